@@ -1,8 +1,12 @@
 import asyncio
+import logging
+
+from . import startup  # первым: засекает время старта процесса до тяжёлых импортов
 
 from .bot import run
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    startup.mark("импорты")
     asyncio.run(run())
-
@@ -1,10 +1,12 @@
 import json
 import secrets
+import threading
 from dataclasses import dataclass
 from typing import Any
 
 from .constants import DATA_DIR
 from .context import get_app_config
+from .store_io import JsonStore
 
 
 AUTH_PATH = DATA_DIR / "auth.json"
@@ -37,10 +39,15 @@ def _save_raw(data: dict[str, Any]) -> None:
     # Гарантируем наличие директории и не скрываем ошибки записи —
     # иначе изменения (регистрация, удаление) могут тихо не сохраняться.
     AUTH_PATH.parent.mkdir(parents=True, exist_ok=True)
-    AUTH_PATH.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    # Атомарно (временный файл + replace): load_auth вызывается и из потоков, и не должен увидеть файл наполовину записанным.
+    text = json.dumps(data, ensure_ascii=False, indent=2)
+    tmp_path = AUTH_PATH.with_name(f"{AUTH_PATH.name}.{threading.get_ident()}.tmp")
+    tmp_path.write_text(text, encoding="utf-8")
+    tmp_path.replace(AUTH_PATH)
 
 
 def load_auth() -> AuthData:
+    """Читает auth.json, ничего не записывая (чтение идёт без блокировки файла; нормализация — normalize_auth)."""
     data = _load_raw()
     users = {int(x) for x in data.get("users", []) if isinstance(x, int) or isinstance(x, str)}
     admins = {int(x) for x in data.get("admins", []) if isinstance(x, int) or isinstance(x, str)}
@@ -74,16 +81,6 @@ def load_auth() -> AuthData:
                 continue
             invites[k] = str(v)
 
-    # нормализуем и сохраняем
-    data.setdefault("users", list(users))
-    data.setdefault("admins", list(admins))
-    data["usage_instructions"] = usage_instructions
-    data["usage_video_file_id"] = usage_video_file_id
-    data["description_template"] = description_template
-    data["pending_admin_requests"] = {str(k): v for k, v in pending_admin_requests.items()}
-    data["invites"] = invites
-    _save_raw(data)
-
     return AuthData(
         users=users,
         admins=admins,
@@ -108,18 +105,32 @@ def save_auth(auth: AuthData) -> None:
     _save_raw(data)
 
 
-def get_role(user_id: int) -> str:
+# Асинхронный API: файл читается и пишется в пуле хранилищ, изменения одного прохода цикла событий
+# записываются одним сохранением (см. store_io.JsonStore). Синхронные load_auth/save_auth — только для пула.
+_STORE: JsonStore[AuthData] = JsonStore(AUTH_PATH, load_auth, save_auth)
+
+
+async def normalize_auth() -> None:
+    """Переписывает auth.json в нормализованном виде (значения по умолчанию, id строками) — один раз при старте."""
+    await _STORE.update(lambda auth: None)
+
+
+async def read_auth() -> AuthData:
+    return await _STORE.read()
+
+
+async def get_role(user_id: int) -> str:
     """
     Возвращает роль пользователя:
     - "root_admin" — пользователь из ADMIN_IDS (имеет все права)
     - "admin" — администратор (может править инструкции и шаблон описания)
     - "user" — обычный пользователь (может генерировать карточки)
     - "guest" — не зарегистрирован (бот отвечает «Это служебный бот»)
+    Root-админы определяются без чтения auth.json.
     """
-    cfg = get_app_config()
-    if user_id in cfg.admin_ids:
+    if user_id in get_app_config().admin_ids:
         return "root_admin"
-    auth = load_auth()
+    auth = await _STORE.read()
     if user_id in auth.admins:
         return "admin"
     if user_id in auth.users:
@@ -127,73 +138,76 @@ def get_role(user_id: int) -> str:
     return "guest"
 
 
-def ensure_user_role(user_id: int, as_admin: bool) -> None:
-    auth = load_auth()
-    if as_admin:
-        auth.admins.add(user_id)
+async def ensure_user_role(user_id: int, as_admin: bool) -> None:
+    def mutate(auth: AuthData) -> None:
+        if as_admin:
+            auth.admins.add(user_id)
+            auth.users.discard(user_id)
+        else:
+            auth.users.add(user_id)
+            auth.admins.discard(user_id)
+
+    await _STORE.update(mutate)
+
+
+async def remove_user(user_id: int) -> None:
+    def mutate(auth: AuthData) -> None:
         auth.users.discard(user_id)
-    else:
-        auth.users.add(user_id)
         auth.admins.discard(user_id)
-    save_auth(auth)
+        # также на всякий случай очищаем возможную заявку
+        auth.pending_admin_requests.pop(user_id, None)
+
+    await _STORE.update(mutate)
+
 
+async def update_usage_instructions(text: str) -> None:
+    def mutate(auth: AuthData) -> None:
+        auth.usage_instructions = text.strip()
 
-def remove_user(user_id: int) -> None:
-    auth = load_auth()
-    auth.users.discard(user_id)
-    auth.admins.discard(user_id)
-     # также на всякий случай очищаем возможную заявку
-    auth.pending_admin_requests.pop(user_id, None)
-    save_auth(auth)
+    await _STORE.update(mutate)
 
 
-def update_usage_instructions(text: str) -> None:
-    auth = load_auth()
-    auth.usage_instructions = text.strip()
-    save_auth(auth)
+async def update_usage_video(file_id: str | None) -> None:
+    def mutate(auth: AuthData) -> None:
+        auth.usage_video_file_id = file_id
 
+    await _STORE.update(mutate)
 
-def update_usage_video(file_id: str | None) -> None:
-    auth = load_auth()
-    auth.usage_video_file_id = file_id
-    save_auth(auth)
 
+async def update_description_template(text: str) -> None:
+    def mutate(auth: AuthData) -> None:
+        auth.description_template = text.strip()
 
-def update_description_template(text: str) -> None:
-    auth = load_auth()
-    auth.description_template = text.strip()
-    save_auth(auth)
+    await _STORE.update(mutate)
 
 
-def list_users_and_admins() -> tuple[set[int], set[int]]:
-    auth = load_auth()
+async def list_users_and_admins() -> tuple[set[int], set[int]]:
+    auth = await _STORE.read()
     return auth.users, auth.admins
 
 
-def add_admin_request(user_id: int, username: str) -> None:
-    auth = load_auth()
-    auth.pending_admin_requests[user_id] = username
-    save_auth(auth)
+async def add_admin_request(user_id: int, username: str) -> None:
+    def mutate(auth: AuthData) -> None:
+        auth.pending_admin_requests[user_id] = username
 
+    await _STORE.update(mutate)
 
-def pop_admin_request(user_id: int) -> str | None:
-    auth = load_auth()
-    reason = auth.pending_admin_requests.pop(user_id, None)
-    save_auth(auth)
-    return reason
 
+async def pop_admin_request(user_id: int) -> str | None:
+    return await _STORE.update(lambda auth: auth.pending_admin_requests.pop(user_id, None))
 
-def list_admin_requests() -> dict[int, str]:
-    auth = load_auth()
+
+async def list_admin_requests() -> dict[int, str]:
+    auth = await _STORE.read()
     return dict(auth.pending_admin_requests)
 
 
-def get_all_admin_ids() -> set[int]:
+async def get_all_admin_ids() -> set[int]:
     """
     Возвращает множество ID всех администраторов, включая root‑админов из настроек.
     """
     cfg = get_app_config()
-    auth = load_auth()
+    auth = await _STORE.read()
     return set(cfg.admin_ids) | set(auth.admins)
 
 
@@ -206,35 +220,32 @@ def list_root_admin_ids() -> set[int]:
     return set(cfg.admin_ids)
 
 
-def create_invite(label: str | None = None) -> str:
+async def create_invite(label: str | None = None) -> str:
     """
     Создаёт новый инвайт-токен и сохраняет его.
     Возвращает строковый токен, который можно передать в deep‑link /start <token>.
     """
-    auth = load_auth()
-    # Генерируем токен до тех пор, пока не получим уникальный
-    token = ""
-    while not token or token in auth.invites:
-        token = secrets.token_urlsafe(8)
-    auth.invites[token] = (label or "").strip()
-    save_auth(auth)
-    return token
 
+    def mutate(auth: AuthData) -> str:
+        # Генерируем токен до тех пор, пока не получим уникальный
+        token = ""
+        while not token or token in auth.invites:
+            token = secrets.token_urlsafe(8)
+        auth.invites[token] = (label or "").strip()
+        return token
+
+    return await _STORE.update(mutate)
 
-def list_invites() -> dict[str, str]:
+
+async def list_invites() -> dict[str, str]:
     """Возвращает копию словаря инвайтов token -> label."""
-    auth = load_auth()
+    auth = await _STORE.read()
     return dict(auth.invites)
 
 
-def consume_invite(token: str) -> str | None:
+async def consume_invite(token: str) -> str | None:
     """
     Поглощает (использует один раз) инвайт‑токен.
     Возвращает его подпись либо None, если токена нет.
     """
-    auth = load_auth()
-    label = auth.invites.pop(token, None)
-    if label is not None:
-        save_auth(auth)
-    return label
-
+    return await _STORE.update(lambda auth: auth.invites.pop(token, None))
@@ -1,16 +1,117 @@
+import asyncio
+from pathlib import Path
+
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.base import BaseSession
+from aiogram.client.telegram import SimpleFilesPathWrapper, TelegramAPIServer
 
+from .auth_store import normalize_auth
+from .browser import close_browser
+from .callback_ack import CallbackAnswerGuard, callback_ack_middleware
 from .config import AppConfig
-from .constants import BASE_DIR
-from .context import set_app_config
+from .config_store import watch_config
+from .constants import BASE_DIR, ensure_dirs
+from .context import get_settings, set_app_config
+from .file_id_store import flush_file_ids, load_file_ids
 from .handlers import include_routers
+from .images import LOCAL_MAX_UPLOAD_BYTES, set_upload_limit
+from .job_journal import close_journal
+from .jobs import cleanup_output, drain
+from .loop_watchdog import watch_loop
+from .media_group import album_middleware
+from .metrics import update_metrics_middleware
+from .previews import refresh_template_previews
+from .send_pipeline import SendPipeline
+from .services import resume_pending_jobs
+from .startup import first_update_middleware, mark, warmup
+from .store_io import flush_stores
+from .template_registry import watch_templates
+
+
+def create_bot(app_config: AppConfig, session: BaseSession | None = None, send_pipeline: bool = True) -> Bot:
+    """
+    Bot с общим конвейером отправки. session — своя сессия (например, нагрузочного теста);
+    без неё при заданном BOT_API_URL бот работает через свой сервер Bot API в режиме --local.
+    """
+    if session is None and app_config.bot_api_url:
+        session = _local_api_session(app_config.bot_api_url, app_config.bot_api_dir, app_config.bot_api_local_dir)
+    if session is not None and session.api.is_local:
+        # Файлы читаются с диска сервера, а не по HTTP: лимит Telegram на скачивание (20 МБ) не действует.
+        set_upload_limit(LOCAL_MAX_UPLOAD_BYTES)
+    bot = Bot(token=app_config.bot_token, session=session)
+    # Второй ответ на то же нажатие (после автоматического, см. callback_ack) не уходит в Telegram.
+    bot.session.middleware(CallbackAnswerGuard())
+    if send_pipeline:
+        # Все исходящие сообщения — через лимиты Telegram, с повторами при 429 и сбоях сети.
+        bot.session.middleware(SendPipeline())
+    return bot
+
+
+def _local_api_session(url: str, server_dir: Path, local_dir: Path | None) -> AiohttpSession:
+    api = TelegramAPIServer.from_base(
+        url,
+        is_local=True,
+        # Сервер отдаёт в getFile абсолютный путь в своём --dir; у бота этот каталог может быть смонтирован в другое место.
+        wrap_local_file=SimpleFilesPathWrapper(server_dir, local_dir or server_dir),
+    )
+    return AiohttpSession(api=api)
+
+
+def create_dispatcher(bot: Bot) -> Dispatcher:
+    """Dispatcher со всеми роутерами и фоновыми задачами запуска/остановки (используется и нагрузочным тестом)."""
+    dp = Dispatcher()
+    include_routers(dp)
+    dp.update.outer_middleware(first_update_middleware)
+    # Время обработки апдейтов и ошибки хендлеров — для панели «Состояние бота».
+    dp.update.outer_middleware(update_metrics_middleware)
+    # На нажатия кнопок отвечаем сразу (не дольше ACK_BUDGET), не дожидаясь, пока хендлер прочитает хранилища.
+    dp.callback_query.outer_middleware(callback_ack_middleware)
+    # Альбом фото — одним вызовом хендлера со всеми частями по порядку.
+    dp.message.outer_middleware(album_middleware)
+    background: list[asyncio.Task] = []
+
+    async def on_startup() -> None:
+        mark("polling запущен")
+        # auth.json в нормализованном виде — один раз, под блокировкой файла (чтение его не переписывает).
+        background.append(asyncio.create_task(normalize_auth()))
+        # file_id уже загруженных файлов (карточки, превью) — чтобы не загружать их заново.
+        background.append(asyncio.create_task(load_file_ids()))
+        # Лаг цикла событий и синхронные вызовы, которые его блокируют (лог, панель «Состояние бота»).
+        background.append(asyncio.create_task(watch_loop()))
+        # Правки config.json на диске подхватываются без перезапуска.
+        background.append(asyncio.create_task(watch_config()))
+        # Новые и изменённые файлы app/templates/template_<id>.svg — тоже.
+        background.append(asyncio.create_task(watch_templates()))
+        # Браузер, шрифты, шаблоны и логотип готовятся в фоне, пока бот уже отвечает на сообщения.
+        background.append(asyncio.create_task(warmup(browser=get_settings().warmup)))
+        # Превью шаблонов для меню «Создать карточку» — рендерятся, только если шаблон или пример изменились.
+        background.append(asyncio.create_task(refresh_template_previews(bot)))
+        # Карточки, не успевшие собраться до прошлой остановки.
+        background.append(asyncio.create_task(resume_pending_jobs(bot)))
+
+    async def on_shutdown() -> None:
+        # SIGTERM/SIGINT: aiogram уже остановил получение апдейтов, дожидаемся начатых карточек.
+        await drain()
+        for task in background:
+            task.cancel()
+        # Отложенные записи хранилищ (auth.json, logos.json, examples.json) — до выхода процесса.
+        await flush_stores()
+        await flush_file_ids()
+        await close_browser()
+        close_journal()
+
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
 
 
 async def run() -> None:
+    ensure_dirs()
+    # Файлы карточек, брошенные при аварийной остановке прошлого процесса.
+    cleanup_output()
     app_config = AppConfig.load(BASE_DIR / "config.json", BASE_DIR / ".env")
     set_app_config(app_config)
-    bot = Bot(token=app_config.bot_token)
-    dp = Dispatcher()
-    include_routers(dp)
+    bot = create_bot(app_config)
+    dp = create_dispatcher(bot)
     await dp.start_polling(bot)
-
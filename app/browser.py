@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from typing import Any
+
+
+logger = logging.getLogger(__name__)
+
+# Один Chromium на процесс: запуск браузера — самая долгая часть первого рендера,
+# поэтому он поднимается один раз (при прогреве или первой карточке) и переиспользуется.
+_PLAYWRIGHT: Any = None
+_BROWSER: Any = None
+_LOCK: asyncio.Lock | None = None
+
+
+def _get_lock() -> asyncio.Lock:
+    global _LOCK
+    if _LOCK is None:
+        _LOCK = asyncio.Lock()
+    return _LOCK
+
+
+async def get_browser() -> Any:
+    """Возвращает общий Chromium, запуская его при первом обращении (или заново, если процесс браузера упал)."""
+    global _PLAYWRIGHT, _BROWSER
+    if _BROWSER is not None and _BROWSER.is_connected():
+        return _BROWSER
+    async with _get_lock():
+        if _BROWSER is not None and _BROWSER.is_connected():
+            return _BROWSER
+        # Playwright импортируется только когда нужен браузер: это ускоряет старт процесса бота.
+        from playwright.async_api import async_playwright
+
+        if _PLAYWRIGHT is None:
+            _PLAYWRIGHT = await async_playwright().start()
+        _BROWSER = await _PLAYWRIGHT.chromium.launch()
+        logger.info("Chromium запущен")
+        return _BROWSER
+
+
+def is_browser_running() -> bool:
+    return _BROWSER is not None and _BROWSER.is_connected()
+
+
+async def close_browser() -> None:
+    """Закрывает общий Chromium и Playwright (при остановке бота)."""
+    global _PLAYWRIGHT, _BROWSER
+    async with _get_lock():
+        browser, playwright = _BROWSER, _PLAYWRIGHT
+        _BROWSER = None
+        _PLAYWRIGHT = None
+        if browser is not None:
+            try:
+                await browser.close()
+            except Exception:  # noqa: BLE001
+                logger.exception("Не удалось закрыть Chromium")
+        if playwright is not None:
+            await playwright.stop()
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramAPIError
+from aiogram.methods import AnswerCallbackQuery, TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiogram.types import CallbackQuery, TelegramObject
+
+
+logger = logging.getLogger(__name__)
+
+# Сколько хендлер может сам ответить на нажатие (своим текстом или alert), прежде чем ответит middleware.
+# Дальше кнопка перестаёт «крутиться» сразу, а хендлер спокойно дорабатывает.
+ACK_BUDGET = 0.15
+# Сколько помнить id отвеченных нажатий (Telegram принимает ответ в течение ~15 с).
+_ANSWERED_TTL = 60.0
+
+# id нажатия -> (время ответа, чат). Общий для dispatcher-middleware и middleware запросов бота.
+_ANSWERED: dict[str, tuple[float, int | None]] = {}
+# id нажатия -> чат, пока нажатие обрабатывается.
+_PENDING: dict[str, int | None] = {}
+# id нажатия -> ответ, который сейчас отправляется (следующий ответ ждёт его результата).
+_INFLIGHT: dict[str, asyncio.Future[None]] = {}
+# Запущенные таймером автоответы: цикл событий хранит на задачи только слабые ссылки.
+_TASKS: set[asyncio.Task] = set()
+
+
+def _prune(now: float) -> None:
+    for query_id in [k for k, (ts, _) in _ANSWERED.items() if now - ts > _ANSWERED_TTL]:
+        del _ANSWERED[query_id]
+
+
+async def _auto_answer(bot: Bot, query_id: str) -> None:
+    if query_id in _ANSWERED:
+        return
+    try:
+        await bot.answer_callback_query(query_id)
+    except TelegramAPIError as exc:
+        # Нажатие могло устареть (бот был перегружен или перезапускался) — это не ошибка хендлера.
+        logger.debug("Не удалось ответить на нажатие %s: %s", query_id, exc)
+
+
+async def callback_ack_middleware(
+    handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+    event: TelegramObject,
+    data: dict[str, Any],
+) -> Any:
+    """
+    Outer-middleware для callback_query (dp.callback_query.outer_middleware): если хендлер не ответил
+    на нажатие за ACK_BUDGET, отвечает пустым ответом сам — клиент сразу убирает «часики» с кнопки,
+    а тяжёлая часть хендлера (чтение хранилищ, рендер) выполняется уже после этого.
+    """
+    if not isinstance(event, CallbackQuery):
+        return await handler(event, data)
+    bot: Bot = data["bot"]
+    chat_id = event.message.chat.id if event.message else None
+    _PENDING[event.id] = chat_id
+
+    def start_auto_answer() -> None:
+        task = asyncio.create_task(_auto_answer(bot, event.id))
+        _TASKS.add(task)
+        task.add_done_callback(_TASKS.discard)
+
+    timer = asyncio.get_running_loop().call_later(ACK_BUDGET, start_auto_answer)
+    try:
+        return await handler(event, data)
+    finally:
+        timer.cancel()
+        _PENDING.pop(event.id, None)
+        if event.id not in _ANSWERED:
+            # Хендлер закончил, так и не ответив (или нажатие вообще не обработано), — тоже гасим «часики».
+            await _auto_answer(bot, event.id)
+
+
+class CallbackAnswerGuard(BaseRequestMiddleware):
+    """
+    Middleware запросов бота: не даёт ответить на одно нажатие дважды (второй ответ Telegram отклоняет).
+    Если хендлер ответил с текстом позже автоматического ответа (alert или всплывающая подсказка вроде
+    «Карточка уже отправлена.»), текст уходит обычным сообщением, чтобы пользователь его всё равно увидел.
+    """
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Any,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if not isinstance(method, AnswerCallbackQuery):
+            return await make_request(bot, method)
+        now = time.monotonic()
+        _prune(now)
+        query_id = method.callback_query_id
+        inflight = _INFLIGHT.get(query_id)
+        if inflight is not None:
+            await asyncio.shield(inflight)
+        answered = _ANSWERED.get(query_id)
+        if answered is None:
+            done = _INFLIGHT[query_id] = asyncio.get_running_loop().create_future()
+            try:
+                response = await make_request(bot, method)
+                # Отвеченным нажатие считается только после успешного ответа: если он не прошёл,
+                # следующий ответ (например, alert хендлера) уходит как обычно.
+                _ANSWERED[query_id] = (now, _PENDING.get(query_id))
+                return response
+            finally:
+                del _INFLIGHT[query_id]
+                done.set_result(None)
+        chat_id = answered[1]
+        if method.text and chat_id is not None:
+            await bot.send_message(chat_id, method.text)
+        return Response[bool](ok=True, result=True)  # type: ignore[return-value]
@@ -1,23 +1,152 @@
+import copy
 import json
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any
 
 from dotenv import load_dotenv
 
 
+# Режимы передачи картинок в Chromium (см. rendering.CardAssets).
+EMBED_MODES = ("route", "data_url")
+# Квоты на генерацию карточек по ролям, если в config.json нет раздела quotas: (карточек в час, подряд без паузы).
+# root_admin не ограничивается.
+DEFAULT_QUOTAS: dict[str, tuple[float, int]] = {"user": (30.0, 5), "admin": (120.0, 10)}
+QUOTA_ROLES = tuple(DEFAULT_QUOTAS)
+# Рабочий каталог (--dir) официального образа telegram-bot-api.
+BOT_API_DEFAULT_DIR = "/var/lib/telegram-bot-api"
+
+
+class ConfigError(ValueError):
+    """config.json не прошёл проверку. Текст можно показывать администратору."""
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Проверенный снимок config.json. Создаётся один раз на версию конфига и дальше не меняется:
+    рендер берёт готовые значения (размеры, CSS), а кэши могут опираться на version.
+    raw — копия исходного словаря только для чтения; для правки делайте deepcopy и apply_config.
+    """
+
+    version: int
+    raw: dict[str, Any]
+    width: int
+    height: int
+    embed_images: str
+    send_variants: bool
+    warmup: bool
+    mtime_ns: int = 0
+    # Квоты генерации: роль -> (карточек в час, подряд без паузы) и персональные квоты по id пользователя.
+    # 0 карточек в час — без ограничения.
+    quotas: dict[str, tuple[float, int]] = field(default_factory=lambda: dict(DEFAULT_QUOTAS))
+    user_quotas: dict[int, tuple[float, int]] = field(default_factory=dict)
+
+
+def _require_int(section: dict[str, Any], key: str, where: str, minimum: int = 0) -> int:
+    try:
+        value = int(section[key])
+    except KeyError as exc:
+        raise ConfigError(f"Не задан параметр {where}.{key}") from exc
+    except (TypeError, ValueError) as exc:
+        raise ConfigError(f"{where}.{key}: ожидалось целое число") from exc
+    if value < minimum:
+        raise ConfigError(f"{where}.{key}: значение должно быть не меньше {minimum}")
+    return value
+
+
+def _parse_quota(value: Any, where: str) -> tuple[float, int]:
+    if not isinstance(value, dict):
+        raise ConfigError(f"{where}: ожидался объект с per_hour и burst")
+    per_hour = value.get("per_hour")
+    if isinstance(per_hour, bool) or not isinstance(per_hour, (int, float)) or per_hour < 0:
+        raise ConfigError(f"{where}.per_hour: ожидалось число не меньше 0")
+    return float(per_hour), _require_int(value, "burst", where, minimum=1)
+
+
+def _parse_quotas(raw: dict[str, Any]) -> tuple[dict[str, tuple[float, int]], dict[int, tuple[float, int]]]:
+    section = raw.get("quotas", {})
+    if not isinstance(section, dict):
+        raise ConfigError("quotas: ожидался объект")
+    quotas = dict(DEFAULT_QUOTAS)
+    for role in QUOTA_ROLES:
+        if role in section:
+            quotas[role] = _parse_quota(section[role], f"quotas.{role}")
+    users_cfg = section.get("users", {})
+    if not isinstance(users_cfg, dict):
+        raise ConfigError("quotas.users: ожидался объект {id пользователя: квота}")
+    user_quotas: dict[int, tuple[float, int]] = {}
+    for key, value in users_cfg.items():
+        try:
+            user_id = int(key)
+        except ValueError as exc:
+            raise ConfigError(f"quotas.users: {key!r} — не id пользователя") from exc
+        user_quotas[user_id] = _parse_quota(value, f"quotas.users.{key}")
+    return quotas, user_quotas
+
+
+def build_settings(raw: dict[str, Any], version: int, mtime_ns: int = 0) -> Settings:
+    """Проверяет словарь конфига и собирает из него снимок. Бросает ConfigError при ошибке."""
+    raw = copy.deepcopy(raw)
+    output_cfg = raw.get("output")
+    cards_cfg = raw.get("cards")
+    if not isinstance(output_cfg, dict) or not isinstance(cards_cfg, dict):
+        raise ConfigError("В конфиге должны быть разделы output и cards")
+    width = _require_int(output_cfg, "width", "output", minimum=1)
+    height = _require_int(output_cfg, "height", "output", minimum=1)
+    ratio = output_cfg.get("left_column_ratio", 0.5)
+    if not isinstance(ratio, (int, float)) or not 0 < float(ratio) < 1:
+        raise ConfigError("output.left_column_ratio: ожидалось число от 0 до 1")
+
+    embed_images = str(raw.get("render", {}).get("embed_images", "route"))
+    if embed_images not in EMBED_MODES:
+        raise ConfigError(f"render.embed_images: допустимо {', '.join(EMBED_MODES)}")
+    warmup = raw.get("render", {}).get("warmup", True)
+    if not isinstance(warmup, bool):
+        raise ConfigError("render.warmup: ожидалось true/false")
+    send_variants = raw.get("export", {}).get("send_variants", True)
+    if not isinstance(send_variants, bool):
+        raise ConfigError("export.send_variants: ожидалось true/false")
+    quotas, user_quotas = _parse_quotas(raw)
+
+    return Settings(
+        version=version,
+        raw=raw,
+        width=width,
+        height=height,
+        embed_images=embed_images,
+        send_variants=send_variants,
+        warmup=warmup,
+        mtime_ns=mtime_ns,
+        quotas=quotas,
+        user_quotas=user_quotas,
+    )
+
+
 @dataclass
 class AppConfig:
     bot_token: str
-    raw: dict[str, Any]
     admin_ids: set[int]
+    path: Path
+    # Текущий снимок конфига; заменяется целиком (context.swap_settings), никогда не правится на месте.
+    settings: Settings = field(repr=False)
+    # Свой сервер Bot API в режиме --local (BOT_API_URL): файлы читаются с общего тома, а не качаются по HTTP.
+    # bot_api_dir — каталог --dir на сервере, bot_api_local_dir — он же, как его видит бот (None — тот же путь).
+    bot_api_url: str | None = None
+    bot_api_dir: Path = Path(BOT_API_DEFAULT_DIR)
+    bot_api_local_dir: Path | None = None
+
+    @property
+    def raw(self) -> dict[str, Any]:
+        return self.settings.raw
 
     @staticmethod
     def load(path: Path, env_path: Path | None = None) -> "AppConfig":
         if env_path and env_path.exists():
             load_dotenv(env_path)
         data = json.loads(path.read_text(encoding="utf-8"))
+        settings = build_settings(data, version=1, mtime_ns=path.stat().st_mtime_ns)
         token = os.getenv("BOT_TOKEN", "").strip()
         if not token:
             raise ValueError("Set BOT_TOKEN in .env (see .env.example).")
@@ -32,5 +161,13 @@ class AppConfig:
                     admin_ids.add(int(part))
                 except ValueError:
                     continue
-        return AppConfig(bot_token=token, raw=data, admin_ids=admin_ids)
-
+        bot_api_local_dir = os.getenv("BOT_API_LOCAL_DIR", "").strip()
+        return AppConfig(
+            bot_token=token,
+            admin_ids=admin_ids,
+            path=path,
+            settings=settings,
+            bot_api_url=os.getenv("BOT_API_URL", "").strip() or None,
+            bot_api_dir=Path(os.getenv("BOT_API_DIR", "").strip() or BOT_API_DEFAULT_DIR),
+            bot_api_local_dir=Path(bot_api_local_dir) if bot_api_local_dir else None,
+        )
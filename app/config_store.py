@@ -1,7 +1,17 @@
+import asyncio
 import json
+import logging
+import os
 from typing import Any
 
-from .constants import BASE_DIR
+from .config import Settings, build_settings
+from .context import get_app_config, get_settings, swap_settings
+from .store_io import file_lock, run_io
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверять mtime config.json на внешние правки (секунды).
+CONFIG_WATCH_INTERVAL = 2.0
 
 
 def convert_config_value(raw_value: str, old_value: Any) -> Any:
@@ -20,9 +30,69 @@ def convert_config_value(raw_value: str, old_value: Any) -> Any:
     return value
 
 
-def save_config(raw: dict[str, Any]) -> None:
-    (BASE_DIR / "config.json").write_text(
-        json.dumps(raw, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
+def save_config(raw: dict[str, Any]) -> int:
+    """
+    Записывает config.json на месте и возвращает новый mtime_ns. Не через временный файл и replace:
+    в docker-compose config.json смонтирован отдельным файлом, и подменить его нельзя (EBUSY).
+    Вызывается под file_lock(config.json) — проверка внешних правок не видит файл недописанным.
+    """
+    path = get_app_config().path
+    text = json.dumps(raw, ensure_ascii=False, indent=2)
+    with path.open("r+" if path.exists() else "w", encoding="utf-8") as file:
+        file.seek(0)
+        file.truncate()
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    return path.stat().st_mtime_ns
+
+
+async def apply_config(raw: dict[str, Any]) -> Settings:
+    """
+    Проверяет новый словарь конфига, сохраняет его и подменяет текущий снимок.
+    При ошибке бросает ConfigError, а файл и действующий конфиг не меняются.
+    Запись идёт в пуле хранилищ под блокировкой файла: одновременные правки и проверка внешних изменений
+    выполняются по очереди, и ни одна версия не теряется.
+    """
+    async with file_lock(get_app_config().path):
+        settings = build_settings(raw, version=get_settings().version + 1)
+        mtime_ns = await run_io(save_config, settings.raw)
+        settings = build_settings(settings.raw, version=settings.version, mtime_ns=mtime_ns)
+        swap_settings(settings)
+    return settings
+
+
+def reload_config_if_changed() -> Settings | None:
+    """Перечитывает config.json, если файл изменили снаружи. Неверный файл логируется, старый снимок остаётся."""
+    path = get_app_config().path
+    current = get_settings()
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except OSError:
+        return None
+    if mtime_ns == current.mtime_ns:
+        return None
+    try:
+        raw = json.loads(path.read_text(encoding="utf-8"))
+        settings = build_settings(raw, version=current.version + 1, mtime_ns=mtime_ns)
+    except (OSError, ValueError) as exc:
+        # json.JSONDecodeError и ConfigError — тоже ValueError.
+        logger.error("config.json не применён: %s", exc)
+        # Запоминаем mtime, чтобы не повторять ошибку в логе на каждой проверке.
+        swap_settings(build_settings(current.raw, version=current.version, mtime_ns=mtime_ns))
+        return None
+    swap_settings(settings)
+    logger.info("config.json перечитан, версия %s", settings.version)
+    return settings
+
+
+async def watch_config(interval: float = CONFIG_WATCH_INTERVAL) -> None:
+    """Фоновая задача: следит за mtime config.json и подхватывает внешние правки без перезапуска бота."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with file_lock(get_app_config().path):
+                await run_io(reload_config_if_changed)
+        except Exception:  # noqa: BLE001
+            logger.exception("Ошибка при проверке config.json")
 
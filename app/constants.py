@@ -1,22 +1,21 @@
+import os
 from pathlib import Path
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
-OUTPUT_DIR = BASE_DIR / "output"
-OUTPUT_DIR.mkdir(exist_ok=True)
+# Каталоги можно переопределить переменными окружения (нагрузочный тест работает во временном каталоге).
+OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR") or BASE_DIR / "output")
 # Каталог для данных, переживающих перезапуск (примеры — examples.json). В Docker монтируется как volume.
-DATA_DIR = BASE_DIR / "data"
-DATA_DIR.mkdir(exist_ok=True)
-# Основной шаблон SVG карточки
-SVG_TEMPLATE_PATH = Path(__file__).resolve().parent / "card_template.svg"
-# Альтернативные шаблоны SVG (варианты макета)
-SVG_TEMPLATE2_PATH = Path(__file__).resolve().parent / "card_template2.svg"
-SVG_TEMPLATE3_PATH = Path(__file__).resolve().parent / "card_template3.svg"
-SVG_TEMPLATES: dict[int, Path] = {
-    1: SVG_TEMPLATE_PATH,
-    2: SVG_TEMPLATE2_PATH,
-    3: SVG_TEMPLATE3_PATH,
-}
+DATA_DIR = Path(os.getenv("DATA_DIR") or BASE_DIR / "data")
+# SVG-шаблоны карточек: templates/template_<id>.svg, слоты размечены атрибутами data-slot (см. template_registry).
+TEMPLATES_DIR = Path(__file__).resolve().parent / "templates"
+# Шрифты карточки (MuseoSansVkusVill): подключаются при рендере и используются для подбора кегля.
+FONTS_DIR = Path(__file__).resolve().parent / "fonts"
 # Логотип по умолчанию (слот «Дополнительный» в шаблоне)
 LOGO_DEFAULT_PATH = Path(__file__).resolve().parent / "logo_defoult.png"
 
+
+def ensure_dirs() -> None:
+    """Создаёт рабочие каталоги. Вызывается при старте бота, а не при импорте модуля."""
+    OUTPUT_DIR.mkdir(exist_ok=True)
+    DATA_DIR.mkdir(exist_ok=True)
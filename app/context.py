@@ -1,4 +1,4 @@
-from .config import AppConfig
+from .config import AppConfig, Settings
 
 
 APP_CONFIG: AppConfig | None = None
@@ -14,3 +14,12 @@ def get_app_config() -> AppConfig:
         raise RuntimeError("Config not loaded")
     return APP_CONFIG
 
+
+def get_settings() -> Settings:
+    """Текущий снимок конфига. Берите его один раз в начале операции, чтобы вся операция видела одну версию."""
+    return get_app_config().settings
+
+
+def swap_settings(settings: Settings) -> None:
+    """Атомарно подменяет снимок: уже начатые рендеры дорабатывают со старым, новые берут новый."""
+    get_app_config().settings = settings
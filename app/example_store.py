@@ -1,7 +1,9 @@
 import json
-from typing import Any
+import threading
+from typing import Any, Callable
 
 from .constants import DATA_DIR
+from .store_io import JsonStore
 
 
 EXAMPLES_PATH = DATA_DIR / "examples.json"
@@ -21,11 +23,32 @@ def load_examples() -> dict[str, Any]:
     return {}
 
 
-def save_examples(data: dict[str, Any]) -> None:
-    """Сохраняет данные примера в JSON, чтобы переживали перезапуск бота/контейнера."""
-    try:
-        EXAMPLES_PATH.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    except Exception:
-        # Логирование не обязательно; пропускаем сбой сохранения, чтобы не ломать бота.
-        pass
+def _save_examples(data: dict[str, Any]) -> None:
+    # Ошибку записи не скрываем: её получает вызвавший update_examples, а не «успешное» сохранение.
+    EXAMPLES_PATH.parent.mkdir(parents=True, exist_ok=True)
+    # Атомарно: файл читается из пула хранилищ без блокировки и не должен быть виден наполовину записанным.
+    tmp_path = EXAMPLES_PATH.with_name(f"{EXAMPLES_PATH.name}.{threading.get_ident()}.tmp")
+    tmp_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp_path.replace(EXAMPLES_PATH)
+
+
+# Асинхронный API (см. store_io.JsonStore); синхронные load_examples/_save_examples — только для пула хранилищ.
+_STORE: JsonStore[dict[str, Any]] = JsonStore(EXAMPLES_PATH, load_examples, _save_examples)
+
+
+async def read_examples() -> dict[str, Any]:
+    return await _STORE.read()
+
+
+async def update_examples(mutate: Callable[[dict[str, Any]], None]) -> None:
+    """
+    Изменяет сохранённый пример (чтение-изменение-запись под блокировкой файла), чтобы данные
+    переживали перезапуск бота/контейнера. Два админа, правящие пример одновременно, не затирают
+    изменения друг друга, пока каждый меняет только свои поля.
+    """
+    await _STORE.update(mutate)
+
 
+async def save_example_fields(**fields: Any) -> None:
+    """Сохраняет в примере только переданные поля, остальные остаются как в файле."""
+    await update_examples(lambda example: example.update(fields))
@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Any
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, InputMediaDocument, InputMediaPhoto, Message
+
+from .constants import DATA_DIR
+from .metrics import cache_hit
+from .store_io import run_io
+
+
+logger = logging.getLogger(__name__)
+
+# file_id, которые Telegram вернул после первой загрузки файла: ключ — "<вид>:<sha256 содержимого>".
+FILE_IDS_PATH = DATA_DIR / "file_ids.json"
+# Сколько записей хранить; при переполнении выбрасываются давно не использованные.
+MAX_ENTRIES = 5000
+# Изменения реестра копятся в памяти и пишутся на диск одним файлом не чаще раза в SAVE_DELAY секунд.
+SAVE_DELAY = 5.0
+
+# key -> {"file_id": ..., "used": unix time}. Работает только из цикла событий; с диска читается при старте
+# (load_file_ids), до этого реестр просто пуст — файлы загружаются байтами.
+_CACHE: dict[str, dict[str, Any]] = {}
+_SAVE_TASK: asyncio.Task | None = None
+
+
+def content_key(kind: str, data: bytes) -> str:
+    """Ключ реестра: вид отправки (photo/document) + хэш содержимого. Один файл фото и документом — разные file_id."""
+    return f"{kind}:{hashlib.sha256(data).hexdigest()}"
+
+
+def _read() -> dict[str, dict[str, Any]]:
+    if not FILE_IDS_PATH.exists():
+        return {}
+    try:
+        data = json.loads(FILE_IDS_PATH.read_text(encoding="utf-8"))
+    except Exception:  # noqa: BLE001
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {k: v for k, v in data.items() if isinstance(v, dict) and isinstance(v.get("file_id"), str)}
+
+
+def _write(entries: dict[str, dict[str, Any]]) -> None:
+    tmp_path = FILE_IDS_PATH.with_name(FILE_IDS_PATH.name + ".tmp")
+    tmp_path.write_text(json.dumps(entries, ensure_ascii=False), encoding="utf-8")
+    tmp_path.replace(FILE_IDS_PATH)
+
+
+async def load_file_ids() -> None:
+    """Читает реестр с диска (при старте бота). Записи, появившиеся до окончания чтения, не затираются."""
+    global _CACHE
+    _CACHE = {**await run_io(_read), **_CACHE}
+
+
+async def _save_now() -> None:
+    if len(_CACHE) > MAX_ENTRIES:
+        for key in sorted(_CACHE, key=lambda k: _CACHE[k].get("used", 0))[: len(_CACHE) - MAX_ENTRIES]:
+            del _CACHE[key]
+    # Снимок — в цикле событий, запись — в пуле хранилищ.
+    snapshot = {key: dict(entry) for key, entry in _CACHE.items()}
+    try:
+        await run_io(_write, snapshot)
+    except Exception:  # noqa: BLE001
+        # Реестр — только оптимизация: без него файл просто загрузится заново.
+        logger.warning("Не удалось сохранить %s", FILE_IDS_PATH.name, exc_info=True)
+
+
+async def _save_later() -> None:
+    global _SAVE_TASK
+    try:
+        await asyncio.sleep(SAVE_DELAY)
+    finally:
+        _SAVE_TASK = None
+    await _save_now()
+
+
+def _schedule_save() -> None:
+    global _SAVE_TASK
+    if _SAVE_TASK is None:
+        _SAVE_TASK = asyncio.get_running_loop().create_task(_save_later())
+
+
+async def flush_file_ids() -> None:
+    """Записывает отложенные изменения реестра сразу (при остановке бота)."""
+    global _SAVE_TASK
+    if _SAVE_TASK is None:
+        return
+    _SAVE_TASK.cancel()
+    _SAVE_TASK = None
+    await _save_now()
+
+
+def get_file_id(key: str) -> str | None:
+    entry = _CACHE.get(key)
+    cache_hit("file_id", entry is not None)
+    if entry is None:
+        return None
+    entry["used"] = time.time()
+    return str(entry["file_id"])
+
+
+def remember_file_id(key: str, file_id: str) -> None:
+    if _CACHE.get(key, {}).get("file_id") == file_id:
+        return
+    _CACHE[key] = {"file_id": file_id, "used": time.time()}
+    _schedule_save()
+
+
+def forget_file_id(key: str) -> None:
+    if _CACHE.pop(key, None) is not None:
+        _schedule_save()
+
+
+async def send_photo_once(bot: Bot, chat_id: int, data: bytes, filename: str, caption: str | None = None) -> Message:
+    """Отправляет фото: по сохранённому file_id, если такое содержимое уже загружалось, иначе байтами."""
+    key = content_key("photo", data)
+    file_id = get_file_id(key)
+    if file_id is not None:
+        try:
+            return await bot.send_photo(chat_id, file_id, caption=caption)
+        except TelegramBadRequest:
+            # file_id устарел или от другого бота — загружаем заново.
+            forget_file_id(key)
+    message = await bot.send_photo(chat_id, BufferedInputFile(data, filename=filename), caption=caption)
+    if message.photo:
+        remember_file_id(key, message.photo[-1].file_id)
+    return message
+
+
+async def send_document_once(bot: Bot, chat_id: int, data: bytes, filename: str, caption: str | None = None) -> Message:
+    """То же, что send_photo_once, но документом (без пережатия Telegram)."""
+    key = content_key("document", data)
+    file_id = get_file_id(key)
+    if file_id is not None:
+        try:
+            return await bot.send_document(chat_id, file_id, caption=caption)
+        except TelegramBadRequest:
+            forget_file_id(key)
+    message = await bot.send_document(chat_id, BufferedInputFile(data, filename=filename), caption=caption)
+    if message.document:
+        remember_file_id(key, message.document.file_id)
+    return message
+
+
+async def send_album_once(
+    bot: Bot,
+    chat_id: int,
+    files: list[tuple[bytes, str]],
+    kind: str = "document",
+    captions: list[str | None] | None = None,
+) -> list[Message]:
+    """
+    Альбом (2–10 файлов) фото или документов: уже загруженные файлы идут по file_id, новые — байтами.
+    captions — подписи по порядку файлов (для альбома документов Telegram показывает подпись последнего).
+    """
+    media_type = InputMediaPhoto if kind == "photo" else InputMediaDocument
+    keys = [content_key(kind, data) for data, _ in files]
+    captions = captions or [None] * len(files)
+
+    def build(use_cache: bool) -> list[InputMediaPhoto | InputMediaDocument]:
+        # InputMedia* неизменяемые, поэтому подпись задаётся при создании.
+        return [
+            media_type(
+                media=(get_file_id(key) if use_cache else None) or BufferedInputFile(data, filename=filename),
+                caption=caption,
+            )
+            for key, (data, filename), caption in zip(keys, files, captions)
+        ]
+
+    try:
+        messages = await bot.send_media_group(chat_id, build(use_cache=True))
+    except TelegramBadRequest:
+        for key in keys:
+            forget_file_id(key)
+        messages = await bot.send_media_group(chat_id, build(use_cache=False))
+    for key, message in zip(keys, messages):
+        if kind == "photo" and message.photo:
+            remember_file_id(key, message.photo[-1].file_id)
+        elif message.document:
+            remember_file_id(key, message.document.file_id)
+    return messages
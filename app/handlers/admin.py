@@ -1,4 +1,13 @@
-from aiogram import F, Router
+import asyncio
+import copy
+import logging
+import time
+from datetime import timedelta
+from typing import Any
+
+from aiogram import Bot, F, Router
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
 
@@ -14,26 +23,45 @@ from ..auth_store import (
     pop_admin_request,
     create_invite,
     list_invites,
-    load_auth,
+    read_auth,
 )
-from ..logo_store import load_logos, set_shop_logo
+from ..browser import is_browser_running
+from ..config import ConfigError, QUOTA_ROLES
+from ..config_store import apply_config
+from ..context import get_settings
+from ..images import ImageRejected, check_upload_size
+from ..job_journal import usage_by_user
+from ..jobs import active_jobs
+from ..metrics import process_memory, snapshot
+from ..photo_sizes import remember_photos
+from ..logo_store import read_logos
+from ..loop_watchdog import top_offenders
+from ..profiling import MAX_RUNS as PROFILE_MAX_RUNS, arm, armed, disarm
+from ..quotas import quota_for
+from ..services import store_shop_logo
 from ..states import AdminEditStates, LogoConfigStates
 from ..ui import cancel_keyboard, main_menu_keyboard
 
 
+logger = logging.getLogger(__name__)
+
 router = Router()
 
+# За какой период показывать расход генераций (журнал хранит завершённые задания неделю).
+USAGE_PERIOD = 7 * 24 * 3600
+ROLE_TITLES = {"user": "пользователи", "admin": "администраторы"}
+
 
-def _ensure_min_role(user_id: int, min_role: str) -> bool:
+async def _ensure_min_role(user_id: int, min_role: str) -> bool:
     order = {"guest": 0, "user": 1, "admin": 2, "root_admin": 3}
-    role = get_role(user_id)
+    role = await get_role(user_id)
     return order.get(role, 0) >= order.get(min_role, 0)
 
 
 @router.callback_query(F.data == "menu_usage")
 async def menu_usage(callback: CallbackQuery, state: FSMContext) -> None:
     _ = state
-    auth = load_auth()
+    auth = await read_auth()
     usage = auth.usage_instructions
     video_id = auth.usage_video_file_id
     if video_id:
@@ -51,7 +79,7 @@ async def menu_usage(callback: CallbackQuery, state: FSMContext) -> None:
 async def admin_edit_data(callback: CallbackQuery, state: FSMContext) -> None:
     """Подменю редактирования данных: инструкция, шаблон описания, логотипы."""
     user_id = callback.from_user.id if callback.from_user else 0
-    if not _ensure_min_role(user_id, "admin"):
+    if not await _ensure_min_role(user_id, "admin"):
         await callback.answer("Недостаточно прав.", show_alert=True)
         return
     _ = state
@@ -70,7 +98,7 @@ async def admin_edit_data(callback: CallbackQuery, state: FSMContext) -> None:
 @router.callback_query(F.data == "admin_edit_usage")
 async def admin_edit_usage(callback: CallbackQuery, state: FSMContext) -> None:
     user_id = callback.from_user.id if callback.from_user else 0
-    if not _ensure_min_role(user_id, "admin"):
+    if not await _ensure_min_role(user_id, "admin"):
         await callback.answer("Недостаточно прав.", show_alert=True)
         return
     await callback.message.edit_text(
@@ -89,7 +117,7 @@ async def admin_edit_usage(callback: CallbackQuery, state: FSMContext) -> None:
 @router.callback_query(F.data == "admin_edit_usage_text")
 async def admin_edit_usage_text(callback: CallbackQuery, state: FSMContext) -> None:
     user_id = callback.from_user.id if callback.from_user else 0
-    if not _ensure_min_role(user_id, "admin"):
+    if not await _ensure_min_role(user_id, "admin"):
         await callback.answer("Недостаточно прав.", show_alert=True)
         return
     await state.set_state(AdminEditStates.waiting_for_usage)
@@ -103,7 +131,7 @@ async def admin_edit_usage_text(callback: CallbackQuery, state: FSMContext) -> N
 @router.callback_query(F.data == "admin_edit_usage_video")
 async def admin_edit_usage_video(callback: CallbackQuery, state: FSMContext) -> None:
     user_id = callback.from_user.id if callback.from_user else 0
-    if not _ensure_min_role(user_id, "admin"):
+    if not await _ensure_min_role(user_id, "admin"):
         await callback.answer("Недостаточно прав.", show_alert=True)
         return
     await state.set_state(AdminEditStates.waiting_for_usage_video)
@@ -118,7 +146,7 @@ async def admin_edit_usage_video(callback: CallbackQuery, state: FSMContext) ->
 @router.callback_query(F.data == "admin_edit_desc_template")
 async def admin_edit_desc_template(callback: CallbackQuery, state: FSMContext) -> None:
     user_id = callback.from_user.id if callback.from_user else 0
-    if not _ensure_min_role(user_id, "admin"):
+    if not await _ensure_min_role(user_id, "admin"):
         await callback.answer("Недостаточно прав.", show_alert=True)
         return
     await state.set_state(AdminEditStates.waiting_for_desc_template)
@@ -133,11 +161,11 @@ async def admin_edit_desc_template(callback: CallbackQuery, state: FSMContext) -
 async def admin_logos(callback: CallbackQuery, state: FSMContext) -> None:
     """Меню конфигуратора логотипов: до трёх магазинов, только для администраторов."""
     user_id = callback.from_user.id if callback.from_user else 0
-    if not _ensure_min_role(user_id, "admin"):
+    if not await _ensure_min_role(user_id, "admin"):
         await callback.answer("Недостаточно прав.", show_alert=True)
         return
     _ = state
-    shops = load_logos()
+    shops = await read_logos()
     rows: list[list[InlineKeyboardButton]] = []
     for shop in shops:
         mark = " ✅" if shop.logo_file_id else ""
@@ -163,7 +191,7 @@ async def admin_logos(callback: CallbackQuery, state: FSMContext) -> None:
 async def admin_logo_shop(callback: CallbackQuery, state: FSMContext) -> None:
     """Выбор конкретного магазина для загрузки логотипа."""
     user_id = callback.from_user.id if callback.from_user else 0
-    if not _ensure_min_role(user_id, "admin"):
+    if not await _ensure_min_role(user_id, "admin"):
         await callback.answer("Недостаточно прав.", show_alert=True)
         return
     parts = (callback.data or "").split(":", 1)
@@ -175,7 +203,7 @@ async def admin_logo_shop(callback: CallbackQuery, state: FSMContext) -> None:
     except ValueError:
         await callback.answer("Некорректный магазин.", show_alert=True)
         return
-    shops = load_logos()
+    shops = await read_logos()
     title = next((s.title for s in shops if s.id == shop_id), f"Магазин {shop_id}")
     await state.set_state(LogoConfigStates.waiting_for_logo)
     await state.update_data(admin_logo_shop_id=shop_id)
@@ -186,8 +214,24 @@ async def admin_logo_shop(callback: CallbackQuery, state: FSMContext) -> None:
     await callback.answer()
 
 
+async def _save_shop_logo(message: Message, state: FSMContext, bot: Bot, shop_id: int, file_id: str) -> None:
+    """Готовит логотип (обрезка, уменьшение под слот) сразу при загрузке и сохраняет его для рендеров."""
+    try:
+        await store_shop_logo(bot, shop_id, file_id)
+    except ImageRejected as exc:
+        await message.answer(str(exc))
+        return
+    except Exception:  # noqa: BLE001
+        logger.exception("Не удалось подготовить логотип магазина %s", shop_id)
+        await message.answer("Не удалось обработать логотип. Попробуйте другой файл PNG/JPG.")
+        return
+    await state.clear()
+    role = await get_role(message.from_user.id if message.from_user else 0)
+    await message.answer("Логотип магазина сохранён.", reply_markup=main_menu_keyboard(role))
+
+
 @router.message(LogoConfigStates.waiting_for_logo, F.photo)
-async def admin_logo_photo(message: Message, state: FSMContext) -> None:
+async def admin_logo_photo(message: Message, state: FSMContext, bot: Bot) -> None:
     """Сохранение логотипа магазина из фото."""
     data = await state.get_data()
     shop_id = int(data.get("admin_logo_shop_id") or 0)
@@ -196,19 +240,16 @@ async def admin_logo_photo(message: Message, state: FSMContext) -> None:
         await state.clear()
         return
     user_id = message.from_user.id if message.from_user else 0
-    if not _ensure_min_role(user_id, "admin"):
+    if not await _ensure_min_role(user_id, "admin"):
         await message.answer("Недостаточно прав для изменения.")
         await state.clear()
         return
-    file_id = message.photo[-1].file_id
-    set_shop_logo(shop_id, file_id)
-    await state.clear()
-    role = get_role(user_id)
-    await message.answer("Логотип магазина сохранён.", reply_markup=main_menu_keyboard(role))
+    logo_file_id = (await asyncio.to_thread(remember_photos, [message.photo]))[0]
+    await _save_shop_logo(message, state, bot, shop_id, logo_file_id)
 
 
 @router.message(LogoConfigStates.waiting_for_logo, F.document)
-async def admin_logo_document(message: Message, state: FSMContext) -> None:
+async def admin_logo_document(message: Message, state: FSMContext, bot: Bot) -> None:
     """Сохранение логотипа магазина из документа-изображения."""
     data = await state.get_data()
     shop_id = int(data.get("admin_logo_shop_id") or 0)
@@ -217,7 +258,7 @@ async def admin_logo_document(message: Message, state: FSMContext) -> None:
         await state.clear()
         return
     user_id = message.from_user.id if message.from_user else 0
-    if not _ensure_min_role(user_id, "admin"):
+    if not await _ensure_min_role(user_id, "admin"):
         await message.answer("Недостаточно прав для изменения.")
         await state.clear()
         return
@@ -225,16 +266,18 @@ async def admin_logo_document(message: Message, state: FSMContext) -> None:
     if not (doc and doc.mime_type and doc.mime_type.startswith("image/")):
         await message.answer("Отправьте файл-изображение (PNG, JPG и т.п.) или выйдите в меню.")
         return
-    set_shop_logo(shop_id, doc.file_id)
-    await state.clear()
-    role = get_role(user_id)
-    await message.answer("Логотип магазина сохранён.", reply_markup=main_menu_keyboard(role))
+    try:
+        check_upload_size(doc.file_size)
+    except ImageRejected as exc:
+        await message.answer(str(exc))
+        return
+    await _save_shop_logo(message, state, bot, shop_id, doc.file_id)
 
 
 @router.message(AdminEditStates.waiting_for_usage, F.text)
 async def admin_usage_input(message: Message, state: FSMContext) -> None:
     user_id = message.from_user.id if message.from_user else 0
-    if not _ensure_min_role(user_id, "admin"):
+    if not await _ensure_min_role(user_id, "admin"):
         await message.answer("Недостаточно прав для изменения.")
         await state.clear()
         return
@@ -242,17 +285,17 @@ async def admin_usage_input(message: Message, state: FSMContext) -> None:
     if not text:
         await message.answer("Текст пустой, отправьте непустое сообщение.")
         return
-    update_usage_instructions(text)
+    await update_usage_instructions(text)
     await message.answer("Инструкция обновлена.")
     await state.clear()
-    role = get_role(user_id)
+    role = await get_role(user_id)
     await message.answer("Главное меню. Выберите действие:", reply_markup=main_menu_keyboard(role))
 
 
 @router.message(AdminEditStates.waiting_for_usage_video, F.video)
 async def admin_usage_video_input(message: Message, state: FSMContext) -> None:
     user_id = message.from_user.id if message.from_user else 0
-    if not _ensure_min_role(user_id, "admin"):
+    if not await _ensure_min_role(user_id, "admin"):
         await message.answer("Недостаточно прав для изменения.")
         await state.clear()
         return
@@ -260,17 +303,17 @@ async def admin_usage_video_input(message: Message, state: FSMContext) -> None:
     if not video:
         await message.answer("Отправьте видеофайл с инструкцией.")
         return
-    update_usage_video(video.file_id)
+    await update_usage_video(video.file_id)
     await message.answer("Видео-инструкция обновлена.")
     await state.clear()
-    role = get_role(user_id)
+    role = await get_role(user_id)
     await message.answer("Главное меню. Выберите действие:", reply_markup=main_menu_keyboard(role))
 
 
 @router.message(AdminEditStates.waiting_for_usage_video, F.document)
 async def admin_usage_video_input_document(message: Message, state: FSMContext) -> None:
     user_id = message.from_user.id if message.from_user else 0
-    if not _ensure_min_role(user_id, "admin"):
+    if not await _ensure_min_role(user_id, "admin"):
         await message.answer("Недостаточно прав для изменения.")
         await state.clear()
         return
@@ -278,10 +321,10 @@ async def admin_usage_video_input_document(message: Message, state: FSMContext)
     if not (doc and doc.mime_type and doc.mime_type.startswith("video/")):
         await message.answer("Отправьте именно видеофайл (формат MP4 и т.п.) или перешлите видео-сообщение.")
         return
-    update_usage_video(doc.file_id)
+    await update_usage_video(doc.file_id)
     await message.answer("Видео-инструкция обновлена.")
     await state.clear()
-    role = get_role(user_id)
+    role = await get_role(user_id)
     await message.answer("Главное меню. Выберите действие:", reply_markup=main_menu_keyboard(role))
 
 
@@ -293,7 +336,7 @@ async def admin_usage_video_wrong(message: Message) -> None:
 @router.message(AdminEditStates.waiting_for_desc_template, F.text)
 async def admin_desc_template_input(message: Message, state: FSMContext) -> None:
     user_id = message.from_user.id if message.from_user else 0
-    if not _ensure_min_role(user_id, "admin"):
+    if not await _ensure_min_role(user_id, "admin"):
         await message.answer("Недостаточно прав для изменения.")
         await state.clear()
         return
@@ -301,22 +344,22 @@ async def admin_desc_template_input(message: Message, state: FSMContext) -> None
     if not text:
         await message.answer("Текст пустой, отправьте непустое сообщение.")
         return
-    update_description_template(text)
+    await update_description_template(text)
     await message.answer("Шаблон описания обновлён.")
     await state.clear()
-    role = get_role(user_id)
+    role = await get_role(user_id)
     await message.answer("Главное меню. Выберите действие:", reply_markup=main_menu_keyboard(role))
 
 
 @router.callback_query(F.data == "root_admin_users")
 async def root_admin_users(callback: CallbackQuery, state: FSMContext) -> None:
     user_id = callback.from_user.id if callback.from_user else 0
-    if not _ensure_min_role(user_id, "root_admin"):
+    if not await _ensure_min_role(user_id, "root_admin"):
         await callback.answer("Недостаточно прав.", show_alert=True)
         return
     _ = state
-    users, admins = list_users_and_admins()
-    requests = list_admin_requests()
+    users, admins = await list_users_and_admins()
+    requests = await list_admin_requests()
 
     lines: list[str] = []
     lines.append("Администраторы:")
@@ -385,12 +428,12 @@ async def root_admin_users(callback: CallbackQuery, state: FSMContext) -> None:
 async def root_admin_invites(callback: CallbackQuery, state: FSMContext) -> None:
     """Просмотр и создание инвайт‑ссылок (токенов) для входа пользователей."""
     user_id = callback.from_user.id if callback.from_user else 0
-    if not _ensure_min_role(user_id, "root_admin"):
+    if not await _ensure_min_role(user_id, "root_admin"):
         await callback.answer("Недостаточно прав.", show_alert=True)
         return
     _ = state
 
-    invites = list_invites()
+    invites = await list_invites()
     lines: list[str] = []
     if invites:
         lines.append("Текущие инвайт‑токены:")
@@ -421,13 +464,13 @@ async def root_admin_invites(callback: CallbackQuery, state: FSMContext) -> None
 async def root_admin_invite_new(callback: CallbackQuery, state: FSMContext) -> None:
     """Создание нового инвайт‑токена без подписи."""
     user_id = callback.from_user.id if callback.from_user else 0
-    if not _ensure_min_role(user_id, "root_admin"):
+    if not await _ensure_min_role(user_id, "root_admin"):
         await callback.answer("Недостаточно прав.", show_alert=True)
         return
     _ = state
 
-    token = create_invite()
-    invites = list_invites()
+    token = await create_invite()
+    invites = await list_invites()
 
     lines: list[str] = []
     lines.append(f"Создан новый инвайт‑токен: {token}")
@@ -453,7 +496,7 @@ async def root_admin_invite_new(callback: CallbackQuery, state: FSMContext) -> N
 @router.callback_query(F.data.startswith("root_admin_approve:"))
 async def root_admin_approve(callback: CallbackQuery, state: FSMContext) -> None:
     user_id = callback.from_user.id if callback.from_user else 0
-    if not _ensure_min_role(user_id, "admin"):
+    if not await _ensure_min_role(user_id, "admin"):
         await callback.answer("Недостаточно прав.", show_alert=True)
         return
     _ = state
@@ -463,12 +506,12 @@ async def root_admin_approve(callback: CallbackQuery, state: FSMContext) -> None
     except ValueError:
         await callback.answer("Некорректный ID.", show_alert=True)
         return
-    reason = pop_admin_request(target_id)
+    reason = await pop_admin_request(target_id)
     if reason is None:
         await callback.answer("Заявка уже обработана.", show_alert=True)
         return
     if decision == "admin":
-        ensure_user_role(target_id, as_admin=True)
+        await ensure_user_role(target_id, as_admin=True)
         await callback.answer("Пользователь назначен администратором.", show_alert=True)
         # Уведомим пользователя о результате
         try:
@@ -495,7 +538,7 @@ async def root_admin_approve(callback: CallbackQuery, state: FSMContext) -> None
 @router.callback_query(F.data.startswith("root_admin_user_menu:"))
 async def root_admin_user_menu(callback: CallbackQuery, state: FSMContext) -> None:
     user_id = callback.from_user.id if callback.from_user else 0
-    if not _ensure_min_role(user_id, "root_admin"):
+    if not await _ensure_min_role(user_id, "root_admin"):
         await callback.answer("Недостаточно прав.", show_alert=True)
         return
     _ = state
@@ -505,13 +548,18 @@ async def root_admin_user_menu(callback: CallbackQuery, state: FSMContext) -> No
     except ValueError:
         await callback.answer("Некорректный ID.", show_alert=True)
         return
-    users, admins = list_users_and_admins()
+    users, admins = await list_users_and_admins()
     if target_id not in users and target_id not in admins:
         await callback.answer("Пользователь не найден в auth.json.", show_alert=True)
         return
     is_admin = target_id in admins
     role_text = "администратор" if is_admin else "пользователь"
     text = f"Управление пользователем {target_id} (текущая роль: {role_text})."
+    usage = await asyncio.to_thread(usage_by_user, time.time() - USAGE_PERIOD, target_id)
+    quota = quota_for(target_id, "admin" if is_admin else "user")
+    personal = " (персональная)" if target_id in get_settings().user_quotas else ""
+    text += f"\nКвота: {_format_quota(quota)}{personal}."
+    text += f"\nЗа 7 дней: {_format_usage(usage[0]) if usage else 'карточек не было'}."
 
     buttons: list[list[InlineKeyboardButton]] = []
     if not is_admin:
@@ -532,6 +580,9 @@ async def root_admin_user_menu(callback: CallbackQuery, state: FSMContext) -> No
                 )
             ]
         )
+    buttons.append(
+        [InlineKeyboardButton(text="⏱ Квота карточек", callback_data=f"root_admin_quota:{target_id}")]
+    )
     buttons.append(
         [
             InlineKeyboardButton(
@@ -551,7 +602,7 @@ async def root_admin_user_menu(callback: CallbackQuery, state: FSMContext) -> No
 @router.callback_query(F.data.startswith("root_admin_user_set_admin:"))
 async def root_admin_user_set_admin(callback: CallbackQuery, state: FSMContext) -> None:
     user_id = callback.from_user.id if callback.from_user else 0
-    if not _ensure_min_role(user_id, "root_admin"):
+    if not await _ensure_min_role(user_id, "root_admin"):
         await callback.answer("Недостаточно прав.", show_alert=True)
         return
     _ = state
@@ -561,7 +612,7 @@ async def root_admin_user_set_admin(callback: CallbackQuery, state: FSMContext)
     except ValueError:
         await callback.answer("Некорректный ID.", show_alert=True)
         return
-    ensure_user_role(target_id, as_admin=True)
+    await ensure_user_role(target_id, as_admin=True)
     await callback.answer("Роль пользователя обновлена: администратор.", show_alert=True)
     # Сообщим пользователю, кем он назначен
     try:
@@ -577,7 +628,7 @@ async def root_admin_user_set_admin(callback: CallbackQuery, state: FSMContext)
 @router.callback_query(F.data.startswith("root_admin_user_set_user:"))
 async def root_admin_user_set_user(callback: CallbackQuery, state: FSMContext) -> None:
     user_id = callback.from_user.id if callback.from_user else 0
-    if not _ensure_min_role(user_id, "root_admin"):
+    if not await _ensure_min_role(user_id, "root_admin"):
         await callback.answer("Недостаточно прав.", show_alert=True)
         return
     _ = state
@@ -587,7 +638,7 @@ async def root_admin_user_set_user(callback: CallbackQuery, state: FSMContext) -
     except ValueError:
         await callback.answer("Некорректный ID.", show_alert=True)
         return
-    ensure_user_role(target_id, as_admin=False)
+    await ensure_user_role(target_id, as_admin=False)
     await callback.answer("Роль пользователя обновлена: пользователь.", show_alert=True)
     # Сообщим пользователю, кем он назначен
     try:
@@ -603,7 +654,7 @@ async def root_admin_user_set_user(callback: CallbackQuery, state: FSMContext) -
 @router.callback_query(F.data.startswith("root_admin_user_delete:"))
 async def root_admin_user_delete(callback: CallbackQuery, state: FSMContext) -> None:
     user_id = callback.from_user.id if callback.from_user else 0
-    if not _ensure_min_role(user_id, "root_admin"):
+    if not await _ensure_min_role(user_id, "root_admin"):
         await callback.answer("Недостаточно прав.", show_alert=True)
         return
     _ = state
@@ -621,7 +672,260 @@ async def root_admin_user_delete(callback: CallbackQuery, state: FSMContext) ->
         )
     except Exception:
         pass
-    remove_user(target_id)
+    await remove_user(target_id)
     await callback.answer("Пользователь удалён.", show_alert=True)
     await root_admin_users(callback, state)
 
+
+def _format_quota(quota: tuple[float, int] | None) -> str:
+    if quota is None:
+        return "без ограничения"
+    per_hour, burst = quota
+    return f"{per_hour:g} в час, подряд до {burst}"
+
+
+def _format_usage(row: dict[str, Any]) -> str:
+    mb_in = (row["bytes_in"] or 0) / (1024 * 1024)
+    mb_out = (row["bytes_out"] or 0) / (1024 * 1024)
+    return (
+        f"{row['done'] or 0} из {row['jobs']} карточек, {row['wall_time'] or 0:.0f} с, "
+        f"CPU {row['cpu_time'] or 0:.1f} с, скачано {mb_in:.1f} МБ, отправлено {mb_out:.1f} МБ"
+    )
+
+
+@router.callback_query(F.data == "root_admin_quotas")
+async def root_admin_quotas(callback: CallbackQuery, state: FSMContext) -> None:
+    """Квоты генерации по ролям и расход по пользователям за неделю."""
+    user_id = callback.from_user.id if callback.from_user else 0
+    if not await _ensure_min_role(user_id, "root_admin"):
+        await callback.answer("Недостаточно прав.", show_alert=True)
+        return
+    await state.clear()
+    settings = get_settings()
+    usage = await asyncio.to_thread(usage_by_user, time.time() - USAGE_PERIOD)
+
+    lines: list[str] = ["Квоты генерации карточек (root-админы не ограничиваются):"]
+    for role in QUOTA_ROLES:
+        lines.append(f"{ROLE_TITLES[role]} — {_format_quota(quota_for(0, role))}")
+    for uid, quota in sorted(settings.user_quotas.items()):
+        lines.append(f"{uid} — {_format_quota(quota if quota[0] > 0 else None)} (персональная)")
+    lines.append("")
+    lines.append("Расход за 7 дней (самые затратные первыми):")
+    if usage:
+        for row in usage[:15]:
+            lines.append(f"{row['user_id']}: {_format_usage(row)}")
+    else:
+        lines.append("— генераций не было —")
+
+    kb = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text=f"⏱ Квота: {ROLE_TITLES[role]}", callback_data=f"root_admin_quota:{role}")]
+            for role in QUOTA_ROLES
+        ]
+        + [
+            [InlineKeyboardButton(text="Обновить", callback_data="root_admin_quotas")],
+            [InlineKeyboardButton(text="⬅️ В меню", callback_data="cancel")],
+        ]
+    )
+    await callback.message.edit_text("\n".join(lines), reply_markup=kb)
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("root_admin_quota:"))
+async def root_admin_quota(callback: CallbackQuery, state: FSMContext) -> None:
+    """Запрос новой квоты для роли (root_admin_quota:user) или пользователя (root_admin_quota:<id>)."""
+    user_id = callback.from_user.id if callback.from_user else 0
+    if not await _ensure_min_role(user_id, "root_admin"):
+        await callback.answer("Недостаточно прав.", show_alert=True)
+        return
+    target = (callback.data or "").split(":", 1)[1]
+    if target not in QUOTA_ROLES and not target.isdigit():
+        await callback.answer("Некорректная цель.", show_alert=True)
+        return
+    await state.set_state(AdminEditStates.waiting_for_quota)
+    await state.update_data(quota_target=target)
+    who = ROLE_TITLES[target] if target in QUOTA_ROLES else f"пользователь {target}"
+    reset = "\n«-» — убрать персональную квоту (будет действовать квота роли)." if target.isdigit() else ""
+    await callback.message.answer(
+        f"Квота для: {who}.\n"
+        "Отправьте «карточек в час/подряд без паузы», например `30/5`, или `0` — без ограничения."
+        f"{reset}",
+        reply_markup=cancel_keyboard(),
+        parse_mode="Markdown",
+    )
+    await callback.answer()
+
+
+@router.message(AdminEditStates.waiting_for_quota, F.text)
+async def admin_quota_input(message: Message, state: FSMContext) -> None:
+    user_id = message.from_user.id if message.from_user else 0
+    if not await _ensure_min_role(user_id, "root_admin"):
+        await message.answer("Недостаточно прав для изменения.")
+        await state.clear()
+        return
+    target = str((await state.get_data()).get("quota_target") or "")
+    value = (message.text or "").strip()
+    quota: dict[str, Any] | None = None
+    if value != "-" or not target.isdigit():
+        per_hour_raw, _, burst_raw = value.partition("/")
+        try:
+            per_hour = float(per_hour_raw.replace(",", "."))
+            burst = int(burst_raw) if burst_raw else 5
+        except ValueError:
+            await message.answer("Неверный формат. Пример: `30/5` или `0`.", parse_mode="Markdown")
+            return
+        quota = {"per_hour": per_hour, "burst": burst}
+
+    # Квоты хранятся в config.json: правим копию снимка, проверяем и подменяем целиком (как в редакторе конфига).
+    cfg = copy.deepcopy(get_settings().raw)
+    section = cfg.setdefault("quotas", {})
+    if target in QUOTA_ROLES:
+        section[target] = quota
+    elif quota is None:
+        section.get("users", {}).pop(target, None)
+    else:
+        section.setdefault("users", {})[target] = quota
+    try:
+        await apply_config(cfg)
+    except ConfigError as exc:
+        await message.answer(f"Квота не применена: {exc}")
+        return
+    except OSError:
+        logger.exception("Не удалось сохранить config.json")
+        await message.answer("Не удалось сохранить config.json — изменение не применено. Подробности в логах сервера.")
+        return
+    await state.clear()
+    await message.answer("Квота сохранена.", reply_markup=main_menu_keyboard(await get_role(user_id)))
+
+
+CACHE_TITLES = {
+    "file_id": "file_id отправленных карточек",
+    "prefetch": "предзагрузка фото",
+    "photo_sizes": "размеры фото под слот",
+    "logo": "логотипы",
+}
+ERROR_TITLES = {
+    "render": "сборка карточки",
+    "image_rejected": "отклонённые фото",
+    "dead_letter": "не отправлено",
+    "handler": "хендлеры",
+}
+
+
+def _format_seconds(seconds: float) -> str:
+    if seconds < 1:
+        return f"{seconds * 1000:.0f} мс"
+    return f"{seconds:.1f} с"
+
+
+def _format_latency(stats: dict[str, float] | None) -> str:
+    if stats is None:
+        return "нет данных"
+    return f"p50 {_format_seconds(stats['p50'])}, p95 {_format_seconds(stats['p95'])}, макс. {_format_seconds(stats['max'])}"
+
+
+def _format_errors(errors: dict[str, int]) -> str:
+    if not errors:
+        return "нет"
+    return ", ".join(f"{ERROR_TITLES.get(kind, kind)} — {count}" for kind, count in sorted(errors.items()))
+
+
+@router.callback_query(F.data == "admin_metrics")
+async def admin_metrics(callback: CallbackQuery, state: FSMContext) -> None:
+    """Текущее состояние процесса: очередь генераций, Chromium, кэши, задержки и ошибки за последний час."""
+    user_id = callback.from_user.id if callback.from_user else 0
+    if not await _ensure_min_role(user_id, "admin"):
+        await callback.answer("Недостаточно прав.", show_alert=True)
+        return
+    await state.clear()
+    snap = snapshot()
+    active = len(active_jobs())
+    bot_rss, chromium_rss, chromium_count = await asyncio.to_thread(process_memory)
+    mb = 1024 * 1024
+
+    lines: list[str] = [f"Работает {timedelta(seconds=int(snap['uptime']))}.", ""]
+    lines.append(f"Карточек в работе: {active} (в Chromium — {snap['pages']}, ждут — {max(active - snap['pages'], 0)})")
+    lines.append(f"Отправок ждут лимитов Telegram: {snap['send_waiting']}")
+    if is_browser_running():
+        lines.append(f"Chromium: запущен, процессов {chromium_count}, память {chromium_rss / mb:.0f} МБ")
+    else:
+        lines.append("Chromium: не запущен")
+    lines.append(f"Память бота: {bot_rss / mb:.0f} МБ")
+    lines.append("")
+    lines.append("Кэши (попадания с запуска):")
+    if snap["caches"]:
+        for cache, (hits, misses) in sorted(snap["caches"].items()):
+            total = hits + misses
+            lines.append(f"{CACHE_TITLES.get(cache, cache)} — {hits * 100 // total}% ({hits} из {total})")
+    else:
+        lines.append("— обращений не было —")
+    lines.append("")
+    lines.append(f"За час: карточек {snap['jobs_total']}, с ошибкой {snap['jobs_failed']}")
+    lines.append(f"Время генерации: {_format_latency(snap['job_latency'])}")
+    lines.append(f"Ответ на апдейты: {_format_latency(snap['update_latency'])}")
+    lines.append(f"Лаг цикла событий: {_format_latency(snap['loop_lag'])}, блокировок с запуска {snap['loop_stalls']}")
+    if snap["slowest"]:
+        lines.append("Самые долгие:")
+        for _, seconds, job_id, job_user, ok in snap["slowest"]:
+            lines.append(f"{job_id} ({job_user}) — {_format_seconds(seconds)}{'' if ok else ', ошибка'}")
+    offenders = top_offenders(3)
+    if offenders:
+        lines.append("Что блокирует цикл событий (с запуска):")
+        for offender in offenders:
+            lines.append(f"{offender.site} — {_format_seconds(offender.blocked)}, {offender.stalls} раз")
+    lines.append("")
+    lines.append(f"Ошибки за час: {_format_errors(snap['errors'])}")
+    lines.append(f"Ошибки с запуска: {_format_errors(snap['errors_total'])}")
+
+    kb = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="Обновить", callback_data="admin_metrics")],
+            [InlineKeyboardButton(text="⬅️ В меню", callback_data="cancel")],
+        ]
+    )
+    try:
+        await callback.message.edit_text("\n".join(lines), reply_markup=kb)
+    except TelegramBadRequest:
+        # «Обновить» без изменений: Telegram отклоняет правку тем же текстом.
+        pass
+    await callback.answer()
+
+
+@router.message(Command("profile"))
+async def admin_profile(message: Message, command: CommandObject) -> None:
+    """
+    /profile <id> [N] — профилировать следующие N генераций пользователя (стеки и трассировка Chromium придут сюда),
+    /profile off <id> — отменить, /profile — что сейчас включено.
+    """
+    user_id = message.from_user.id if message.from_user else 0
+    if not await _ensure_min_role(user_id, "admin"):
+        await message.answer("Недостаточно прав.")
+        return
+    args = (command.args or "").split()
+    if not args:
+        current = armed()
+        if not current:
+            await message.answer(
+                "Профилирование выключено.\n"
+                f"/profile <id> [N] — следующие N (до {PROFILE_MAX_RUNS}) генераций пользователя, /profile off <id> — отменить."
+            )
+            return
+        lines = ["Профилируются:"] + [f"{uid} — ещё {request.runs}" for uid, request in sorted(current.items())]
+        await message.answer("\n".join(lines))
+        return
+    if args[0] == "off" and len(args) == 2 and args[1].isdigit():
+        if disarm(int(args[1])):
+            await message.answer(f"Профилирование пользователя {args[1]} отменено.")
+        else:
+            await message.answer(f"Для пользователя {args[1]} профилирование не было включено.")
+        return
+    if not args[0].isdigit() or (len(args) > 1 and not args[1].isdigit()) or len(args) > 2:
+        await message.answer("Формат: /profile <id> [N] или /profile off <id>.")
+        return
+    target = int(args[0])
+    runs = int(args[1]) if len(args) > 1 else 1
+    arm(target, runs, message.chat.id)
+    await message.answer(
+        f"Следующие {min(max(runs, 1), PROFILE_MAX_RUNS)} генераций пользователя {target} будут профилироваться; "
+        "стеки (для speedscope/flamegraph.pl) и трассировка Chromium придут в этот чат."
+    )
@@ -1,15 +1,24 @@
+import asyncio
 from typing import Any
 
 from aiogram import Bot, F, Router
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, InlineKeyboardButton, Message
 
-from ..auth_store import get_role, load_auth
-from ..example_store import load_examples, save_examples
-from ..logo_store import load_logos
-from ..services import generate_and_send_card
+from ..auth_store import get_role, read_auth
+from ..example_store import read_examples, save_example_fields
+from ..images import ImageRejected, check_upload_size
+from ..jobs import is_draining, load_job, recently_sent, single_flight
+from ..logo_store import read_logos
+from ..previews import send_template_previews
+from ..photo_sizes import remember_photos
+from ..quotas import quota_message, refund_render_quota
+from ..services import generate_and_send_card, prefetch_photos, reserve_render, run_reserved_card_job
 from ..states import CardStates
-from ..ui import cancel_keyboard, examples_menu_keyboard, template_select_keyboard
+from ..template_registry import get_template, template_ids
+from ..text_layout import TEXT_SLOTS, TextSlot, fits
+from ..ui import cancel_keyboard, examples_menu_keyboard, main_menu_keyboard, template_select_keyboard
 
 # Примеры текстов с текущей страницы шаблона (для подсказок в боте)
 EXAMPLE_TITLE_MAIN = "Msi Bravo 15.6"
@@ -29,7 +38,8 @@ async def _ensure_registered_callback(callback: CallbackQuery, state: FSMContext
     Возвращает True, если доступ разрешён.
     """
     user_id = callback.from_user.id if callback.from_user else 0
-    role = get_role(user_id)
+    # Чтение auth.json — в пуле хранилищ, чтобы не задерживать цикл событий (и ответы на другие нажатия).
+    role = await get_role(user_id)
     if role != "guest":
         return True
     if state is not None:
@@ -42,7 +52,7 @@ async def _ensure_registered_callback(callback: CallbackQuery, state: FSMContext
 async def _ensure_registered_message(message: Message, state: FSMContext | None = None) -> bool:
     """Аналогичная проверка для обычных сообщений."""
     user_id = message.from_user.id if message.from_user else 0
-    role = get_role(user_id)
+    role = await get_role(user_id)
     if role != "guest":
         return True
     if state is not None:
@@ -51,15 +61,15 @@ async def _ensure_registered_message(message: Message, state: FSMContext | None
     return False
 
 
-def _logo_choice_buttons(user_id: int) -> list[list[InlineKeyboardButton]]:
+async def _logo_choice_buttons(user_id: int) -> list[list[InlineKeyboardButton]]:
     """
     Возвращает дополнительные кнопки для выбора логотипа магазина.
     Доступно только администраторам и root-админам.
     """
-    role = get_role(user_id)
+    role = await get_role(user_id)
     if role not in {"admin", "root_admin"}:
         return [[InlineKeyboardButton(text="Без логотипа", callback_data="card_skip_logo")]]
-    shops = load_logos()
+    shops = await read_logos()
     rows: list[list[InlineKeyboardButton]] = []
     for shop in shops:
         if not shop.logo_file_id:
@@ -80,23 +90,23 @@ def _logo_choice_buttons(user_id: int) -> list[list[InlineKeyboardButton]]:
     return rows
 
 
-def _get_description_template() -> str:
+async def _get_description_template() -> str:
     """Текст блока слева по умолчанию: из админского шаблона описания."""
-    return load_auth().description_template
+    return (await read_auth()).description_template
 
 
-def _get_defaults_from_example_store() -> dict[str, Any]:
+async def _get_defaults_from_example_store() -> dict[str, Any]:
     """
     Берёт значения по умолчанию из сохранённого примера (examples.json),
     а если их нет — шаблон описания из админки и константы из этого файла.
     """
-    stored = load_examples()
+    stored = await read_examples()
     return {
         "title_main": str(stored.get("title_main") or EXAMPLE_TITLE_MAIN),
         "title_sub": str(stored.get("title_sub") or EXAMPLE_TITLE_SUB),
         # Для общего сценария «По умолчанию» описание всегда берём из админского шаблона,
         # а не из примера, чтобы совпадало с тем, что показывается в подсказке.
-        "text_minor": _get_description_template(),
+        "text_minor": await _get_description_template(),
         "text_bottom_line1": str(stored.get("text_bottom_line1") or EXAMPLE_TEXT_BOTTOM_1),
         "text_bottom_line2": str(stored.get("text_bottom_line2") or EXAMPLE_TEXT_BOTTOM_2),
         "price": str(stored.get("price") or EXAMPLE_PRICE),
@@ -105,36 +115,47 @@ def _get_defaults_from_example_store() -> dict[str, Any]:
     }
 
 
-def _get_spec_example_for_index(index: int) -> str | None:
+async def _get_spec_example_for_index(index: int) -> str | None:
     """
     Возвращает пример характеристики для шага с данным индексом (0‑based),
     чтобы можно было показать её в тексте подсказки.
     """
-    defaults = _get_defaults_from_example_store()
+    defaults = await _get_defaults_from_example_store()
     specs: list[str] = defaults.get("spec_list", [])
     if 0 <= index < len(specs):
         return specs[index]
     return None
 
 
-async def _save_example_if_needed(state: FSMContext) -> None:
-    """Если данные заполняются из меню примера, сохраняем их на диск."""
+async def _save_example_if_needed(state: FSMContext, **fields: Any) -> None:
+    """Если данные заполняются из меню примера, сохраняем на диск введённые поля (остальные поля примера не трогаем)."""
     data = await state.get_data()
     if data.get("from_example"):
-        save_examples(data)
+        await save_example_fields(**fields)
 
 
 @router.callback_query(F.data == "menu_create_card")
-async def menu_create_card(callback: CallbackQuery, state: FSMContext) -> None:
+async def menu_create_card(callback: CallbackQuery, state: FSMContext, bot: Bot) -> None:
     if not await _ensure_registered_callback(callback, state):
         return
     await state.clear()
     await state.set_state(CardStates.waiting_for_template)
+    await callback.answer()
+    # Сначала альбом превью шаблонов, затем выбор — новым сообщением под альбомом.
+    if await send_template_previews(bot, callback.message.chat.id):
+        try:
+            await callback.message.delete()
+        except TelegramBadRequest:
+            pass
+        await callback.message.answer(
+            "Выберите вариант макета карточки (превью — выше):",
+            reply_markup=template_select_keyboard(prefix="card_tpl"),
+        )
+        return
     await callback.message.edit_text(
         "Выберите вариант макета карточки:",
         reply_markup=template_select_keyboard(prefix="card_tpl"),
     )
-    await callback.answer()
 
 
 @router.callback_query(F.data.startswith("menu_preset:"))
@@ -155,7 +176,7 @@ async def menu_preset(callback: CallbackQuery, state: FSMContext) -> None:
 
     logo_file_id: str | None = None
     # Пробуем взять логотип магазина с таким же id из конфигуратора логотипов.
-    for shop in load_logos():
+    for shop in await read_logos():
         if shop.id == preset_id and shop.logo_file_id:
             logo_file_id = shop.logo_file_id
             break
@@ -191,7 +212,7 @@ async def card_template_select(callback: CallbackQuery, state: FSMContext) -> No
     if not await _ensure_registered_callback(callback, state):
         return
     raw = (callback.data or "").removeprefix("card_tpl:")
-    if raw not in {"1", "2", "3"}:
+    if not raw.isdigit() or int(raw) not in template_ids():
         await callback.answer()
         return
     await state.update_data(template_id=int(raw), photo_file_ids=[])
@@ -205,20 +226,64 @@ async def card_template_select(callback: CallbackQuery, state: FSMContext) -> No
     await callback.answer()
 
 
+@router.callback_query(F.data.startswith("job_retry:"))
+async def card_job_retry(callback: CallbackQuery, bot: Bot) -> None:
+    """Повтор генерации карточки из журнала заданий (кнопка «Повторить» после ошибки или перезапуска)."""
+    if not await _ensure_registered_callback(callback):
+        return
+    user_id = callback.from_user.id if callback.from_user else 0
+    loaded = await load_job((callback.data or "").removeprefix("job_retry:"))
+    if loaded is None or loaded[0].user_id != user_id:
+        await callback.answer("Задание не найдено. Создайте карточку заново.", show_alert=True)
+        return
+    job, status, retryable = loaded
+    if status != "failed" or not retryable:
+        await callback.answer("Эту карточку повторить нельзя: она уже собрана или собирается.", show_alert=True)
+        return
+    if is_draining():
+        await callback.answer("Бот перезапускается. Повторите через минуту.", show_alert=True)
+        return
+    # Квота — до того, как убрать кнопку: сверх квоты она остаётся, чтобы повторить позже.
+    wait, quota = await reserve_render(user_id)
+    if wait:
+        await callback.answer(quota_message(wait, quota, retry=True), show_alert=True)
+        return
+    await callback.answer()
+    try:
+        # Кнопку убираем, чтобы повторное нажатие не запустило вторую генерацию.
+        await callback.message.edit_reply_markup(reply_markup=None)
+    except TelegramBadRequest:
+        pass
+    ok, outcome = await single_flight(job.chat_id, job.data, lambda: run_reserved_card_job(bot, job))
+    if outcome != "run":
+        # Генерация этого задания уже шла или только что закончилась — списанная квота не понадобилась.
+        refund_render_quota(user_id)
+    if ok and outcome == "run":
+        await callback.message.answer("Главное меню. Выберите действие:", reply_markup=main_menu_keyboard(await get_role(user_id)))
+
+
 @router.message(CardStates.waiting_for_main_photo, F.photo)
-async def main_photo_handler(message: Message, state: FSMContext) -> None:
+async def main_photo_handler(
+    message: Message, state: FSMContext, bot: Bot, album: list[Message] | None = None
+) -> None:
     if not await _ensure_registered_message(message, state):
         return
+    # Храним все размеры каждого фото: при генерации скачивается тот, которого хватает на слот шаблона.
+    # Запоминаем до чтения FSM: между get_data и update_data не должно быть ожиданий, иначе фото,
+    # присланные по одному подряд (обрабатываются параллельно), перезапишут друг друга.
+    new_ids = await asyncio.to_thread(remember_photos, [part.photo for part in (album or [message]) if part.photo])
     data = await state.get_data()
     ids: list[str] = list(data.get("photo_file_ids", []))
-    ids.append(message.photo[-1].file_id)
-    await state.update_data(photo_file_ids=ids)
+    # Альбом (см. media_group) приходит целиком: все фото по порядку добавляются одной записью в FSM.
+    ids.extend(new_ids)
     if len(ids) < 3:
         # Просто копим фото без лишних сообщений, пока не будет 3 штуки.
+        await state.update_data(photo_file_ids=ids)
         return
 
-    # Есть как минимум 3 фото — берём первые три.
+    # Есть как минимум 3 фото — берём первые три и сразу начинаем их скачивать, пока пользователь заполняет тексты.
     await state.update_data(photo_file_ids=ids[:3])
+    prefetch_photos(bot, ids[:3], ["main", "minor1", "minor2"], template_id=int(data.get("template_id", 1) or 1))
 
     # Если сценарий запущен через пресет (K&B/МНСГ/Паша),
     # то не спрашиваем про логотип и сразу переходим к названию.
@@ -233,7 +298,7 @@ async def main_photo_handler(message: Message, state: FSMContext) -> None:
 
     # Иначе переходим к выбору/загрузке логотипа.
     await state.set_state(CardStates.waiting_for_logo)
-    extra_buttons = _logo_choice_buttons(message.from_user.id if message.from_user else 0)
+    extra_buttons = await _logo_choice_buttons(message.from_user.id if message.from_user else 0)
     await message.answer(
         "Получил 3 фото (1 главное и 2 дополнительных).\n"
         "Теперь отправьте **логотип** (фото или файл PNG/JPG), выберите один из логотипов магазина, "
@@ -260,6 +325,10 @@ async def card_default_callback(callback: CallbackQuery, state: FSMContext, bot:
         data = await state.get_data()
         spec_list: list[str] = list(data.get("spec_list", []))
         if not spec_list:
+            if callback.message and recently_sent(callback.message.chat.id):
+                # Повторное нажатие после того, как карточка собрана и анкета очищена.
+                await callback.answer("Карточка уже отправлена.")
+                return
             await callback.answer("Добавьте хотя бы одну характеристику.", show_alert=True)
             return
         from_example = data.get("from_example")
@@ -288,7 +357,7 @@ async def card_default_callback(callback: CallbackQuery, state: FSMContext, bot:
         return
 
     if step == "photos":
-        stored = load_examples()
+        stored = await read_examples()
         photo_ids: list[str] = list(stored.get("example_photo_file_ids", []))
         if len(photo_ids) != 3:
             await callback.answer(
@@ -299,7 +368,9 @@ async def card_default_callback(callback: CallbackQuery, state: FSMContext, bot:
         await state.update_data(photo_file_ids=photo_ids[:3])
         await state.set_state(CardStates.waiting_for_logo)
         await callback.answer()
-        extra_buttons = _logo_choice_buttons(callback.from_user.id if callback.from_user else 0)
+        data = await state.get_data()
+        prefetch_photos(bot, photo_ids[:3], ["main", "minor1", "minor2"], template_id=int(data.get("template_id", 1) or 1))
+        extra_buttons = await _logo_choice_buttons(callback.from_user.id if callback.from_user else 0)
         await callback.message.answer(
             "Фото из примера подставлены.\n"
             "Отправьте **логотип** (фото или файл PNG/JPG), выберите один из логотипов магазина, "
@@ -313,7 +384,7 @@ async def card_default_callback(callback: CallbackQuery, state: FSMContext, bot:
         return
 
     if step == "logo":
-        stored = load_examples()
+        stored = await read_examples()
         logo_id = stored.get("example_logo_file_id")
         if not logo_id:
             await callback.answer(
@@ -333,7 +404,7 @@ async def card_default_callback(callback: CallbackQuery, state: FSMContext, bot:
 
     if step == "spec_example":
         data = await state.get_data()
-        stored_defaults = _get_defaults_from_example_store()
+        stored_defaults = await _get_defaults_from_example_store()
         default_specs: list[str] = list(stored_defaults["spec_list"])
         spec_list: list[str] = list(data.get("spec_list", []))
         step = int(data.get("spec_step", 0))
@@ -375,7 +446,7 @@ async def card_default_callback(callback: CallbackQuery, state: FSMContext, bot:
         spec_entry = f"{label} — {example_value}"
         spec_list.append(spec_entry)
         await state.update_data(spec_list=spec_list, spec_step=step + 1)
-        await _save_example_if_needed(state)
+        await _save_example_if_needed(state, spec_list=spec_list)
         await callback.answer()
 
         if step + 1 >= len(labels):
@@ -413,8 +484,8 @@ async def card_default_callback(callback: CallbackQuery, state: FSMContext, bot:
             )
         return
 
-    stored_defaults = _get_defaults_from_example_store()
-    desc_example = _get_description_template()
+    stored_defaults = await _get_defaults_from_example_store()
+    desc_example = await _get_description_template()
     defaults = {
         "title_main": (
             {"title_main": stored_defaults["title_main"]},
@@ -448,7 +519,7 @@ async def card_default_callback(callback: CallbackQuery, state: FSMContext, bot:
         return
     updates, next_state, next_text, next_callback = defaults[step]
     await state.update_data(**updates)
-    await _save_example_if_needed(state)
+    await _save_example_if_needed(state, **updates)
     await state.set_state(next_state)
     await callback.answer()
     await callback.message.answer(
@@ -490,7 +561,8 @@ async def card_skip_logo_callback(callback: CallbackQuery, state: FSMContext) ->
 async def logo_photo_handler(message: Message, state: FSMContext) -> None:
     if not await _ensure_registered_message(message, state):
         return
-    await state.update_data(logo_file_id=message.photo[-1].file_id, skip_logo=False)
+    logo_file_id = (await asyncio.to_thread(remember_photos, [message.photo]))[0]
+    await state.update_data(logo_file_id=logo_file_id, skip_logo=False)
     await state.set_state(CardStates.waiting_for_title_main)
     await message.answer(
         f"Укажите модель и бренд ноутбука.\n_Пример: {EXAMPLE_TITLE_MAIN}_",
@@ -505,6 +577,11 @@ async def logo_document_handler(message: Message, state: FSMContext) -> None:
         return
     doc = message.document
     if doc and doc.mime_type and doc.mime_type.startswith("image/"):
+        try:
+            check_upload_size(doc.file_size)
+        except ImageRejected as exc:
+            await message.answer(str(exc))
+            return
         await state.update_data(logo_file_id=doc.file_id, skip_logo=False)
         await state.set_state(CardStates.waiting_for_title_main)
         await message.answer(
@@ -528,7 +605,7 @@ async def wrong_logo(message: Message) -> None:
 async def card_logo_shop_callback(callback: CallbackQuery, state: FSMContext) -> None:
     """Выбор одного из преднастроенных логотипов магазина (доступно только администраторам)."""
     user_id = callback.from_user.id if callback.from_user else 0
-    role = get_role(user_id)
+    role = await get_role(user_id)
     if role not in {"admin", "root_admin"}:
         await callback.answer("Недостаточно прав.", show_alert=True)
         return
@@ -541,7 +618,7 @@ async def card_logo_shop_callback(callback: CallbackQuery, state: FSMContext) ->
     except ValueError:
         await callback.answer("Некорректный магазин.", show_alert=True)
         return
-    shops = load_logos()
+    shops = await read_logos()
     logo_file_id: str | None = None
     for shop in shops:
         if shop.id == shop_id:
@@ -565,10 +642,10 @@ async def title_main_handler(message: Message, state: FSMContext) -> None:
     if not await _ensure_registered_message(message, state):
         return
     await state.update_data(title_main=message.text.strip())
-    await _save_example_if_needed(state)
+    await _save_example_if_needed(state, title_main=message.text.strip())
     await state.set_state(CardStates.waiting_for_text_minor)
     await message.answer(
-        f"Введите **текст блока слева** (описание, можно с переносами).\n_Пример: {_get_description_template()}_",
+        f"Введите **текст блока слева** (описание, можно с переносами).\n_Пример: {await _get_description_template()}_",
         reply_markup=cancel_keyboard(default_callback="card_default:text_minor"),
         parse_mode="Markdown",
     )
@@ -579,20 +656,33 @@ async def wrong_title_main(message: Message) -> None:
     await message.answer("Укажите модель и бренд ноутбука текстом.")
 
 
+def _lines_word(count: int) -> str:
+    """«строку», «строки» или «строк» — в зависимости от числа."""
+    if count % 10 == 1 and count % 100 != 11:
+        return "строку"
+    if 2 <= count % 10 <= 4 and not 12 <= count % 100 <= 14:
+        return "строки"
+    return "строк"
+
+
 @router.message(CardStates.waiting_for_text_minor, F.text)
 async def text_minor_handler(message: Message, state: FSMContext) -> None:
     if not await _ensure_registered_message(message, state):
         return
     text = message.text.strip()
-    await state.update_data(
-        text_minor=text,
-        text_bottom_line1=EXAMPLE_TEXT_BOTTOM_1,
-        text_bottom_line2=EXAMPLE_TEXT_BOTTOM_2,
-    )
-    await _save_example_if_needed(state)
-    if len(text) >= 150:
+    updates = {
+        "text_minor": text,
+        "text_bottom_line1": EXAMPLE_TEXT_BOTTOM_1,
+        "text_bottom_line2": EXAMPLE_TEXT_BOTTOM_2,
+    }
+    await state.update_data(**updates)
+    await _save_example_if_needed(state, **updates)
+    template = get_template(int((await state.get_data()).get("template_id", 1) or 1))
+    slot = template.texts.get("text_minor", "text_minor")
+    if not fits(slot, text):
+        max_lines = (slot if isinstance(slot, TextSlot) else TEXT_SLOTS[slot]).max_lines
         await message.answer(
-            "⚠ Описание длинное (150+ символов). На карточке отображаются только первые 3 строки."
+            f"⚠ Описание не помещается в {max_lines} {_lines_word(max_lines)}. На карточке оно будет обрезано многоточием."
         )
     await state.set_state(CardStates.waiting_for_price)
     await message.answer(
@@ -612,7 +702,7 @@ async def text_bottom_1_handler(message: Message, state: FSMContext) -> None:
     if not await _ensure_registered_message(message, state):
         return
     await state.update_data(text_bottom_line1=message.text.strip())
-    await _save_example_if_needed(state)
+    await _save_example_if_needed(state, text_bottom_line1=message.text.strip())
     await state.set_state(CardStates.waiting_for_text_bottom_line2)
     await message.answer(
         f"Введите **вторую строку блока справа внизу**.\n_Пример: {EXAMPLE_TEXT_BOTTOM_2}_",
@@ -631,7 +721,7 @@ async def text_bottom_2_handler(message: Message, state: FSMContext) -> None:
     if not await _ensure_registered_message(message, state):
         return
     await state.update_data(text_bottom_line2=message.text.strip())
-    await _save_example_if_needed(state)
+    await _save_example_if_needed(state, text_bottom_line2=message.text.strip())
     await state.set_state(CardStates.waiting_for_price)
     await message.answer(
         f"Введите **цену** (как на карточке).\n_Пример: {EXAMPLE_PRICE}_",
@@ -652,9 +742,9 @@ async def price_handler(message: Message, state: FSMContext) -> None:
     await state.update_data(price=message.text.strip())
     # Начинаем пошаговый сбор характеристик: CPU, GPU, RAM, SSD, Display.
     await state.update_data(spec_list=[], spec_step=0)
-    await _save_example_if_needed(state)
+    await _save_example_if_needed(state, price=message.text.strip(), spec_list=[])
     await state.set_state(CardStates.waiting_for_spec)
-    cpu_example = _get_spec_example_for_index(0) or "Ryzen 7 7535HS"
+    cpu_example = await _get_spec_example_for_index(0) or "Ryzen 7 7535HS"
     await message.answer(
         f"Укажите CPU (например: _{cpu_example}_).",
         reply_markup=cancel_keyboard(default_callback="card_default:spec_example"),
@@ -724,7 +814,7 @@ async def spec_handler(message: Message, state: FSMContext, bot: Bot) -> None:
     spec_entry = f"{label} — {value}"
     spec_list.append(spec_entry)
     await state.update_data(spec_list=spec_list, spec_step=step + 1)
-    await _save_example_if_needed(state)
+    await _save_example_if_needed(state, spec_list=spec_list)
 
     if step + 1 >= len(labels):
         # Все 5 характеристик собраны — генерируем карточку.
@@ -745,7 +835,7 @@ async def spec_handler(message: Message, state: FSMContext, bot: Bot) -> None:
     next_label = labels[step + 1]
     example_value = None
     # Пробуем взять пример из сохранённых характеристик.
-    defaults = _get_defaults_from_example_store()
+    defaults = await _get_defaults_from_example_store()
     for item in defaults.get("spec_list", []):
         if item.lower().startswith(next_label.lower()):
             parts = item.split("—", 1)
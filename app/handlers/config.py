@@ -1,20 +1,26 @@
+import copy
+import logging
+
 from aiogram import F, Router
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, InlineKeyboardButton, Message
 
-from ..config_store import convert_config_value, save_config
-from ..context import get_app_config
+from ..config import ConfigError
+from ..config_store import apply_config, convert_config_value
+from ..context import get_settings
 from ..states import ConfigStates
 from ..ui import cancel_keyboard, config_section_data, config_section_keyboard, main_menu_keyboard
 
 
+logger = logging.getLogger(__name__)
+
 router = Router()
 
 
 @router.callback_query(F.data == "cfg_section_output")
 async def cfg_section_output(callback: CallbackQuery, state: FSMContext) -> None:
     _ = state
-    kb = config_section_keyboard("output", get_app_config().raw)
+    kb = config_section_keyboard("output", get_settings().raw)
     await callback.message.edit_text("Параметры output:", reply_markup=kb)
     await callback.answer()
 
@@ -22,7 +28,7 @@ async def cfg_section_output(callback: CallbackQuery, state: FSMContext) -> None
 @router.callback_query(F.data == "cfg_section_price")
 async def cfg_section_price(callback: CallbackQuery, state: FSMContext) -> None:
     _ = state
-    kb = config_section_keyboard("price", get_app_config().raw)
+    kb = config_section_keyboard("price", get_settings().raw)
     await callback.message.edit_text("Параметры блока «Название-цена»:", reply_markup=kb)
     await callback.answer()
 
@@ -30,7 +36,7 @@ async def cfg_section_price(callback: CallbackQuery, state: FSMContext) -> None:
 @router.callback_query(F.data == "cfg_section_desc")
 async def cfg_section_desc(callback: CallbackQuery, state: FSMContext) -> None:
     _ = state
-    kb = config_section_keyboard("desc", get_app_config().raw)
+    kb = config_section_keyboard("desc", get_settings().raw)
     await callback.message.edit_text("Параметры description_block:", reply_markup=kb)
     await callback.answer()
 
@@ -42,7 +48,7 @@ async def cfg_edit_handler(callback: CallbackQuery, state: FSMContext) -> None:
         await callback.answer("Некорректный параметр", show_alert=True)
         return
     _, section, key = parts
-    section_data = config_section_data(section, get_app_config().raw)
+    section_data = config_section_data(section, get_settings().raw)
     if key not in section_data:
         await callback.answer("Параметр не найден", show_alert=True)
         return
@@ -66,7 +72,8 @@ async def cfg_value_input_handler(message: Message, state: FSMContext) -> None:
         await state.clear()
         await message.answer("Не удалось определить параметр.", reply_markup=main_menu_keyboard())
         return
-    cfg = get_app_config().raw
+    # Снимок конфига не правим на месте: меняем копию, проверяем и подменяем целиком.
+    cfg = copy.deepcopy(get_settings().raw)
     section_data = config_section_data(section, cfg)
     old_value = section_data[key]
     try:
@@ -75,7 +82,15 @@ async def cfg_value_input_handler(message: Message, state: FSMContext) -> None:
         await message.answer(f"Неверный формат значения: {exc}")
         return
     section_data[key] = new_value
-    save_config(cfg)
+    try:
+        await apply_config(cfg)
+    except ConfigError as exc:
+        await message.answer(f"Значение не применено: {exc}")
+        return
+    except OSError:
+        logger.exception("Не удалось сохранить config.json")
+        await message.answer("Не удалось сохранить config.json — изменение не применено. Подробности в логах сервера.")
+        return
     await state.clear()
     await message.answer(f"Сохранено: `{section}.{key}` = `{new_value}`", parse_mode="Markdown")
     kb = config_section_keyboard(section, cfg)
@@ -1,11 +1,16 @@
+import asyncio
+
 from aiogram import Bot, F, Router
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, InlineKeyboardButton, Message
 
-from ..auth_store import load_auth
-from ..example_store import load_examples, save_examples
+from ..auth_store import read_auth
+from ..example_store import read_examples, save_example_fields
+from ..images import ImageRejected, check_upload_size
+from ..photo_sizes import remember_photos
 from ..services import generate_and_send_card
 from ..states import CardStates, ExampleStates
+from ..template_registry import template_ids
 from ..ui import cancel_keyboard, example_builder_keyboard, examples_menu_keyboard
 
 
@@ -14,7 +19,7 @@ router = Router()
 
 @router.callback_query(F.data == "example_edit_data")
 async def example_edit_data(callback: CallbackQuery, state: FSMContext) -> None:
-    stored = load_examples()
+    stored = await read_examples()
     if stored:
         await state.update_data(**stored)
     await state.set_state(None)
@@ -48,7 +53,7 @@ async def example_edit_logo(callback: CallbackQuery, state: FSMContext) -> None:
 @router.callback_query(F.data == "example_logo_clear")
 async def example_logo_clear(callback: CallbackQuery, state: FSMContext) -> None:
     await state.update_data(example_logo_file_id=None)
-    save_examples(await state.get_data())
+    await save_example_fields(example_logo_file_id=None)
     await state.set_state(None)
     await callback.message.edit_text("Меню примера: выберите, что изменить.", reply_markup=example_builder_keyboard(await state.get_data()))
     await callback.answer()
@@ -82,7 +87,7 @@ async def example_edit_texts(callback: CallbackQuery, state: FSMContext) -> None
     photo_ids: list[str] = data.get("example_photo_file_ids", [])
     if len(photo_ids) != 3:
         # Пытаемся подгрузить сохранённый пример с диска (после /start, cancel или рестарта контейнера).
-        stored = load_examples()
+        stored = await read_examples()
         photo_ids = list(stored.get("example_photo_file_ids", []))
         if len(photo_ids) == 3:
             data.update(stored)
@@ -116,14 +121,14 @@ async def example_back_builder(callback: CallbackQuery, state: FSMContext) -> No
 @router.callback_query(F.data.startswith("example_gen:"))
 async def example_generate(callback: CallbackQuery, state: FSMContext, bot: Bot) -> None:
     raw = (callback.data or "").removeprefix("example_gen:")
-    if raw not in ("1", "2", "3"):
+    if not raw.isdigit() or int(raw) not in template_ids():
         await callback.answer()
         return
     template_id = int(raw)
     data = await state.get_data()
     photos: list[str] = data.get("example_photo_file_ids", [])
     if len(photos) != 3:
-        stored = load_examples()
+        stored = await read_examples()
         photos = list(stored.get("example_photo_file_ids", []))
         if len(photos) == 3:
             data = {**data, **stored}
@@ -135,8 +140,8 @@ async def example_generate(callback: CallbackQuery, state: FSMContext, bot: Bot)
         await callback.answer("Сначала нажмите «Заполнить тексты» и введите все данные.", show_alert=True)
         return
 
-    stored = load_examples()
-    desc_template = load_auth().description_template
+    stored = await read_examples()
+    desc_template = (await read_auth()).description_template
     # Для генерации примера по умолчанию всегда используем актуальный админский шаблон описания,
     # чтобы изменения из настроек сразу применялись.
     text_minor = desc_template
@@ -168,8 +173,9 @@ async def example_generate(callback: CallbackQuery, state: FSMContext, bot: Bot)
 
 @router.message(ExampleStates.waiting_for_logo, F.photo)
 async def example_logo_photo(message: Message, state: FSMContext) -> None:
-    await state.update_data(example_logo_file_id=message.photo[-1].file_id)
-    save_examples(await state.get_data())
+    logo_file_id = (await asyncio.to_thread(remember_photos, [message.photo]))[0]
+    await state.update_data(example_logo_file_id=logo_file_id)
+    await save_example_fields(example_logo_file_id=logo_file_id)
     await state.set_state(None)
     await message.answer("Логотип сохранён.", reply_markup=example_builder_keyboard(await state.get_data()))
 
@@ -178,8 +184,13 @@ async def example_logo_photo(message: Message, state: FSMContext) -> None:
 async def example_logo_document(message: Message, state: FSMContext) -> None:
     doc = message.document
     if doc and doc.mime_type and doc.mime_type.startswith("image/"):
+        try:
+            check_upload_size(doc.file_size)
+        except ImageRejected as exc:
+            await message.answer(str(exc))
+            return
         await state.update_data(example_logo_file_id=doc.file_id)
-        save_examples(await state.get_data())
+        await save_example_fields(example_logo_file_id=doc.file_id)
         await state.set_state(None)
         await message.answer("Логотип сохранён.", reply_markup=example_builder_keyboard(await state.get_data()))
     else:
@@ -192,16 +203,20 @@ async def example_wrong_logo(message: Message) -> None:
 
 
 @router.message(ExampleStates.waiting_for_photos, F.photo)
-async def example_collect_photos(message: Message, state: FSMContext) -> None:
+async def example_collect_photos(message: Message, state: FSMContext, album: list[Message] | None = None) -> None:
+    # Запоминаем до чтения FSM, чтобы между get_data и update_data не было ожиданий (фото, присланные подряд, не теряются).
+    new_ids = await asyncio.to_thread(remember_photos, [part.photo for part in (album or [message]) if part.photo])
     data = await state.get_data()
-    photo_ids: list[str] = data.get("example_photo_file_ids", [])
+    photo_ids: list[str] = list(data.get("example_photo_file_ids", []))
     if len(photo_ids) >= 3:
         await message.answer("Лимит: 3 фото.")
         return
-    photo_ids.append(message.photo[-1].file_id)
+    # Альбом добавляется целиком (в пределах лимита), по порядку отправки.
+    photo_ids.extend(new_ids)
+    photo_ids = photo_ids[:3]
     await state.update_data(example_photo_file_ids=photo_ids)
     # Сохраняем пример на диск, чтобы переживал перезапуск.
-    save_examples(await state.get_data())
+    await save_example_fields(example_photo_file_ids=photo_ids)
     await message.answer(
         f"Фото добавлено: {len(photo_ids)}/3",
         reply_markup=cancel_keyboard(extra_buttons=[[InlineKeyboardButton(text="✅ Готово с фото", callback_data="example_photos_done")]]),
@@ -215,7 +230,7 @@ async def example_features_input(message: Message, state: FSMContext) -> None:
         await message.answer("Характеристики пустые.")
         return
     await state.update_data(example_features=value)
-    save_examples(await state.get_data())
+    await save_example_fields(example_features=value)
     await state.set_state(None)
     await message.answer("Характеристики сохранены.", reply_markup=example_builder_keyboard(await state.get_data()))
 
@@ -227,7 +242,7 @@ async def example_description_input(message: Message, state: FSMContext) -> None
         await message.answer("Описание пустое.")
         return
     await state.update_data(example_description=value)
-    save_examples(await state.get_data())
+    await save_example_fields(example_description=value)
     await state.set_state(None)
     await message.answer("Описание сохранено.", reply_markup=example_builder_keyboard(await state.get_data()))
 
@@ -239,7 +254,7 @@ async def example_price_input(message: Message, state: FSMContext) -> None:
         await message.answer("Название+цена пустые.")
         return
     await state.update_data(example_price_text=value)
-    save_examples(await state.get_data())
+    await save_example_fields(example_price_text=value)
     await state.set_state(None)
     await message.answer("Название+цена сохранены.", reply_markup=example_builder_keyboard(await state.get_data()))
 
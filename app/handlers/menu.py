@@ -22,11 +22,11 @@ async def start_handler(message: Message, state: FSMContext) -> None:
     if len(parts) == 2:
         payload = parts[1].strip()
         if payload:
-            invite_label = consume_invite(payload)
+            invite_label = await consume_invite(payload)
             if invite_label is not None:
                 # Зарегистрируем пользователя и покажем главное меню
-                ensure_user_role(user_id, as_admin=False)
-                role = get_role(user_id)
+                await ensure_user_role(user_id, as_admin=False)
+                role = await get_role(user_id)
                 extra = f" «{invite_label}»" if invite_label else ""
                 await message.answer(
                     f"Вы вошли в бота по инвайт‑ссылке{extra}.",
@@ -34,7 +34,7 @@ async def start_handler(message: Message, state: FSMContext) -> None:
                 )
                 return
 
-    role = get_role(user_id)
+    role = await get_role(user_id)
     if role == "guest":
         kb = InlineKeyboardMarkup(
             inline_keyboard=[
@@ -67,9 +67,9 @@ async def login_start(callback: CallbackQuery, state: FSMContext) -> None:
 async def login_user(callback: CallbackQuery, state: FSMContext) -> None:
     await state.clear()
     user_id = callback.from_user.id if callback.from_user else 0
-    ensure_user_role(user_id, as_admin=False)
+    await ensure_user_role(user_id, as_admin=False)
     await callback.answer()
-    role = get_role(user_id)
+    role = await get_role(user_id)
     await callback.message.edit_text("Вы зарегистрированы как пользователь.", reply_markup=main_menu_keyboard(role))
 
 
@@ -79,10 +79,10 @@ async def login_admin(callback: CallbackQuery, state: FSMContext) -> None:
     user_id = callback.from_user.id if callback.from_user else 0
     username = callback.from_user.username or ""
     display = f"@{username}" if username else str(user_id)
-    add_admin_request(user_id, display)
+    await add_admin_request(user_id, display)
 
     # Рассылаем уведомление всем администраторам (root_admin + admin)
-    admin_ids = get_all_admin_ids()
+    admin_ids = await get_all_admin_ids()
     text = (
         "Новая заявка на роль администратора.\n"
         f"Пользователь: {display}\n"
@@ -109,7 +109,7 @@ async def login_admin(callback: CallbackQuery, state: FSMContext) -> None:
 async def cancel_callback(callback: CallbackQuery, state: FSMContext) -> None:
     await state.clear()
     user_id = callback.from_user.id if callback.from_user else 0
-    role = get_role(user_id)
+    role = await get_role(user_id)
     if role == "guest":
         kb = InlineKeyboardMarkup(
             inline_keyboard=[[InlineKeyboardButton(text="ВОЙТИ", callback_data="login_start")]]
@@ -144,7 +144,7 @@ async def fallback_to_main_menu(message: Message, state: FSMContext) -> None:
         return
 
     user_id = message.from_user.id if message.from_user else 0
-    role = get_role(user_id)
+    role = await get_role(user_id)
     if role == "guest":
         kb = InlineKeyboardMarkup(
             inline_keyboard=[[InlineKeyboardButton(text="ВОЙТИ", callback_data="login_start")]]
@@ -0,0 +1,125 @@
+import mmap
+from io import BytesIO
+from pathlib import Path
+from typing import BinaryIO
+
+from PIL import Image
+
+
+# Максимальный размер файла, который бот вообще скачивает (фото, логотипы, документы).
+MAX_UPLOAD_BYTES = 15 * 1024 * 1024
+# С локальным сервером Bot API файлы не качаются по HTTP, а отображаются в память с общего тома,
+# поэтому и лимит — как у самого сервера (2000 МБ); от «тяжёлых» картинок защищает MAX_IMAGE_PIXELS.
+LOCAL_MAX_UPLOAD_BYTES = 2000 * 1024 * 1024
+# Максимум пикселей по заголовку картинки: всё больше — отклоняем, не декодируя (защита от «бомб»).
+MAX_IMAGE_PIXELS = 50_000_000
+# Размер карточки в пикселях — больше этого ни одна картинка на ней не нужна.
+CARD_SIZE = (1921, 1081)
+# Размеры слотов шаблона в пикселях карточки (width/height <image> × масштаб transform в SVG).
+SLOT_SIZES: dict[str, tuple[int, int]] = {
+    "main": (887, 645),
+    "minor1": (383, 268),
+    "minor2": (383, 256),
+    "logo": (479, 338),
+}
+
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+class ImageRejected(ValueError):
+    """Файл не принят: слишком большой или не картинка. Текст исключения можно показывать пользователю."""
+
+
+def _format_mb(size: int) -> str:
+    return f"{size / (1024 * 1024):.1f}".rstrip("0").rstrip(".")
+
+
+# Действующий лимит: MAX_UPLOAD_BYTES или LOCAL_MAX_UPLOAD_BYTES (задаётся при создании бота).
+_UPLOAD_LIMIT = MAX_UPLOAD_BYTES
+
+
+def set_upload_limit(limit: int) -> None:
+    global _UPLOAD_LIMIT
+    _UPLOAD_LIMIT = limit
+
+
+def check_upload_size(size: int | None, limit: int | None = None) -> None:
+    """Проверяет размер файла по данным Telegram ещё до скачивания."""
+    limit = limit or _UPLOAD_LIMIT
+    if size is not None and size > limit:
+        raise ImageRejected(
+            f"Файл слишком большой ({_format_mb(size)} МБ). "
+            f"Максимум — {_format_mb(limit)} МБ, уменьшите изображение и отправьте снова."
+        )
+
+
+class CappedBuffer(BytesIO):
+    """Буфер для потокового скачивания: прерывает загрузку, как только превышен лимит."""
+
+    def __init__(self, limit: int | None = None) -> None:
+        super().__init__()
+        self.limit = limit or _UPLOAD_LIMIT
+
+    def write(self, data: bytes) -> int:  # type: ignore[override]
+        check_upload_size(self.tell() + len(data), self.limit)
+        return super().write(data)
+
+
+def _stream(data: bytes | mmap.mmap) -> BinaryIO:
+    if isinstance(data, mmap.mmap):
+        # mmap сам по себе файлоподобный: PIL читает страницы файла напрямую, без копии в памяти.
+        data.seek(0)
+        return data  # type: ignore[return-value]
+    return BytesIO(data)
+
+
+def sniff_image_size(data: bytes | mmap.mmap) -> tuple[int, int]:
+    """Читает размеры картинки из заголовка файла, не декодируя пиксели."""
+    try:
+        with Image.open(_stream(data)) as img:
+            width, height = img.size
+    except Image.DecompressionBombError as exc:
+        raise ImageRejected("Изображение слишком большое по разрешению. Уменьшите его и отправьте снова.") from exc
+    except Exception as exc:  # noqa: BLE001
+        raise ImageRejected("Не удалось прочитать изображение. Отправьте PNG или JPG.") from exc
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageRejected("Изображение слишком большое по разрешению. Уменьшите его и отправьте снова.")
+    return width, height
+
+
+def fit_image(data: bytes | mmap.mmap, box: tuple[int, int] | None = None) -> bytes:
+    """
+    Проверяет картинку по заголовку и, если она больше слота, сразу уменьшает её до размера слота.
+    Для JPEG используется draft-режим: декодер сразу отдаёт уменьшенную в 2–8 раз картинку, не занимая память
+    под полный кадр. Картинки, которые и так помещаются в слот, возвращаются без перекодирования.
+    """
+    box = box or CARD_SIZE
+    width, height = sniff_image_size(data)
+    if width <= box[0] and height <= box[1]:
+        return data[:] if isinstance(data, mmap.mmap) else data
+    with Image.open(_stream(data)) as img:
+        if img.format == "JPEG":
+            img.draft("RGB", box)
+        img.thumbnail(box, Image.Resampling.LANCZOS)
+        has_alpha = img.mode in ("RGBA", "LA", "P") and (img.mode != "P" or "transparency" in img.info)
+        out = BytesIO()
+        if has_alpha:
+            img.save(out, "PNG", optimize=True)
+        else:
+            img.convert("RGB").save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def fit_image_file(path: Path, box: tuple[int, int] | None = None) -> bytes:
+    """
+    То же, что fit_image, но для файла на диске (локальный сервер Bot API): файл отображается в память (mmap),
+    и в процесс попадают только страницы, которые читает декодер, а не всё содержимое целиком.
+    """
+    with path.open("rb") as file:
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as exc:
+            # Пустой файл: mmap нулевой длины не создаётся.
+            raise ImageRejected("Не удалось прочитать изображение. Отправьте PNG или JPG.") from exc
+        with data:
+            return fit_image(data, box)
@@ -0,0 +1,181 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from .constants import DATA_DIR
+
+
+logger = logging.getLogger(__name__)
+
+# Журнал генераций карточек: входные данные и статус каждого задания. Переживает падение процесса и Chromium.
+JOURNAL_PATH = DATA_DIR / "jobs.sqlite3"
+# Завершённые задания хранятся неделю (для разбора жалоб), потом удаляются при старте.
+KEEP_FINISHED_SECONDS = 7 * 24 * 3600
+
+# Статусы задания:
+# queued  — принято, но ещё не начато (например, запрошено во время остановки бота);
+# running — собирается; если процесс упал, при старте задание найдётся в этом статусе;
+# done    — карточка отправлена;
+# failed  — ошибка; можно повторить кнопкой «Повторить» (кроме отклонённых фото, см. retryable).
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+UNFINISHED = (QUEUED, RUNNING)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    retryable INTEGER NOT NULL DEFAULT 1,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user_id, created_at);
+"""
+# Стоимость генерации (quotas.RenderCost), суммируется по всем попыткам. Колонки добавляются и в старые журналы.
+_COST_COLUMNS = {
+    "wall_time": "REAL NOT NULL DEFAULT 0",
+    "cpu_time": "REAL NOT NULL DEFAULT 0",
+    "bytes_in": "INTEGER NOT NULL DEFAULT 0",
+    "bytes_out": "INTEGER NOT NULL DEFAULT 0",
+}
+
+_CONN: sqlite3.Connection | None = None
+_LOCK = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    global _CONN
+    if _CONN is None:
+        DATA_DIR.mkdir(exist_ok=True)
+        # autocommit (isolation_level=None): каждая запись сразу на диске; WAL — чтобы запись не блокировала чтение.
+        conn = sqlite3.connect(JOURNAL_PATH, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        existing = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for name, decl in _COST_COLUMNS.items():
+            if name not in existing:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {decl}")
+        _CONN = conn
+    return _CONN
+
+
+def _execute(sql: str, params: tuple[Any, ...] = ()) -> list[sqlite3.Row]:
+    with _LOCK:
+        return _connect().execute(sql, params).fetchall()
+
+
+def record_job(job_id: str, chat_id: int, user_id: int, data: dict[str, Any], created_at: float, status: str = QUEUED) -> None:
+    """Добавляет задание в журнал (повторная запись того же job_id ничего не меняет)."""
+    now = time.time()
+    _execute(
+        "INSERT OR IGNORE INTO jobs (job_id, chat_id, user_id, data, status, created_at, updated_at)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (job_id, chat_id, user_id, json.dumps(data, ensure_ascii=False, default=str), status, created_at, now),
+    )
+
+
+def mark_running(job_id: str) -> int:
+    """Задание начато: статус running, счётчик попыток +1. Возвращает номер попытки."""
+    rows = _execute(
+        "UPDATE jobs SET status = ?, attempts = attempts + 1, error = NULL, updated_at = ? WHERE job_id = ? RETURNING attempts",
+        (RUNNING, time.time(), job_id),
+    )
+    return int(rows[0]["attempts"]) if rows else 0
+
+
+def mark_done(job_id: str) -> None:
+    _execute("UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?", (DONE, time.time(), job_id))
+
+
+def mark_failed(job_id: str, error: str, retryable: bool = True) -> None:
+    _execute(
+        "UPDATE jobs SET status = ?, error = ?, retryable = ?, updated_at = ? WHERE job_id = ?",
+        (FAILED, error[:1000], int(retryable), time.time(), job_id),
+    )
+
+
+def mark_queued(job_ids: list[str]) -> None:
+    """Возвращает задания в очередь (остановка бота до их завершения)."""
+    now = time.time()
+    with _LOCK:
+        conn = _connect()
+        conn.executemany("UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?", [(QUEUED, now, job_id) for job_id in job_ids])
+
+
+def add_cost(job_id: str, wall_time: float, cpu_time: float, bytes_in: int, bytes_out: int) -> None:
+    _execute(
+        "UPDATE jobs SET wall_time = wall_time + ?, cpu_time = cpu_time + ?, bytes_in = bytes_in + ?,"
+        " bytes_out = bytes_out + ? WHERE job_id = ?",
+        (wall_time, cpu_time, bytes_in, bytes_out, job_id),
+    )
+
+
+def usage_by_user(since: float, user_id: int | None = None) -> list[dict[str, Any]]:
+    """
+    Расход по пользователям за период (с момента since): число заданий, из них собранных, и суммарная стоимость.
+    Отсортировано по времени генерации, самые «дорогие» — первыми.
+    """
+    where = "created_at >= ?" + (" AND user_id = ?" if user_id is not None else "")
+    params: tuple[Any, ...] = (DONE, since) if user_id is None else (DONE, since, user_id)
+    rows = _execute(
+        "SELECT user_id, COUNT(*) AS jobs, SUM(status = ?) AS done, SUM(wall_time) AS wall_time,"
+        " SUM(cpu_time) AS cpu_time, SUM(bytes_in) AS bytes_in, SUM(bytes_out) AS bytes_out"
+        f" FROM jobs WHERE {where} GROUP BY user_id ORDER BY SUM(wall_time) DESC",
+        params,
+    )
+    return [dict(row) for row in rows]
+
+
+def get_job(job_id: str) -> dict[str, Any] | None:
+    rows = _execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+    return _row_to_dict(rows[0]) if rows else None
+
+
+def unfinished_jobs() -> list[dict[str, Any]]:
+    """Задания, которые не завершились: отложенные при остановке и прерванные падением процесса."""
+    rows = _execute(
+        f"SELECT * FROM jobs WHERE status IN ({','.join('?' * len(UNFINISHED))}) ORDER BY created_at",
+        UNFINISHED,
+    )
+    return [_row_to_dict(row) for row in rows]
+
+
+def prune_finished(keep_seconds: float = KEEP_FINISHED_SECONDS) -> int:
+    """Удаляет старые завершённые задания. Возвращает число удалённых."""
+    rows = _execute(
+        "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ? RETURNING job_id",
+        (DONE, FAILED, time.time() - keep_seconds),
+    )
+    return len(rows)
+
+
+def _row_to_dict(row: sqlite3.Row) -> dict[str, Any]:
+    item = dict(row)
+    try:
+        item["data"] = json.loads(item["data"])
+    except ValueError:
+        logger.error("Повреждённые данные задания %s в журнале", item["job_id"])
+        item["data"] = {}
+    item["retryable"] = bool(item["retryable"])
+    return item
+
+
+def close_journal() -> None:
+    global _CONN
+    with _LOCK:
+        if _CONN is not None:
+            _CONN.close()
+            _CONN = None
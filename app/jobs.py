@@ -0,0 +1,232 @@
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from . import job_journal
+from .constants import DATA_DIR, OUTPUT_DIR
+from .quotas import RenderCost
+from .store_io import run_io
+
+
+logger = logging.getLogger(__name__)
+
+# Карточки, отложенные до перезапуска в версиях до журнала: при старте переносятся в журнал (job_journal).
+PENDING_JOBS_PATH = DATA_DIR / "pending_jobs.json"
+# Сколько ждать незавершённые карточки при остановке (Docker по умолчанию даёт 10 с, в docker-compose — 60 с).
+DRAIN_TIMEOUT = 45.0
+# Сколько секунд после отправки карточки повторное нажатие «Готово» с теми же данными считается дублем.
+DUPLICATE_WINDOW = 30.0
+
+
+@dataclass
+class CardJob:
+    """Одна генерация карточки: куда отправить результат и данные анкеты (FSM state data)."""
+
+    chat_id: int
+    user_id: int
+    data: dict[str, Any]
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    created_at: float = field(default_factory=time.time)
+    # Сколько раз задание уже начиналось (по журналу); растёт и при перезапусках после падения.
+    attempts: int = 0
+
+    @classmethod
+    def from_journal(cls, item: dict[str, Any]) -> "CardJob":
+        return cls(
+            chat_id=int(item["chat_id"]),
+            user_id=int(item["user_id"]),
+            data=dict(item["data"]),
+            job_id=str(item["job_id"]),
+            created_at=float(item["created_at"]),
+            attempts=int(item.get("attempts") or 0),
+        )
+
+
+# job_id -> (задание, задача asyncio, которая его выполняет)
+_ACTIVE: dict[str, tuple[CardJob, asyncio.Task]] = {}
+_DRAINING = False
+
+
+def is_draining() -> bool:
+    """True после начала остановки: новые карточки уже не собираются, а откладываются до перезапуска."""
+    return _DRAINING
+
+
+def _record(job: CardJob, status: str = job_journal.QUEUED) -> None:
+    job_journal.record_job(job.job_id, job.chat_id, job.user_id, job.data, job.created_at, status=status)
+
+
+def _start(job: CardJob) -> int:
+    _record(job)
+    return job_journal.mark_running(job.job_id)
+
+
+# Журнал — sqlite с записью на диск при каждом изменении: все обращения к нему идут в пуле хранилищ (run_io),
+# а не в цикле событий.
+async def start_job(job: CardJob) -> None:
+    """Задание начато: пишется в журнал (running), так что после падения процесса его можно досоздать."""
+    # Сначала регистрируем: остановка (drain), начавшаяся во время записи, должна дождаться и этого задания.
+    task = asyncio.current_task()
+    if task is not None:
+        _ACTIVE[job.job_id] = (job, task)
+    job.attempts = await run_io(_start, job)
+
+
+async def finish_job(job: CardJob, cost: RenderCost | None = None) -> None:
+    """Задание больше не выполняется (успешно, с ошибкой или отменено); cost — стоимость этой попытки."""
+    _ACTIVE.pop(job.job_id, None)
+    if cost is not None:
+        await run_io(job_journal.add_cost, job.job_id, cost.wall, cost.cpu, cost.bytes_in, cost.bytes_out)
+
+
+async def complete_job(job: CardJob) -> None:
+    await run_io(job_journal.mark_done, job.job_id)
+
+
+async def fail_job(job: CardJob, error: str, retryable: bool = True) -> None:
+    """Задание завершилось ошибкой. retryable=False — повтор бессмыслен (например, фото отклонены)."""
+    await run_io(functools.partial(job_journal.mark_failed, job.job_id, error, retryable=retryable))
+
+
+def active_jobs() -> list[CardJob]:
+    return [job for job, _ in _ACTIVE.values()]
+
+
+def _import_legacy_pending() -> None:
+    """Переносит задания из pending_jobs.json (старый формат отложенных карточек) в журнал."""
+    if not PENDING_JOBS_PATH.exists():
+        return
+    try:
+        raw = json.loads(PENDING_JOBS_PATH.read_text(encoding="utf-8"))
+        for item in raw:
+            if isinstance(item, dict):
+                _record(CardJob(**item))
+    except Exception:  # noqa: BLE001
+        logger.exception("Не удалось прочитать %s", PENDING_JOBS_PATH.name)
+    PENDING_JOBS_PATH.unlink(missing_ok=True)
+
+
+def _load_pending() -> list[CardJob]:
+    _import_legacy_pending()
+    return [CardJob.from_journal(item) for item in job_journal.unfinished_jobs()]
+
+
+async def load_pending_jobs() -> list[CardJob]:
+    """Незавершённые задания из журнала: отложенные при остановке и прерванные падением процесса."""
+    return await run_io(_load_pending)
+
+
+async def load_job(job_id: str) -> tuple[CardJob, str, bool] | None:
+    """Задание из журнала: (задание, статус, можно ли повторить) или None, если его нет (или уже удалено)."""
+    item = await run_io(job_journal.get_job, job_id)
+    if item is None:
+        return None
+    return CardJob.from_journal(item), str(item["status"]), bool(item["retryable"])
+
+
+async def defer_job(job: CardJob) -> None:
+    """Откладывает задание до следующего запуска (карточка запрошена во время остановки)."""
+    await run_io(_record, job)
+
+
+async def drain(timeout: float = DRAIN_TIMEOUT) -> list[CardJob]:
+    """
+    Останавливает приём новых карточек и ждёт уже начатые не дольше timeout.
+    Не успевшие задания возвращаются в очередь журнала (досоздаются при следующем запуске) и возвращаются.
+    """
+    global _DRAINING
+    _DRAINING = True
+    if not _ACTIVE:
+        return []
+    logger.info("Остановка: жду %s карточек (до %.0f с)", len(_ACTIVE), timeout)
+    tasks = {task for _, task in _ACTIVE.values()}
+    await asyncio.wait(tasks, timeout=timeout)
+    unfinished = active_jobs()
+    if unfinished:
+        await run_io(job_journal.mark_queued, [job.job_id for job in unfinished])
+        logger.warning("Остановка: %s карточек отложено до следующего запуска", len(unfinished))
+        cancelled = [task for _, task in _ACTIVE.values()]
+        for task in cancelled:
+            task.cancel()
+        # Отменённые задания дописывают журнал в finally (тоже через пул) — даём им закончить до закрытия журнала.
+        await asyncio.wait(cancelled, timeout=5)
+    return unfinished
+
+
+# Single-flight: ключ (чат + отпечаток данных анкеты) -> результат выполняющейся генерации.
+_IN_FLIGHT: dict[str, asyncio.Future[bool]] = {}
+# Недавно отправленные карточки: ключ -> время отправки (monotonic); и то же по чатам.
+_RECENT: dict[str, float] = {}
+_RECENT_CHATS: dict[int, float] = {}
+
+
+def job_key(chat_id: int, data: dict[str, Any]) -> str:
+    """Отпечаток запроса карточки: чат + данные анкеты (порядок ключей не важен)."""
+    canonical = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return f"{chat_id}:{hashlib.sha1(canonical.encode('utf-8')).hexdigest()}"
+
+
+def _prune_recent(now: float) -> None:
+    for store in (_RECENT, _RECENT_CHATS):
+        for key in [k for k, ts in store.items() if now - ts > DUPLICATE_WINDOW]:
+            del store[key]
+
+
+def recently_sent(chat_id: int) -> bool:
+    """True, если в этот чат только что (DUPLICATE_WINDOW) ушла карточка — анкета уже очищена, а нажатие запоздало."""
+    _prune_recent(time.monotonic())
+    return chat_id in _RECENT_CHATS
+
+
+async def single_flight(chat_id: int, data: dict[str, Any], run: Callable[[], Awaitable[bool]]) -> tuple[bool, str]:
+    """
+    Запускает генерацию не больше одного раза на одинаковый запрос.
+    Возвращает (успех, как обработан): "run" — выполнено сейчас; "joined" — такой же запрос уже выполнялся,
+    дождались его результата; "recent" — такая же карточка только что отправлена, повторять не нужно.
+    """
+    key = job_key(chat_id, data)
+    _prune_recent(time.monotonic())
+    if key in _RECENT:
+        return True, "recent"
+    in_flight = _IN_FLIGHT.get(key)
+    if in_flight is not None:
+        # shield: отмена дубля (например, при остановке) не должна отменять исходную генерацию.
+        return await asyncio.shield(in_flight), "joined"
+    future: asyncio.Future[bool] = asyncio.get_running_loop().create_future()
+    _IN_FLIGHT[key] = future
+    ok = False
+    try:
+        ok = await run()
+    finally:
+        _IN_FLIGHT.pop(key, None)
+        future.set_result(ok)
+        if ok:
+            now = time.monotonic()
+            _RECENT[key] = now
+            _RECENT_CHATS[chat_id] = now
+    return ok, "run"
+
+
+def cleanup_output() -> int:
+    """
+    Удаляет файлы карточек, оставшиеся в output/ после аварийной остановки.
+    Вызывается при старте, когда ни одна карточка ещё не собирается.
+    """
+    removed = 0
+    if not OUTPUT_DIR.exists():
+        return 0
+    for path in OUTPUT_DIR.glob("card_*"):
+        try:
+            path.unlink()
+            removed += 1
+        except OSError:
+            continue
+    if removed:
+        logger.info("Удалено %s файлов, оставшихся в output/ после прошлого запуска", removed)
+    return removed
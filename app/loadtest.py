@@ -0,0 +1,536 @@
+"""
+Нагрузочный тест бота: локальный заменитель Telegram Bot API + N пользователей, проходящих сценарий
+«Создать карточку» через настоящие Dispatcher, хендлеры, рендер и конвейер отправки.
+
+    python -m app.loadtest --users 20 --ramp 10
+    python -m app.loadtest --users 20 --local-api   # как со своим сервером Bot API: файлы с диска, без HTTP
+
+Бот работает во временных DATA_DIR/OUTPUT_DIR (реальные data/ и output/ не трогаются).
+В конце печатается отчёт: пропускная способность, перцентили задержек, память, число процессов Chromium.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from io import BytesIO
+from pathlib import Path
+from typing import Any
+
+from aiohttp import web
+from PIL import Image
+
+
+logger = logging.getLogger(__name__)
+
+BOT_TOKEN = "123456:LOAD-TEST"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+# id симулируемых пользователей: FIRST_USER_ID, FIRST_USER_ID + 1, ...
+FIRST_USER_ID = 900_000_000
+# Фото, которое «скачивают» все пользователи: как снимок с телефона, заметно больше слота шаблона.
+PHOTO_SIZE = (2400, 1800)
+# Уменьшенные копии, которые Telegram хранит вместе с фото (длинная сторона), — как в message.photo.
+PHOTO_THUMB_SIDES = (320, 800, 1280)
+# Как часто снимать память и процессы (секунды).
+SAMPLE_INTERVAL = 0.5
+
+SPEC_ANSWERS = ("Ryzen 7 7535HS", "RTX 4060", "16", "512", '15.6" IPS 144 Гц')
+
+
+def _make_photos() -> dict[tuple[int, int], bytes]:
+    """Исходное фото и его уменьшенные копии: размер -> JPEG."""
+    noise = Image.effect_noise(PHOTO_SIZE, 40).convert("RGB")
+    gradient = Image.linear_gradient("L").resize(PHOTO_SIZE).convert("RGB")
+    full = Image.blend(noise, gradient, 0.6)
+    photos: dict[tuple[int, int], bytes] = {}
+    for side in (*PHOTO_THUMB_SIDES, PHOTO_SIZE[0]):
+        size = (side, round(side * PHOTO_SIZE[1] / PHOTO_SIZE[0]))
+        out = BytesIO()
+        full.resize(size, Image.Resampling.LANCZOS).save(out, "JPEG", quality=90)
+        photos[size] = out.getvalue()
+    return photos
+
+
+@dataclass
+class ApiCall:
+    method: str
+    chat_id: int | None
+    ts: float
+    text: str = ""
+
+
+class FakeTelegram:
+    """
+    Заменитель Bot API на aiohttp: getUpdates (long polling), getFile, скачивание файлов и методы отправки.
+    Входящие апдейты кладут симулируемые пользователи, исходящие вызовы бота записываются по чатам.
+    """
+
+    def __init__(self, files_dir: Path | None = None) -> None:
+        self.photos = _make_photos()
+        # Режим --local: getFile отдаёт абсолютный путь к файлу в files_dir, как telegram-bot-api --local.
+        self.files_dir = files_dir
+        self.downloaded_bytes = 0
+        self.calls: dict[int | None, list[ApiCall]] = {}
+        self.method_counts: dict[str, int] = {}
+        self.last_bot_message: dict[int, dict[str, Any]] = {}
+        self._updates: list[dict[str, Any]] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_update = asyncio.Event()
+        self._chat_events: dict[int | None, asyncio.Event] = {}
+        self._runner: web.AppRunner | None = None
+        self.base_url = ""
+
+    async def start(self, port: int = 0) -> str:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self._handle_method)
+        app.router.add_get("/file/bot{token}/{path:.*}", self._handle_file)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        await site.start()
+        sockets = site._server.sockets if site._server else []  # noqa: SLF001
+        real_port = sockets[0].getsockname()[1] if sockets else port
+        self.base_url = f"http://127.0.0.1:{real_port}"
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    # --- входящие апдейты (от «пользователей») ---
+
+    def _user(self, user_id: int) -> dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def _push(self, update: dict[str, Any]) -> None:
+        update["update_id"] = next(self._update_ids)
+        self._updates.append(update)
+        self._new_update.set()
+
+    def push_text(self, user_id: int, text: str) -> None:
+        self._push({"message": self._user_message(user_id, text=text)})
+
+    def push_photo(self, user_id: int, file_id: str, media_group_id: str | None = None) -> None:
+        # file_id копии — "<file_id>_<ширина>", у исходного размера — сам file_id.
+        sizes = [
+            {
+                "file_id": file_id if size == PHOTO_SIZE else f"{file_id}_{size[0]}",
+                "file_unique_id": f"{file_id}_{size[0]}",
+                "width": size[0],
+                "height": size[1],
+                "file_size": len(data),
+            }
+            for size, data in self.photos.items()
+        ]
+        extra: dict[str, Any] = {"photo": sizes}
+        if media_group_id:
+            extra["media_group_id"] = media_group_id
+        self._push({"message": self._user_message(user_id, **extra)})
+
+    def push_callback(self, user_id: int, data: str) -> None:
+        message = self.last_bot_message.get(user_id) or self._bot_message(user_id, text="Главное меню")
+        self._push(
+            {
+                "callback_query": {
+                    "id": str(next(self._message_ids)),
+                    "from": self._user(user_id),
+                    "chat_instance": str(user_id),
+                    "data": data,
+                    "message": message,
+                }
+            }
+        )
+
+    def _user_message(self, user_id: int, **extra: Any) -> dict[str, Any]:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"user{user_id}"},
+            "from": self._user(user_id),
+            **extra,
+        }
+
+    def _bot_message(self, chat_id: int, **extra: Any) -> dict[str, Any]:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            **extra,
+        }
+
+    # --- ожидание ответов бота ---
+
+    def mark(self, chat_id: int) -> int:
+        return len(self.calls.get(chat_id, []))
+
+    async def wait_for(self, chat_id: int, since: int, predicate: Any, timeout: float) -> ApiCall:
+        """Ждёт вызов бота в чат chat_id (после позиции since), для которого predicate(call) истинно."""
+        deadline = time.monotonic() + timeout
+        while True:
+            for call in self.calls.get(chat_id, [])[since:]:
+                if predicate(call):
+                    return call
+            since = len(self.calls.get(chat_id, []))
+            event = self._chat_events.setdefault(chat_id, asyncio.Event())
+            event.clear()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            await asyncio.wait_for(event.wait(), remaining)
+
+    def _record(self, method: str, chat_id: int | None, text: str) -> None:
+        self.method_counts[method] = self.method_counts.get(method, 0) + 1
+        self.calls.setdefault(chat_id, []).append(ApiCall(method, chat_id, time.monotonic(), text))
+        event = self._chat_events.get(chat_id)
+        if event is not None:
+            event.set()
+
+    # --- HTTP ---
+
+    async def _handle_file(self, request: web.Request) -> web.Response:
+        path = request.match_info["path"]
+        self._record("downloadFile", None, path)
+        body = self._photo_for(path.rsplit("/", 1)[-1].removesuffix(".jpg"))
+        self.downloaded_bytes += len(body)
+        return web.Response(body=body, content_type="image/jpeg")
+
+    def _photo_for(self, file_id: str) -> bytes:
+        suffix = file_id.rsplit("_", 1)[-1]
+        for size, data in self.photos.items():
+            if suffix == str(size[0]) and size != PHOTO_SIZE:
+                return data
+        return self.photos[PHOTO_SIZE]
+
+    async def _handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params: dict[str, Any] = {}
+        if request.method == "POST" and request.can_read_body:
+            form = await request.post()
+            for key, value in form.items():
+                params[key] = value if isinstance(value, str) else getattr(value, "filename", "")
+        params.update(request.query)
+        result = await self._dispatch(method.lower(), params)
+        return web.json_response({"ok": True, "result": result})
+
+    async def _dispatch(self, method: str, params: dict[str, Any]) -> Any:
+        chat_id = int(params["chat_id"]) if str(params.get("chat_id", "")).lstrip("-").isdigit() else None
+        if method == "getupdates":
+            return await self._get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0))
+        if method == "getme":
+            return BOT_USER
+        if method == "getfile":
+            file_id = str(params.get("file_id"))
+            self._record("getFile", None, file_id)
+            file_path = f"photos/{file_id}.jpg"
+            if self.files_dir is not None:
+                local_path = self.files_dir / file_path
+                if not local_path.exists():
+                    local_path.parent.mkdir(parents=True, exist_ok=True)
+                    local_path.write_bytes(self._photo_for(file_id))
+                file_path = str(local_path)
+            return {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_size": len(self._photo_for(file_id)),
+                "file_path": file_path,
+            }
+        text = str(params.get("text") or params.get("caption") or "")
+        self._record(method, chat_id, text)
+        if chat_id is None:
+            return True
+        if method in ("sendmessage", "editmessagetext"):
+            message = self._bot_message(chat_id, text=text)
+        elif method == "sendphoto":
+            file_id = f"sent_{next(self._message_ids)}"
+            message = self._bot_message(
+                chat_id, caption=text, photo=[{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 720}]
+            )
+        elif method == "senddocument":
+            file_id = f"sent_{next(self._message_ids)}"
+            message = self._bot_message(chat_id, caption=text, document={"file_id": file_id, "file_unique_id": file_id})
+        elif method == "sendmediagroup":
+            media = json.loads(params.get("media") or "[]")
+            messages = []
+            for item in media:
+                file_id = f"sent_{next(self._message_ids)}"
+                kind = item.get("type", "document")
+                payload = (
+                    {"photo": [{"file_id": file_id, "file_unique_id": file_id, "width": 480, "height": 270}]}
+                    if kind == "photo"
+                    else {"document": {"file_id": file_id, "file_unique_id": file_id}}
+                )
+                messages.append(self._bot_message(chat_id, **payload))
+            return messages
+        elif method == "editmessagereplymarkup":
+            message = self.last_bot_message.get(chat_id) or self._bot_message(chat_id, text="")
+        else:
+            return True
+        if "reply_markup" in params:
+            message["reply_markup"] = json.loads(params["reply_markup"])
+        self.last_bot_message[chat_id] = message
+        return message
+
+    async def _get_updates(self, offset: int, timeout: float) -> list[dict[str, Any]]:
+        if offset:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(self._updates[:100])
+
+
+@dataclass
+class UserResult:
+    user_id: int
+    template_id: int
+    ok: bool = False
+    error: str = ""
+    # От последней характеристики до присланной карточки (вся генерация, как её видит пользователь).
+    card_latency: float | None = None
+    # Время ответа бота на каждый шаг диалога.
+    step_latencies: list[float] = field(default_factory=list)
+    total: float = 0.0
+
+
+def _is_reply(call: ApiCall) -> bool:
+    return call.method in ("sendmessage", "editmessagetext")
+
+
+def _is_card_or_error(call: ApiCall) -> bool:
+    if call.method in ("sendphoto", "senddocument") and call.text.startswith("Готово"):
+        return True
+    return call.method == "sendmessage" and not call.text.startswith("Собираю")
+
+
+async def simulate_user(api: FakeTelegram, user_id: int, template_id: int, think: float, timeout: float) -> UserResult:
+    """Один пользователь: «Создать карточку» → шаблон → 3 фото альбомом → без логотипа → тексты → 5 характеристик."""
+    result = UserResult(user_id, template_id)
+    started = time.monotonic()
+
+    async def step(action: Any, predicate: Any = _is_reply) -> ApiCall:
+        since = api.mark(user_id)
+        sent = time.monotonic()
+        action()
+        call = await api.wait_for(user_id, since, predicate, timeout)
+        result.step_latencies.append(call.ts - sent)
+        await asyncio.sleep(think)
+        return call
+
+    try:
+        await step(lambda: api.push_callback(user_id, "menu_create_card"))
+        await step(lambda: api.push_callback(user_id, f"card_tpl:{template_id}"))
+
+        def send_album() -> None:
+            for idx in range(3):
+                api.push_photo(user_id, f"u{user_id}_p{idx}", media_group_id=f"album_{user_id}")
+
+        await step(send_album)
+        await step(lambda: api.push_callback(user_id, "card_skip_logo"))
+        await step(lambda: api.push_text(user_id, f"Ноутбук {user_id}"))
+        await step(lambda: api.push_text(user_id, "Подойдёт для игр, учёбы и работы с графикой."))
+        await step(lambda: api.push_text(user_id, "69 990 ₽"))
+        for answer in SPEC_ANSWERS[:-1]:
+            await step(lambda answer=answer: api.push_text(user_id, answer))
+
+        since = api.mark(user_id)
+        sent = time.monotonic()
+        api.push_text(user_id, SPEC_ANSWERS[-1])
+        call = await api.wait_for(user_id, since, _is_card_or_error, timeout)
+        result.card_latency = call.ts - sent
+        result.ok = call.method in ("sendphoto", "senddocument")
+        if not result.ok:
+            result.error = call.text[:200]
+    except asyncio.TimeoutError:
+        result.error = f"нет ответа за {timeout:.0f} с"
+    result.total = time.monotonic() - started
+    return result
+
+
+@dataclass
+class ResourceStats:
+    bot_rss_max: int = 0
+    total_rss_max: int = 0
+    chromium_processes_max: int = 0
+    browsers_max: int = 0
+
+
+def _sample_processes(pid: int) -> tuple[int, int, int]:
+    """(RSS бота, RSS вместе с дочерними процессами, процессов Chromium) — читает /proc, поэтому в потоке."""
+    from .metrics import descendants, is_chromium, rss
+
+    children = descendants(pid)
+    bot_rss = rss(pid)
+    return bot_rss, bot_rss + sum(rss(child) for child in children), sum(1 for child in children if is_chromium(child))
+
+
+async def sample_resources(stats: ResourceStats, stop: asyncio.Event) -> None:
+    from .browser import is_browser_running
+
+    pid = os.getpid()
+    while not stop.is_set():
+        # Не на цикле событий: иначе сам замер попадал бы в блокировки цикла и задержки ответов бота.
+        bot_rss, total_rss, chromium = await asyncio.to_thread(_sample_processes, pid)
+        stats.bot_rss_max = max(stats.bot_rss_max, bot_rss)
+        stats.total_rss_max = max(stats.total_rss_max, total_rss)
+        stats.chromium_processes_max = max(stats.chromium_processes_max, chromium)
+        stats.browsers_max = max(stats.browsers_max, int(is_browser_running()))
+        try:
+            await asyncio.wait_for(stop.wait(), SAMPLE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def _percentiles(values: list[float]) -> str:
+    if not values:
+        return "—"
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        p50 = p90 = p99 = ordered[0]
+    else:
+        cuts = statistics.quantiles(ordered, n=100, method="inclusive")
+        p50, p90, p99 = cuts[49], cuts[89], cuts[98]
+    return f"p50 {p50:.2f} с, p90 {p90:.2f} с, p99 {p99:.2f} с, max {ordered[-1]:.2f} с"
+
+
+def _mb(value: int) -> str:
+    return f"{value / (1024 * 1024):.0f} МБ" if value else "—"
+
+
+def print_report(results: list[UserResult], elapsed: float, stats: ResourceStats, api: FakeTelegram) -> None:
+    ok = [r for r in results if r.ok]
+    failed = [r for r in results if not r.ok]
+    print()
+    print(f"Пользователей: {len(results)}, карточек: {len(ok)}, ошибок: {len(failed)}, длительность: {elapsed:.1f} с")
+    print(f"Пропускная способность: {len(ok) / elapsed * 60:.1f} карточек/мин" if elapsed else "")
+    print(f"Генерация (последняя характеристика → карточка): {_percentiles([r.card_latency for r in ok if r.card_latency])}")
+    print(f"Ответ на шаг диалога: {_percentiles([x for r in results for x in r.step_latencies])}")
+    print(f"Сценарий целиком: {_percentiles([r.total for r in ok])}")
+    print(f"Память: бот {_mb(stats.bot_rss_max)}, вместе с Chromium {_mb(stats.total_rss_max)} (максимум)")
+    print(f"Chromium: процессов до {stats.chromium_processes_max}, браузеров до {stats.browsers_max}")
+    print("Запросы к Bot API: " + ", ".join(f"{k} {v}" for k, v in sorted(api.method_counts.items())))
+    print(f"Скачано файлов: {api.downloaded_bytes / (1024 * 1024):.1f} МБ")
+    errors: dict[str, int] = {}
+    for r in failed:
+        errors[r.error] = errors.get(r.error, 0) + 1
+    for error, count in sorted(errors.items(), key=lambda kv: -kv[1])[:5]:
+        print(f"  ошибка ×{count}: {error}")
+    from .loop_watchdog import top_offenders
+
+    offenders = top_offenders(5)
+    if offenders:
+        print("Блокировки цикла событий (место в коде бота — суммарно, раз, самая долгая, что выполнялось):")
+        for offender in offenders:
+            print(
+                f"  {offender.site} — {offender.blocked * 1000:.0f} мс, ×{offender.stalls}, "
+                f"до {offender.worst * 1000:.0f} мс ({offender.leaf})"
+            )
+
+
+async def run_loadtest(args: argparse.Namespace, work_dir: Path) -> list[UserResult]:
+    # Модули бота импортируются здесь: DATA_DIR/OUTPUT_DIR уже указывают во временный каталог.
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    from .bot import create_bot, create_dispatcher
+    from .config import AppConfig, build_settings
+    from .constants import BASE_DIR, ensure_dirs
+    from .context import set_app_config
+    from .template_registry import template_ids
+
+    ensure_dirs()
+    users = [FIRST_USER_ID + idx for idx in range(args.users)]
+    (work_dir / "data" / "auth.json").write_text(json.dumps({"users": users}), encoding="utf-8")
+    config_path = BASE_DIR / "config.json"
+    raw = json.loads(config_path.read_text(encoding="utf-8"))
+    app_config = AppConfig(BOT_TOKEN, set(), config_path, build_settings(raw, version=1))
+    set_app_config(app_config)
+
+    api = FakeTelegram(files_dir=work_dir / "bot-api" if args.local_api else None)
+    base_url = await api.start(args.port)
+    if args.local_api:
+        # Сессию на локальный сервер собирает сам бот — как при заданном BOT_API_URL.
+        app_config.bot_api_url = base_url
+        app_config.bot_api_dir = work_dir / "bot-api"
+        session = None
+    else:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(base_url))
+    bot = create_bot(app_config, session=session, send_pipeline=not args.no_rate_limit)
+    dp = create_dispatcher(bot)
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=1))
+
+    stats = ResourceStats()
+    stop_sampling = asyncio.Event()
+    sampler = asyncio.create_task(sample_resources(stats, stop_sampling))
+    ids = [args.template] if args.template else template_ids()
+    started = time.monotonic()
+    try:
+        tasks = []
+        for idx, user_id in enumerate(users):
+            if idx and args.ramp:
+                await asyncio.sleep(args.ramp / max(1, len(users) - 1))
+            tasks.append(asyncio.create_task(simulate_user(api, user_id, ids[idx % len(ids)], args.think, args.timeout)))
+        results = list(await asyncio.gather(*tasks))
+        elapsed = time.monotonic() - started
+    finally:
+        stop_sampling.set()
+        await sampler
+        await dp.stop_polling()
+        await polling
+        await bot.session.close()
+        await api.stop()
+    print_report(results, elapsed, stats, api)
+    if args.json:
+        Path(args.json).write_text(
+            json.dumps({"elapsed": elapsed, "resources": asdict(stats), "users": [asdict(r) for r in results]}, ensure_ascii=False, indent=2),
+            encoding="utf-8",
+        )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на локальном заменителе Telegram Bot API.")
+    parser.add_argument("--users", type=int, default=10, help="сколько пользователей одновременно создают карточки")
+    parser.add_argument("--ramp", type=float, default=5.0, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument("--think", type=float, default=0.3, help="пауза пользователя между шагами, с")
+    parser.add_argument("--timeout", type=float, default=300.0, help="сколько ждать ответа на шаг, с")
+    parser.add_argument("--template", type=int, default=0, help="id шаблона (по умолчанию — все по кругу)")
+    parser.add_argument("--port", type=int, default=0, help="порт заменителя Bot API (0 — свободный)")
+    parser.add_argument("--local-api", action="store_true", help="как свой сервер Bot API (--local): файлы читаются с диска, без HTTP")
+    parser.add_argument("--no-rate-limit", action="store_true", help="без лимитов отправки SendPipeline (чистая ёмкость рендера)")
+    parser.add_argument("--json", help="сохранить сырые результаты в файл")
+    parser.add_argument("--keep", action="store_true", help="не удалять временный каталог с data/ и output/")
+    parser.add_argument("-v", "--verbose", action="store_true", help="логи бота уровня INFO")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+    work_dir = Path(tempfile.mkdtemp(prefix="avito_cards_loadtest_"))
+    (work_dir / "data").mkdir()
+    (work_dir / "output").mkdir()
+    os.environ["DATA_DIR"] = str(work_dir / "data")
+    os.environ["OUTPUT_DIR"] = str(work_dir / "output")
+    try:
+        asyncio.run(run_loadtest(args, work_dir))
+    finally:
+        if args.keep:
+            print(f"Временный каталог: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image, ImageChops
+
+from .constants import DATA_DIR, LOGO_DEFAULT_PATH
+from .images import SLOT_SIZES, sniff_image_size
+from .metrics import cache_hit
+
+
+# Подготовленные логотипы магазинов: обрезанные по содержимому и уменьшенные под слот шаблона PNG.
+LOGO_ASSETS_DIR = DATA_DIR / "logos"
+
+_DEFAULT_LOGO: bytes | None = None
+# path -> (mtime_ns, png), чтобы не читать файл логотипа с диска на каждый рендер.
+_ASSET_CACHE: dict[Path, tuple[int, bytes]] = {}
+
+
+def prepare_logo(data: bytes, trim: bool = True) -> bytes:
+    """
+    Нормализует логотип один раз: обрезает прозрачные (или белые) поля вокруг содержимого
+    и уменьшает до размера слота логотипа в шаблоне. Возвращает PNG, готовый к встраиванию.
+    """
+    sniff_image_size(data)
+    with Image.open(BytesIO(data)) as src:
+        img = src.convert("RGBA")
+    if trim:
+        bbox = img.getchannel("A").getbbox()
+        if bbox == (0, 0, img.width, img.height) or bbox is None:
+            # Непрозрачный логотип — обрезаем белые поля.
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            bbox = ImageChops.difference(img.convert("RGB"), background).getbbox() or bbox
+        if bbox:
+            img = img.crop(bbox)
+    img.thumbnail(SLOT_SIZES["logo"], Image.Resampling.LANCZOS)
+    out = BytesIO()
+    img.save(out, "PNG", optimize=True)
+    return out.getvalue()
+
+
+def shop_logo_asset_path(shop_id: int) -> Path:
+    return LOGO_ASSETS_DIR / f"shop_{shop_id}.png"
+
+
+def save_shop_logo_asset(shop_id: int, prepared_png: bytes) -> str:
+    """Сохраняет подготовленный логотип магазина и возвращает имя файла для logos.json."""
+    path = shop_logo_asset_path(shop_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(prepared_png)
+    _ASSET_CACHE.pop(path, None)
+    return path.name
+
+
+def load_logo_asset(name: str | None) -> bytes | None:
+    """Возвращает подготовленный логотип по имени файла (из памяти, пока файл не изменился)."""
+    if not name:
+        return None
+    path = LOGO_ASSETS_DIR / Path(name).name
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        return None
+    cached = _ASSET_CACHE.get(path)
+    cache_hit("logo", bool(cached and cached[0] == mtime))
+    if cached and cached[0] == mtime:
+        return cached[1]
+    data = path.read_bytes()
+    _ASSET_CACHE[path] = (mtime, data)
+    return data
+
+
+def preload_default_logo() -> bytes | None:
+    """
+    Готовит логотип по умолчанию (logo_defoult.png) один раз при старте бота.
+    Поля не обрезаются: файл нарисован под слот шаблона, меняется только разрешение.
+    """
+    global _DEFAULT_LOGO
+    if _DEFAULT_LOGO is None and LOGO_DEFAULT_PATH.exists():
+        _DEFAULT_LOGO = prepare_logo(LOGO_DEFAULT_PATH.read_bytes(), trim=False)
+    return _DEFAULT_LOGO
+
+
+def get_default_logo() -> bytes | None:
+    """Подготовленный логотип по умолчанию; если предзагрузки не было — готовит его сейчас."""
+    return _DEFAULT_LOGO if _DEFAULT_LOGO is not None else preload_default_logo()
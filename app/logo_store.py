@@ -1,8 +1,10 @@
 import json
+import threading
 from dataclasses import dataclass
 from typing import Any
 
 from .constants import DATA_DIR
+from .store_io import JsonStore
 
 
 LOGOS_PATH = DATA_DIR / "logos.json"
@@ -13,6 +15,8 @@ class ShopLogo:
     id: int
     title: str
     logo_file_id: str | None = None
+    # Имя подготовленного PNG в data/logos (обрезан и уменьшен под слот при загрузке админом).
+    logo_asset: str | None = None
 
 
 def _load_raw() -> dict[str, Any]:
@@ -29,17 +33,19 @@ def _load_raw() -> dict[str, Any]:
 
 
 def _save_raw(data: dict[str, Any]) -> None:
-    try:
-        LOGOS_PATH.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    except Exception:
-        # Не ломаем бота из-за ошибки сохранения.
-        pass
+    # Ошибку записи не скрываем: её получает вызвавший set_shop_logo, а не «успешное» сохранение.
+    LOGOS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    # Атомарно: файл читается из пула хранилищ без блокировки и не должен быть виден наполовину записанным.
+    tmp_path = LOGOS_PATH.with_name(f"{LOGOS_PATH.name}.{threading.get_ident()}.tmp")
+    tmp_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp_path.replace(LOGOS_PATH)
 
 
 def load_logos() -> list[ShopLogo]:
     """
     Возвращает до трёх магазинов с логотипами из logos.json.
-    Если файл ещё не создан — заполняет заготовкой K&B / МНСГ / Паша.
+    Если файл ещё не создан — заготовка K&B / МНСГ / Паша; на диск она попадает при первом изменении
+    (чтение идёт без блокировки файла и ничего не записывает).
     """
     data = _load_raw()
     shops_raw = data.get("shops")
@@ -56,14 +62,16 @@ def load_logos() -> list[ShopLogo]:
             logo_file_id = item.get("logo_file_id")
             if logo_file_id is not None:
                 logo_file_id = str(logo_file_id)
-            shops.append(ShopLogo(id=shop_id, title=title, logo_file_id=logo_file_id))
+            logo_asset = item.get("logo_asset")
+            if logo_asset is not None:
+                logo_asset = str(logo_asset)
+            shops.append(ShopLogo(id=shop_id, title=title, logo_file_id=logo_file_id, logo_asset=logo_asset))
     if not shops:
         shops = [
             ShopLogo(id=1, title=default_titles[1]),
             ShopLogo(id=2, title=default_titles[2]),
             ShopLogo(id=3, title=default_titles[3]),
         ]
-        save_logos(shops)
     return shops[:3]
 
 
@@ -74,6 +82,7 @@ def save_logos(shops: list[ShopLogo]) -> None:
                 "id": shop.id,
                 "title": shop.title,
                 "logo_file_id": shop.logo_file_id,
+                "logo_asset": shop.logo_asset,
             }
             for shop in shops
         ]
@@ -81,20 +90,36 @@ def save_logos(shops: list[ShopLogo]) -> None:
     _save_raw(data)
 
 
-def set_shop_logo(shop_id: int, logo_file_id: str) -> None:
+# Асинхронный API (см. store_io.JsonStore); синхронные load_logos/save_logos — только для пула хранилищ.
+_STORE: JsonStore[list[ShopLogo]] = JsonStore(LOGOS_PATH, load_logos, save_logos)
+
+
+async def read_logos() -> list[ShopLogo]:
+    return await _STORE.read()
+
+
+async def set_shop_logo(shop_id: int, logo_file_id: str, logo_asset: str | None = None) -> None:
     """
     Обновляет логотип магазина по id. Если магазина с таким id нет — добавляет/расширяет список.
+    logo_asset — имя подготовленного файла логотипа (см. logo_assets).
     """
-    shops = load_logos()
-    updated = False
-    for shop in shops:
-        if shop.id == shop_id:
-            shop.logo_file_id = logo_file_id
-            updated = True
-            break
-    if not updated:
+
+    def mutate(shops: list[ShopLogo]) -> None:
+        for shop in shops:
+            if shop.id == shop_id:
+                shop.logo_file_id = logo_file_id
+                shop.logo_asset = logo_asset
+                return
         default_titles = {1: "K&B", 2: "МНСГ", 3: "Паша"}
         title = default_titles.get(shop_id, f"Магазин {shop_id}")
-        shops.append(ShopLogo(id=shop_id, title=title, logo_file_id=logo_file_id))
-    save_logos(shops)
+        shops.append(ShopLogo(id=shop_id, title=title, logo_file_id=logo_file_id, logo_asset=logo_asset))
+
+    await _STORE.update(mutate)
+
 
+async def find_shop_by_logo(logo_file_id: str) -> ShopLogo | None:
+    """Ищет магазин, чей логотип имеет данный file_id (чтобы взять подготовленный файл вместо скачивания)."""
+    for shop in await _STORE.read():
+        if shop.logo_file_id == logo_file_id:
+            return shop
+    return None
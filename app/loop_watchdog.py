@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from pathlib import Path
+from types import FrameType
+
+from .constants import BASE_DIR
+from .metrics import incr, record_loop_lag
+
+
+logger = logging.getLogger(__name__)
+
+# Как часто цикл событий отмечается «жив»; задержка этой отметки и есть лаг цикла.
+HEARTBEAT = 0.1
+# Лаг, начиная с которого цикл считается заблокированным: все чаты ждут столько же.
+BLOCK_THRESHOLD = 0.1
+# Как часто сторожевой поток проверяет цикл (и снимает стек, пока цикл заблокирован).
+CHECK_INTERVAL = 0.02
+# Сколько мест блокировок помнить (остальные попадают в общую строку «прочее»).
+MAX_SITES = 200
+
+APP_DIR = BASE_DIR / "app"
+
+
+@dataclass
+class Offender:
+    """Место в коде бота, где цикл событий простаивал: сколько раз, суммарно и максимум (по сэмплам стека)."""
+
+    site: str
+    leaf: str
+    stalls: int = 0
+    blocked: float = 0.0
+    worst: float = 0.0
+
+
+# (место вызова в app, самая вложенная функция) -> статистика.
+_OFFENDERS: dict[tuple[str, str], Offender] = {}
+# Пишет сторожевой поток, читает панель и отчёт нагрузочного теста.
+_LOCK = threading.Lock()
+# Время последней отметки цикла (time.monotonic); None — сторож не запущен.
+_LAST_BEAT: float | None = None
+
+
+def _describe(frame: FrameType) -> str:
+    code = frame.f_code
+    path = Path(code.co_filename)
+    try:
+        name = str(path.relative_to(BASE_DIR))
+    except ValueError:
+        name = path.name
+    return f"{name}:{frame.f_lineno} {code.co_qualname}"
+
+
+def _call_site(frame: FrameType) -> tuple[str, str]:
+    """(самый вложенный кадр в коде бота, самый вложенный кадр вообще): где блокирует и что именно."""
+    leaf = _describe(frame)
+    current: FrameType | None = frame
+    while current is not None:
+        if current.f_code.co_filename.startswith(str(APP_DIR)) and not current.f_code.co_filename.endswith(
+            "loop_watchdog.py"
+        ):
+            return _describe(current), leaf
+        current = current.f_back
+    return leaf, leaf
+
+
+def _record(key: tuple[str, str], blocked: float, new_stall: bool) -> Offender:
+    with _LOCK:
+        offender = _OFFENDERS.get(key)
+        if offender is None:
+            if len(_OFFENDERS) >= MAX_SITES:
+                key = ("прочее", "прочее")
+            offender = _OFFENDERS.setdefault(key, Offender(site=key[0], leaf=key[1]))
+        offender.stalls += int(new_stall)
+        offender.blocked += blocked
+        return offender
+
+
+def _watch(loop_thread: int, stop: threading.Event) -> None:
+    """
+    Сторожевой поток: пока цикл не отмечается дольше HEARTBEAT + BLOCK_THRESHOLD, раз в CHECK_INTERVAL снимает
+    его стек и начисляет прошедшее время месту вызова. Одна блокировка может пройти через несколько мест —
+    каждое получает свою долю. По окончании блокировки — строка в лог (со стеком, если место новое).
+    """
+    stall_started: float | None = None
+    stall_sites: dict[tuple[str, str], float] = {}
+    first_stack: dict[tuple[str, str], str] = {}
+    last_check = time.monotonic()
+    while not stop.wait(CHECK_INTERVAL):
+        now = time.monotonic()
+        step, last_check = now - last_check, now
+        beat = _LAST_BEAT
+        lag = now - beat - HEARTBEAT if beat is not None else 0.0
+        if lag > BLOCK_THRESHOLD:
+            frame = sys._current_frames().get(loop_thread)
+            if frame is None:
+                continue
+            key = _call_site(frame)
+            if stall_started is None:
+                stall_started = beat + HEARTBEAT
+                step = lag
+            if key not in stall_sites and key not in _OFFENDERS:
+                first_stack[key] = "".join(traceback.format_stack(frame))
+            _record(key, step, new_stall=key not in stall_sites)
+            stall_sites[key] = stall_sites.get(key, 0.0) + step
+            continue
+        if stall_started is None:
+            continue
+        # Блокировка закончилась: цикл снова отмечается.
+        duration = (beat or now) - stall_started
+        incr("loop.stalls")
+        worst_key = max(stall_sites, key=stall_sites.__getitem__)
+        with _LOCK:
+            for key in stall_sites:
+                offender = _OFFENDERS.get(key)
+                if offender is not None:
+                    offender.worst = max(offender.worst, duration)
+        if worst_key in first_stack:
+            logger.warning(
+                "Цикл событий заблокирован на %.0f мс: %s (%s). Стек:\n%s",
+                duration * 1000,
+                worst_key[0],
+                worst_key[1],
+                first_stack[worst_key],
+            )
+        else:
+            logger.warning("Цикл событий заблокирован на %.0f мс: %s (%s)", duration * 1000, *worst_key)
+        stall_started = None
+        stall_sites = {}
+        first_stack = {}
+
+
+async def watch_loop() -> None:
+    """
+    Фоновая задача (запускается в on_startup): отмечает цикл событий раз в HEARTBEAT, пишет лаг в метрики
+    и держит сторожевой поток, который ловит синхронные вызовы, блокирующие цикл. Останавливается отменой.
+    """
+    global _LAST_BEAT
+    stop = threading.Event()
+    thread = threading.Thread(target=_watch, args=(threading.get_ident(), stop), name="loop-watchdog", daemon=True)
+    _LAST_BEAT = time.monotonic()
+    thread.start()
+    try:
+        while True:
+            await asyncio.sleep(HEARTBEAT)
+            now = time.monotonic()
+            record_loop_lag(max(now - _LAST_BEAT - HEARTBEAT, 0.0))
+            _LAST_BEAT = now
+    finally:
+        stop.set()
+        _LAST_BEAT = None
+        thread.join()
+
+
+def top_offenders(limit: int = 10) -> list[Offender]:
+    """Места, где цикл событий простоял дольше всего (суммарно с запуска)."""
+    with _LOCK:
+        offenders = [Offender(**vars(offender)) for offender in _OFFENDERS.values()]
+    return sorted(offenders, key=lambda offender: offender.blocked, reverse=True)[:limit]
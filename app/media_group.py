@@ -0,0 +1,46 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+from aiogram.types import Message, TelegramObject
+
+
+# Части альбома приходят отдельными апдейтами почти одновременно; альбом считается полным,
+# когда за ALBUM_WAIT секунд не пришло ни одной новой части.
+ALBUM_WAIT = 0.4
+# Telegram не присылает в одном альбоме больше 10 элементов.
+ALBUM_MAX_PARTS = 10
+
+# (чат, media_group_id) -> уже полученные части альбома.
+_ALBUMS: dict[tuple[int, str], list[Message]] = {}
+
+
+async def album_middleware(
+    handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+    event: TelegramObject,
+    data: dict[str, Any],
+) -> Any:
+    """
+    Outer-middleware для сообщений (dp.message.outer_middleware): собирает альбом (media_group_id) целиком
+    и вызывает хендлер один раз — с первой частью и списком всех частей по порядку в data["album"].
+    Хендлеры, которые принимают параметр album, обрабатывают все фото за один проход (и одну запись в FSM),
+    остальные видят только первую часть, как раньше.
+    """
+    if not isinstance(event, Message) or not event.media_group_id:
+        return await handler(event, data)
+    key = (event.chat.id, event.media_group_id)
+    parts = _ALBUMS.get(key)
+    if parts is not None:
+        # Не первая часть: её заберёт апдейт, который первым открыл альбом.
+        parts.append(event)
+        return None
+    parts = _ALBUMS[key] = [event]
+    try:
+        seen = 0
+        while seen != len(parts) and len(parts) < ALBUM_MAX_PARTS:
+            seen = len(parts)
+            await asyncio.sleep(ALBUM_WAIT)
+    finally:
+        _ALBUMS.pop(key, None)
+    parts.sort(key=lambda message: message.message_id)
+    data["album"] = parts
+    return await handler(parts[0], data)
@@ -0,0 +1,176 @@
+import os
+import statistics
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+
+# Счётчики процесса для панели «Состояние бота». Обновление — O(1) (словарь или deque с maxlen),
+# вся обработка (перцентили, окно за час) — только при просмотре панели.
+
+# Окно для задержек и ошибок «за последний час».
+WINDOW = 3600.0
+# Сколько последних генераций и ошибок помнить (с запасом на час работы под нагрузкой).
+MAX_JOBS = 2000
+MAX_ERRORS = 1000
+# Лаг цикла событий отмечается раз в 0,1 с (loop_watchdog) — за час это 36 000 значений.
+MAX_LOOP_LAGS = 36000
+
+STARTED_AT = time.time()
+
+# Накопительные счётчики с запуска: "cache.<имя>.hit" / "cache.<имя>.miss", "updates", ...
+_COUNTERS: dict[str, int] = {}
+# Текущие значения: "pages" — открытые страницы Chromium, "send_waiting" — отправки, ждущие лимитов Telegram.
+_GAUGES: dict[str, int] = {}
+# (время окончания, длительность, job_id, user_id, успех) — последние генерации.
+_JOBS: deque[tuple[float, float, str, int, bool]] = deque(maxlen=MAX_JOBS)
+# (время, вид ошибки).
+_ERRORS: deque[tuple[float, str]] = deque(maxlen=MAX_ERRORS)
+# (время, длительность) обработки апдейтов — чтобы видеть, не «тормозят» ли сами ответы бота.
+_UPDATES: deque[tuple[float, float]] = deque(maxlen=MAX_JOBS)
+# (время, лаг) цикла событий: насколько позже положенного просыпается отметка сторожа.
+_LOOP_LAGS: deque[tuple[float, float]] = deque(maxlen=MAX_LOOP_LAGS)
+
+
+def incr(name: str, amount: int = 1) -> None:
+    _COUNTERS[name] = _COUNTERS.get(name, 0) + amount
+
+
+def gauge_add(name: str, delta: int) -> None:
+    _GAUGES[name] = _GAUGES.get(name, 0) + delta
+
+
+def gauge(name: str) -> int:
+    return _GAUGES.get(name, 0)
+
+
+def cache_hit(cache: str, hit: bool) -> None:
+    incr(f"cache.{cache}.{'hit' if hit else 'miss'}")
+
+
+def record_job(job_id: str, user_id: int, seconds: float, ok: bool) -> None:
+    _JOBS.append((time.time(), seconds, job_id, user_id, ok))
+
+
+def record_error(kind: str) -> None:
+    _ERRORS.append((time.time(), kind))
+    incr(f"errors.{kind}")
+
+
+def record_update(seconds: float) -> None:
+    _UPDATES.append((time.time(), seconds))
+    incr("updates")
+
+
+def record_loop_lag(seconds: float) -> None:
+    _LOOP_LAGS.append((time.time(), seconds))
+
+
+async def update_metrics_middleware(
+    handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+    event: Any,
+    data: dict[str, Any],
+) -> Any:
+    """Outer-middleware на update: время обработки каждого апдейта и необработанные исключения хендлеров."""
+    started = time.perf_counter()
+    try:
+        return await handler(event, data)
+    except Exception:
+        record_error("handler")
+        raise
+    finally:
+        record_update(time.perf_counter() - started)
+
+
+def _percentile(values: list[float], pct: int) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[pct - 1]
+
+
+def latency_stats(samples: list[float]) -> dict[str, float] | None:
+    if not samples:
+        return None
+    return {"p50": _percentile(samples, 50), "p95": _percentile(samples, 95), "max": max(samples)}
+
+
+def cache_rates() -> dict[str, tuple[int, int]]:
+    """Кэш -> (попаданий, промахов) с запуска."""
+    rates: dict[str, tuple[int, int]] = {}
+    for name, value in _COUNTERS.items():
+        if not name.startswith("cache."):
+            continue
+        cache, kind = name[len("cache.") :].rsplit(".", 1)
+        hits, misses = rates.get(cache, (0, 0))
+        rates[cache] = (hits + value, misses) if kind == "hit" else (hits, misses + value)
+    return rates
+
+
+def snapshot(slowest: int = 5) -> dict[str, Any]:
+    """Сводка для панели: окно за последний час считается здесь, а не при обновлении счётчиков."""
+    since = time.time() - WINDOW
+    jobs = [job for job in _JOBS if job[0] >= since]
+    errors: dict[str, int] = {}
+    for ts, kind in _ERRORS:
+        if ts >= since:
+            errors[kind] = errors.get(kind, 0) + 1
+    return {
+        "uptime": time.time() - STARTED_AT,
+        "jobs_total": len(jobs),
+        "jobs_failed": sum(1 for job in jobs if not job[4]),
+        "job_latency": latency_stats([job[1] for job in jobs if job[4]]),
+        "slowest": sorted(jobs, key=lambda job: job[1], reverse=True)[:slowest],
+        "update_latency": latency_stats([seconds for ts, seconds in _UPDATES if ts >= since]),
+        "loop_lag": latency_stats([seconds for ts, seconds in _LOOP_LAGS if ts >= since]),
+        "loop_stalls": _COUNTERS.get("loop.stalls", 0),
+        "errors": errors,
+        "errors_total": {name[len("errors.") :]: value for name, value in _COUNTERS.items() if name.startswith("errors.")},
+        "caches": cache_rates(),
+        "pages": gauge("pages"),
+        "send_waiting": gauge("send_waiting"),
+    }
+
+
+# --- Память процессов (Linux, /proc) ---
+
+
+def descendants(root_pid: int) -> list[int]:
+    """Дочерние процессы (рекурсивно) по /proc — для подсчёта Chromium и его памяти. Вне Linux — пусто."""
+    children: dict[int, list[int]] = {}
+    for entry in Path("/proc").glob("[0-9]*"):
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry.name))
+    result, stack = [], [root_pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            result.append(child)
+            stack.append(child)
+    return result
+
+
+def rss(pid: int) -> int:
+    try:
+        pages = int(Path(f"/proc/{pid}/statm").read_text().split()[1])
+    except (OSError, IndexError, ValueError):
+        return 0
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def is_chromium(pid: int) -> bool:
+    try:
+        name = Path(f"/proc/{pid}/comm").read_text().strip().lower()
+    except OSError:
+        return False
+    return "chrom" in name or "headless_shell" in name
+
+
+def process_memory() -> tuple[int, int, int]:
+    """(RSS бота, RSS дочерних процессов Chromium, их число). Читает /proc — вызывать через asyncio.to_thread."""
+    pid = os.getpid()
+    chromium = [child for child in descendants(pid) if is_chromium(child)]
+    return rss(pid), sum(rss(child) for child in chromium), len(chromium)
@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+from typing import Any, Iterable
+
+from aiogram.types import PhotoSize
+
+from .constants import DATA_DIR
+from .metrics import cache_hit
+
+
+# Все размеры, в которых Telegram хранит присланное фото. Ключ — file_id самого большого размера
+# (именно он лежит в FSM, примерах и журнале заданий), значение — варианты [file_id, ширина, высота].
+PHOTO_SIZES_PATH = DATA_DIR / "photo_sizes.json"
+# Сколько фото помнить; при переполнении выбрасываются давно не использованные.
+MAX_ENTRIES = 2000
+
+# file_id -> {"sizes": [[file_id, w, h], ...], "used": unix time}. С диска читается при старте (load_photo_sizes,
+# в потоке прогрева); до этого pick_file_id просто отдаёт исходный file_id.
+_CACHE: dict[str, dict[str, Any]] = {}
+_LOADED = False
+# Изменения идут из потоков (asyncio.to_thread), чтение — из цикла событий. Под _LOCK — только операции
+# со словарём, без диска: иначе pick_file_id в цикле событий ждал бы записи файла.
+_LOCK = threading.Lock()
+# Записи файла — по очереди, каждая со свежим снимком (более старый снимок не перезапишет новый).
+_SAVE_LOCK = threading.Lock()
+
+
+def _read() -> dict[str, dict[str, Any]]:
+    if not PHOTO_SIZES_PATH.exists():
+        return {}
+    try:
+        data = json.loads(PHOTO_SIZES_PATH.read_text(encoding="utf-8"))
+    except Exception:  # noqa: BLE001
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {k: v for k, v in data.items() if isinstance(v, dict) and isinstance(v.get("sizes"), list)}
+
+
+def load_photo_sizes() -> None:
+    """Читает реестр с диска (при старте бота, не в цикле событий). Уже запомненные записи не затираются."""
+    global _CACHE, _LOADED
+    if _LOADED:
+        return
+    entries = _read()
+    with _LOCK:
+        if not _LOADED:
+            _CACHE = {**entries, **_CACHE}
+            _LOADED = True
+
+
+def _save() -> None:
+    with _SAVE_LOCK:
+        with _LOCK:
+            if len(_CACHE) > MAX_ENTRIES:
+                for key in sorted(_CACHE, key=lambda k: _CACHE[k].get("used", 0))[: len(_CACHE) - MAX_ENTRIES]:
+                    del _CACHE[key]
+            snapshot = {key: dict(entry) for key, entry in _CACHE.items()}
+        try:
+            tmp_path = PHOTO_SIZES_PATH.with_name(f"{PHOTO_SIZES_PATH.name}.{threading.get_ident()}.tmp")
+            tmp_path.write_text(json.dumps(snapshot, ensure_ascii=False), encoding="utf-8")
+            tmp_path.replace(PHOTO_SIZES_PATH)
+        except Exception:  # noqa: BLE001
+            # Реестр — только оптимизация: без него фото просто скачивается в самом большом размере.
+            pass
+
+
+def remember_photos(photos: Iterable[list[PhotoSize]]) -> list[str]:
+    """
+    Запоминает все размеры каждого фото (message.photo) и возвращает file_id самых больших — их и хранить.
+    Пишет на диск, поэтому из хендлеров вызывается через asyncio.to_thread.
+    """
+    load_photo_sizes()
+    ids: list[str] = []
+    with _LOCK:
+        now = time.time()
+        for sizes in photos:
+            if not sizes:
+                continue
+            largest = max(sizes, key=lambda size: size.width * size.height)
+            _CACHE[largest.file_id] = {
+                "sizes": [[size.file_id, size.width, size.height] for size in sizes],
+                "used": now,
+            }
+            ids.append(largest.file_id)
+    if ids:
+        _save()
+    return ids
+
+
+def pick_file_id(file_id: str, box: tuple[int, int] | None) -> str:
+    """
+    Самый маленький размер фото, которого хватает на слот box: при вписывании в слот его не нужно растягивать
+    (ширина или высота не меньше слота — картинка в SVG вписывается с сохранением пропорций).
+    Без слота, без сохранённых размеров или если меньшие размеры не подходят — исходный file_id (самый большой).
+    """
+    if box is None:
+        return file_id
+    with _LOCK:
+        entry = _CACHE.get(file_id)
+        cache_hit("photo_sizes", entry is not None)
+        if entry is None:
+            return file_id
+        entry["used"] = time.time()
+        sizes = list(entry["sizes"])
+    fitting = [size for size in sizes if size[1] >= box[0] or size[2] >= box[1]]
+    if not fitting:
+        return file_id
+    return str(min(fitting, key=lambda size: size[1] * size[2])[0])
@@ -0,0 +1,210 @@
+import asyncio
+import hashlib
+import json
+import logging
+from io import BytesIO
+from pathlib import Path
+from typing import Any
+
+from aiogram import Bot
+from PIL import Image
+
+from .auth_store import read_auth
+from .constants import DATA_DIR
+from .context import get_settings
+from .example_store import read_examples
+from .file_id_store import send_album_once
+from .images import SLOT_SIZES
+from .services import download_photos, render_card
+from .template_registry import CardTemplate, get_template, template_ids
+
+
+logger = logging.getLogger(__name__)
+
+# Превью шаблонов: template_<id>_<ключ>.jpg. Ключ меняется вместе с файлом шаблона или данными примера.
+PREVIEWS_DIR = DATA_DIR / "previews"
+# Превью рендерится тем же SVG в масштабе 1/4 (≈480×270) — это в разы быстрее полного рендера.
+PREVIEW_SCALE = 0.25
+PREVIEW_WIDTH = 480
+
+# Поля примера, от которых зависит картинка превью.
+_EXAMPLE_FIELDS = (
+    "example_photo_file_ids",
+    "example_logo_file_id",
+    "title_main",
+    "title_sub",
+    "text_bottom_line1",
+    "text_bottom_line2",
+    "price",
+    "spec_list",
+)
+
+_LOCK: asyncio.Lock | None = None
+# Фоновое обновление превью, запущенное из меню при холодном кэше (ссылка держит задачу до завершения).
+_REFRESH: asyncio.Task | None = None
+
+
+def _get_lock() -> asyncio.Lock:
+    global _LOCK
+    if _LOCK is None:
+        _LOCK = asyncio.Lock()
+    return _LOCK
+
+
+async def _example_data() -> dict[str, Any]:
+    """Данные примера (как в «Примерах» → генерация), по которым рендерятся превью."""
+    stored = await read_examples()
+    data = {key: stored.get(key) for key in _EXAMPLE_FIELDS if stored.get(key)}
+    data["text_minor"] = (await read_auth()).description_template
+    data["logo_file_id"] = data.get("example_logo_file_id")
+    data.setdefault("text_bottom_line1", "Гарантия до 12 месяцев")
+    data.setdefault("text_bottom_line2", "Доставка или самовывоз")
+    data.setdefault("price", "69 990 ₽")
+    return data
+
+
+def preview_key(template: CardTemplate, example: dict[str, Any]) -> str:
+    """Отпечаток превью: версия файла шаблона (mtime, с которым он разобран) + данные примера."""
+    canonical = json.dumps(
+        {"template": [template.template_id, template.mtime_ns], "example": example, "scale": PREVIEW_SCALE},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def _placeholder_photos(template: CardTemplate) -> list[bytes]:
+    """Серые заглушки под слоты фото шаблона, если пример ещё не задан."""
+    result = []
+    for slot in ("main", "minor1", "minor2"):
+        out = BytesIO()
+        Image.new("RGB", template.image_box(slot, SLOT_SIZES[slot]), (205, 205, 205)).save(out, "JPEG", quality=80)
+        result.append(out.getvalue())
+    return result
+
+
+def _to_thumbnail(png_path: Path) -> bytes:
+    with Image.open(png_path) as img:
+        img = img.convert("RGB")
+        img.thumbnail((PREVIEW_WIDTH, PREVIEW_WIDTH), Image.Resampling.LANCZOS)
+        out = BytesIO()
+        img.save(out, "JPEG", quality=85, optimize=True)
+    return out.getvalue()
+
+
+async def _render_preview(bot: Bot, example: dict[str, Any], template_id: int, photos: list[bytes]) -> bytes:
+    svg_path, png_path = await render_card(
+        bot,
+        {**example, "template_id": template_id},
+        user_id=0,
+        embed_mode=get_settings().embed_images,
+        scale=PREVIEW_SCALE,
+        photos=photos,
+    )
+    try:
+        return await asyncio.to_thread(_to_thumbnail, png_path)
+    finally:
+        svg_path.unlink(missing_ok=True)
+        png_path.unlink(missing_ok=True)
+
+
+async def get_template_previews(bot: Bot) -> list[tuple[int, bytes]]:
+    """
+    Превью всех шаблонов из реестра (templates/template_<id>.svg). Готовые берутся из data/previews, устаревшие (сменился
+    файл шаблона или пример) перерендериваются; фото примера скачиваются только если что-то нужно рендерить.
+    """
+    async with _get_lock():
+        example = await _example_data()
+        photo_ids = list(example.get("example_photo_file_ids") or [])
+        example_photos: list[bytes] | None = None
+        result: list[tuple[int, bytes]] = []
+        for template_id in template_ids():
+            template = get_template(template_id)
+            path = PREVIEWS_DIR / f"template_{template_id}_{preview_key(template, example)}.jpg"
+            cached = await asyncio.to_thread(_read_preview, path)
+            if cached is not None:
+                result.append((template_id, cached))
+                continue
+            if len(photo_ids) == 3:
+                # Фото примера скачиваются один раз на все шаблоны.
+                if example_photos is None:
+                    example_photos = await download_photos(bot, photo_ids, slots=["main", "minor1", "minor2"])
+                photos = example_photos
+            else:
+                # Заглушки — под слоты именно этого шаблона: у шаблонов разная геометрия.
+                photos = await asyncio.to_thread(_placeholder_photos, template)
+            preview = await _render_preview(bot, example, template_id, photos)
+            await asyncio.to_thread(_store_preview, template_id, path, preview)
+            logger.info("Превью шаблона %s обновлено", template_id)
+            result.append((template_id, preview))
+        return result
+
+
+def _read_preview(path: Path) -> bytes | None:
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def _store_preview(template_id: int, path: Path, preview: bytes) -> None:
+    PREVIEWS_DIR.mkdir(parents=True, exist_ok=True)
+    for stale in PREVIEWS_DIR.glob(f"template_{template_id}_*.jpg"):
+        stale.unlink(missing_ok=True)
+    path.write_bytes(preview)
+
+
+def _read_cached(paths: list[tuple[int, Path]]) -> list[tuple[int, bytes]] | None:
+    result: list[tuple[int, bytes]] = []
+    for template_id, path in paths:
+        if not path.exists():
+            return None
+        result.append((template_id, path.read_bytes()))
+    return result
+
+
+async def cached_template_previews(bot: Bot) -> list[tuple[int, bytes]] | None:
+    """
+    Превью, только если все они уже готовы: без рендера и без ожидания идущего обновления.
+    None — кэш холодный; тогда обновление запускается в фоне, и превью появятся при следующем выборе шаблона.
+    """
+    global _REFRESH
+    if not _get_lock().locked():
+        example = await _example_data()
+        paths = [
+            (template_id, PREVIEWS_DIR / f"template_{template_id}_{preview_key(get_template(template_id), example)}.jpg")
+            for template_id in template_ids()
+        ]
+        previews = await asyncio.to_thread(_read_cached, paths)
+        if previews is not None:
+            return previews
+    if _REFRESH is None or _REFRESH.done():
+        _REFRESH = asyncio.create_task(refresh_template_previews(bot))
+    return None
+
+
+async def refresh_template_previews(bot: Bot) -> None:
+    """Фоновая задача при старте: готовит превью, чтобы первый выбор шаблона не ждал рендера."""
+    try:
+        await get_template_previews(bot)
+    except Exception:  # noqa: BLE001
+        logger.exception("Не удалось подготовить превью шаблонов")
+
+
+async def send_template_previews(bot: Bot, chat_id: int) -> bool:
+    """
+    Отправляет готовые превью шаблонов одним альбомом (по file_id, если уже отправлялись).
+    False — если не вышло или превью ещё не готовы: выбор шаблона не ждёт их рендера.
+    """
+    try:
+        # В альбоме Telegram не больше 10 файлов.
+        previews = (await cached_template_previews(bot) or [])[:10]
+        if len(previews) < 2:
+            return False
+        files = [(data, f"template_{template_id}.jpg") for template_id, data in previews]
+        captions: list[str | None] = [get_template(template_id).title for template_id, _ in previews]
+        await send_album_once(bot, chat_id, files, kind="photo", captions=captions)
+        return True
+    except Exception:  # noqa: BLE001
+        logger.exception("Не удалось отправить превью шаблонов")
+        return False
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from types import FrameType
+from typing import Awaitable, Callable, TypeVar
+
+from aiogram import Bot
+from aiogram.types import BufferedInputFile
+
+from .browser import get_browser
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Интервал сэмплирования стеков: 5 мс — заметные (>50 мс) участки видны, а сам профайлер почти не нагружает процесс.
+SAMPLE_INTERVAL = 0.005
+# Сколько генераций можно профилировать за одну команду.
+MAX_RUNS = 10
+# Категории трассировки Chromium: разбор и отрисовка страницы, декодирование картинок, снимок экрана.
+TRACE_CATEGORIES = [
+    "devtools.timeline",
+    "disabled-by-default-devtools.timeline",
+    "blink",
+    "cc",
+    "gpu",
+    "v8",
+]
+
+
+@dataclass
+class ProfileRequest:
+    """Профилирование следующих runs генераций пользователя; результаты уходят в чат admin_chat_id."""
+
+    runs: int
+    admin_chat_id: int
+
+
+# id пользователя -> что профилировать. Пусто — профилирование выключено и генерация идёт без обёрток.
+_ARMED: dict[int, ProfileRequest] = {}
+# Chromium пишет только одну трассировку за раз; параллельные профилируемые генерации идут без неё.
+_TRACE_LOCK: asyncio.Lock | None = None
+
+
+def arm(user_id: int, runs: int, admin_chat_id: int) -> None:
+    _ARMED[user_id] = ProfileRequest(runs=min(max(runs, 1), MAX_RUNS), admin_chat_id=admin_chat_id)
+
+
+def disarm(user_id: int) -> bool:
+    return _ARMED.pop(user_id, None) is not None
+
+
+def armed() -> dict[int, ProfileRequest]:
+    return dict(_ARMED)
+
+
+def _take(user_id: int) -> ProfileRequest | None:
+    request = _ARMED.get(user_id)
+    if request is None:
+        return None
+    request.runs -= 1
+    if request.runs <= 0:
+        del _ARMED[user_id]
+    return request
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({Path(code.co_filename).name})"
+
+
+class StackSampler:
+    """
+    Сэмплирующий профайлер: отдельный поток раз в SAMPLE_INTERVAL снимает стеки всех потоков процесса
+    (sys._current_frames) и считает одинаковые. Результат — «свёрнутые» стеки (поток;функция;...;функция число),
+    их напрямую открывают speedscope и flamegraph.pl. Цикл событий общий, поэтому в стеки потока цикла
+    попадает и работа других чатов, выполнявшаяся в это время.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL) -> None:
+        self.interval = interval
+        self.samples: Counter[tuple[str, ...]] = Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._loop_thread = threading.get_ident()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack: list[str] = []
+                current: FrameType | None = frame
+                while current is not None:
+                    stack.append(_frame_name(current))
+                    current = current.f_back
+                thread = "loop" if ident == self._loop_thread else names.get(ident, str(ident))
+                stack.append(thread)
+                self.samples[tuple(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self) -> str:
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common())
+
+
+async def _start_trace() -> bool:
+    global _TRACE_LOCK
+    if _TRACE_LOCK is None:
+        _TRACE_LOCK = asyncio.Lock()
+    if _TRACE_LOCK.locked():
+        return False
+    await _TRACE_LOCK.acquire()
+    try:
+        browser = await get_browser()
+        await browser.start_tracing(categories=TRACE_CATEGORIES)
+    except Exception:  # noqa: BLE001
+        logger.exception("Не удалось включить трассировку Chromium")
+        _TRACE_LOCK.release()
+        return False
+    return True
+
+
+async def _stop_trace() -> bytes | None:
+    assert _TRACE_LOCK is not None
+    try:
+        browser = await get_browser()
+        return await browser.stop_tracing()
+    except Exception:  # noqa: BLE001
+        logger.exception("Не удалось получить трассировку Chromium")
+        return None
+    finally:
+        _TRACE_LOCK.release()
+
+
+async def profiled(bot: Bot, user_id: int, label: str, run: Callable[[], Awaitable[T]]) -> T:
+    """
+    Выполняет run() и, если для пользователя включено профилирование (/profile), снимает стеки
+    и трассировку Chromium и отправляет их в чат админа. Когда профилирование выключено — просто run().
+    """
+    request = _take(user_id) if _ARMED else None
+    if request is None:
+        return await run()
+    traced = await _start_trace()
+    sampler = StackSampler()
+    started = time.perf_counter()
+    sampler.start()
+    try:
+        return await run()
+    finally:
+        # join ждёт последнего прохода сэмплера — не в цикле событий.
+        await asyncio.to_thread(sampler.stop)
+        seconds = time.perf_counter() - started
+        trace = await _stop_trace() if traced else None
+        await _send_profile(bot, request.admin_chat_id, user_id, label, seconds, sampler, trace)
+
+
+async def _send_profile(
+    bot: Bot,
+    chat_id: int,
+    user_id: int,
+    label: str,
+    seconds: float,
+    sampler: StackSampler,
+    trace: bytes | None,
+) -> None:
+    folded = await asyncio.to_thread(sampler.folded)
+    caption = f"Профиль генерации {label} пользователя {user_id}: {seconds:.2f} с, сэмплов {sampler.sample_count}"
+    try:
+        await bot.send_document(
+            chat_id,
+            BufferedInputFile(folded.encode("utf-8"), filename=f"profile_{label}.folded.txt"),
+            caption=caption,
+        )
+        if trace is not None:
+            await bot.send_document(
+                chat_id,
+                BufferedInputFile(trace, filename=f"trace_{label}.json"),
+                caption="Трассировка Chromium (chrome://tracing, ui.perfetto.dev)",
+            )
+        else:
+            await bot.send_message(chat_id, "Трассировка Chromium не снята: браузер занят другой трассировкой или недоступен.")
+    except Exception:  # noqa: BLE001
+        logger.exception("Не удалось отправить профиль генерации %s", label)
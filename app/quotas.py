@@ -0,0 +1,153 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from dataclasses import dataclass
+from typing import Any, Callable, Coroutine, Iterator, TypeVar
+
+from .context import get_settings
+from .send_pipeline import TokenBucket
+
+
+T = TypeVar("T")
+
+# Роли без квот: root_admin настраивает квоты и сам не ограничивается.
+UNLIMITED_ROLES = ("root_admin",)
+
+# id пользователя -> (квота, по которой собрана корзина; корзина). Корзина пересобирается при смене квоты.
+_BUCKETS: dict[int, tuple[tuple[float, int], TokenBucket]] = {}
+
+
+def quota_for(user_id: int, role: str) -> tuple[float, int] | None:
+    """Действующая квота (карточек в час, подряд без паузы): персональная или по роли. None — без ограничения."""
+    if role in UNLIMITED_ROLES:
+        return None
+    settings = get_settings()
+    quota = settings.user_quotas.get(user_id) or settings.quotas.get(role)
+    if not quota or quota[0] <= 0:
+        return None
+    return quota
+
+
+def take_render_quota(user_id: int, role: str) -> float:
+    """
+    Списывает одну генерацию из квоты пользователя. Возвращает 0, если можно собирать,
+    иначе — через сколько секунд появится следующая (квота при этом не тратится).
+    """
+    quota = quota_for(user_id, role)
+    if quota is None:
+        return 0.0
+    entry = _BUCKETS.get(user_id)
+    if entry is None or entry[0] != quota:
+        per_hour, burst = quota
+        bucket = TokenBucket(rate=per_hour / 3600, capacity=burst)
+        if entry is not None:
+            # Квоту поменяли: уже потраченное не возвращается, но и не превышает новый запас.
+            bucket.tokens = min(entry[1].tokens, bucket.capacity)
+        entry = _BUCKETS[user_id] = (quota, bucket)
+    return entry[1].try_take()
+
+
+def refund_render_quota(user_id: int) -> None:
+    """Возвращает списанную генерацию (карточка не собралась по нашей вине или запрос присоединился к идущей)."""
+    entry = _BUCKETS.get(user_id)
+    if entry is not None:
+        bucket = entry[1]
+        bucket.tokens = min(bucket.tokens + 1, bucket.capacity)
+
+
+def format_wait(seconds: float) -> str:
+    if seconds < 60:
+        return f"{max(1, round(seconds))} с"
+    return f"{round(seconds / 60)} мин"
+
+
+def quota_message(wait: float, quota: tuple[float, int] | None, retry: bool = False) -> str:
+    """retry — ответ на «Повторить»: кнопка остаётся под сообщением об ошибке, данные вводить заново не нужно."""
+    limit = f" (не больше {quota[0]:g} в час)" if quota else ""
+    if retry:
+        return f"Вы собрали много карточек подряд{limit}. Нажмите «Повторить» через {format_wait(wait)}."
+    return (
+        f"Вы собрали много карточек подряд{limit}. "
+        f"Следующую можно будет собрать через {format_wait(wait)} — введённые данные сохранены."
+    )
+
+
+@dataclass
+class RenderCost:
+    """
+    Во что обошлась генерация: wall — время от начала до отправки; cpu — время CPU потоков бота
+    (уменьшение фото, логотип, сборка SVG, варианты размеров; Chromium — отдельные процессы и входит только в wall);
+    bytes_in — скачано фото и логотипов, bytes_out — отправлено файлов карточки.
+    """
+
+    wall: float = 0.0
+    cpu: float = 0.0
+    bytes_in: int = 0
+    bytes_out: int = 0
+
+    def merge(self, other: "RenderCost") -> None:
+        self.wall += other.wall
+        self.cpu += other.cpu
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+
+
+# Стоимость текущей генерации. asyncio.to_thread копирует контекст, так что потоки пишут в тот же объект.
+_COST: ContextVar[RenderCost | None] = ContextVar("render_cost", default=None)
+
+
+@contextmanager
+def track_cost() -> Iterator[RenderCost]:
+    """Всё, что выполняется внутри (и в задачах/потоках, запущенных отсюда), учитывается в возвращаемой стоимости."""
+    cost = RenderCost()
+    token = _COST.set(cost)
+    started = time.monotonic()
+    try:
+        yield cost
+    finally:
+        cost.wall += time.monotonic() - started
+        _COST.reset(token)
+
+
+def add_cost(cpu: float = 0.0, bytes_in: int = 0, bytes_out: int = 0, cost: RenderCost | None = None) -> None:
+    """Добавляет к стоимости текущей генерации (или переданной cost). Вне генерации ничего не делает."""
+    target = _COST.get()
+    if target is None:
+        return
+    if cost is not None:
+        target.merge(cost)
+    target.cpu += cpu
+    target.bytes_in += bytes_in
+    target.bytes_out += bytes_out
+
+
+@contextmanager
+def cpu_cost() -> Iterator[None]:
+    """CPU текущего потока на блок без await (или целиком в потоке) — в стоимость генерации."""
+    started = time.thread_time()
+    try:
+        yield
+    finally:
+        add_cost(cpu=time.thread_time() - started)
+
+
+async def costed_to_thread(func: Callable[..., T], *args: Any) -> T:
+    """asyncio.to_thread с учётом CPU потока в стоимости генерации."""
+
+    def run() -> T:
+        with cpu_cost():
+            return func(*args)
+
+    return await asyncio.to_thread(run)
+
+
+def costed_task(coro: Coroutine[Any, Any, T]) -> tuple[asyncio.Task[T], RenderCost]:
+    """
+    Фоновая задача (например, предзагрузка фото) со своей стоимостью: её добавляют к генерации,
+    которая воспользуется результатом (add_cost(cost=...)).
+    """
+    cost = RenderCost()
+    context = copy_context()
+    context.run(_COST.set, cost)
+    return asyncio.create_task(coro, context=context), cost
@@ -1,16 +1,24 @@
+import asyncio
 import base64
 import html
+import uuid
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 from typing import Any
 
-from playwright.async_api import async_playwright
+from PIL import Image
 
-from .config import AppConfig
-from .constants import LOGO_DEFAULT_PATH, OUTPUT_DIR, SVG_TEMPLATES, SVG_TEMPLATE_PATH
+from .browser import get_browser
+from .config import EMBED_MODES
+from .constants import FONTS_DIR, OUTPUT_DIR
+from .logo_assets import get_default_logo
+from .metrics import gauge_add
+from .quotas import cpu_cost
+from .template_registry import CardTemplate, get_template
+from .text_layout import TextSlot, layout_text
 
-# Папка со шрифтами для совпадения с примером (MuseoSansVkusVill). Если файлы есть — подключаются при рендере.
-FONTS_DIR = SVG_TEMPLATE_PATH.parent / "fonts"
+# Шрифты для совпадения с примером (MuseoSansVkusVill) из FONTS_DIR. Если файлы есть — подключаются при рендере.
 SVG_FONT_FAMILIES = (
     ("MuseoSansVkusVill-100Italic", "MuseoSansVkusVill-100Italic"),
     ("MuseoSansVkusVill-900", "MuseoSansVkusVill-900"),
@@ -18,8 +26,12 @@ SVG_FONT_FAMILIES = (
 FONT_EXTENSIONS = (".woff2", ".woff", ".ttf")
 
 
+@lru_cache(maxsize=1)
 def _get_font_face_css() -> str:
-    """Собирает @font-face для шрифтов из FONTS_DIR, чтобы карточка совпадала с примером по шрифтам."""
+    """
+    Собирает @font-face для шрифтов из FONTS_DIR, чтобы карточка совпадала с примером по шрифтам.
+    Результат кэшируется: шрифты читаются и кодируются в base64 один раз на процесс.
+    """
     if not FONTS_DIR.exists():
         return ""
     parts = []
@@ -48,32 +60,53 @@ def to_data_url(photo_bytes: bytes, media_type: str = "image/jpeg") -> str:
     return f"data:{media_type};base64,{b64}"
 
 
-# В шаблоне SVG: главное фото (большой блок) = IMG_2587.JPG, первое доп. = IMG_2589.JPG, второе доп. = путь к png
-SVG_MAIN_HREF = "IMG_2587.JPG"
-SVG_MINOR1_HREF = "IMG_2589.JPG"
-SVG_MINOR2_HREF = "../../ChatGPT Image 27 февр. 2026 г., 13_59_03.png"
-SVG_LOGO_HREF = "C:\\Users\\user\\Downloads\\Дополнительный.png"
-SVG_SPECS_GRID = """
-<g id="spec-grid">
-	<g>
-		<path class="st15" d="M56.1,468.2c132.5-0.5,281.1-0.5,413.6,0C337.2,468.8,188.6,468.8,56.1,468.2L56.1,468.2z"/>
-	</g>
-	<g>
-		<path class="st15" d="M56.1,534.2c132.5-0.5,281.1-0.5,413.6,0C337.2,534.7,188.6,534.7,56.1,534.2L56.1,534.2z"/>
-	</g>
-	<g>
-		<path class="st15" d="M56.1,600.1c132.5-0.5,281.1-0.5,413.6,0C337.2,600.6,188.6,600.6,56.1,600.1L56.1,600.1z"/>
-	</g>
-	<g>
-		<path class="st15" d="M56.1,666c132.5-0.5,281.1-0.5,413.6,0C337.2,666.6,188.6,666.6,56.1,666L56.1,666z"/>
-	</g>
-	<path class="st16" d="M174.2,423.3c0,8,0,16,0,24"/>
-	<path class="st16" d="M174.2,489.2c0,8,0,16,0,24"/>
-	<path class="st16" d="M174.2,555.1c0,8,0,16,0,24"/>
-	<path class="st16" d="M174.2,621.1c0,8,0,16,0,24"/>
-	<path class="st16" d="M174.2,687c0,8,0,16,0,24"/>
-</g>
-"""
+def sniff_media_type(data: bytes) -> str:
+    """Определяет MIME картинки по сигнатуре (Telegram присылает и JPEG, и PNG/WebP документами)."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "image/jpeg"
+
+
+# Псевдо-origin, запросы к которому перехватывает page.route и отдаёт байты прямо из памяти.
+ASSET_ORIGIN = "http://card-assets.local"
+
+
+class CardAssets:
+    """
+    Картинки одной карточки.
+    Режим "data_url" — классическое встраивание base64 прямо в SVG.
+    Режим "route" — в SVG попадает короткий URL, а Chromium получает исходные байты через page.route:
+    многомегабайтные base64-строки не создаются ни в Python, ни в HTML.
+    """
+
+    def __init__(self, mode: str = "data_url") -> None:
+        self.mode = mode if mode in EMBED_MODES else "data_url"
+        self._files: dict[str, tuple[bytes, str]] = {}
+
+    def href(self, name: str, data: bytes, media_type: str | None = None) -> str:
+        media_type = media_type or sniff_media_type(data)
+        if self.mode == "data_url":
+            return to_data_url(data, media_type)
+        self._files[name] = (data, media_type)
+        return f"{ASSET_ORIGIN}/{name}"
+
+    async def attach(self, page: Any) -> None:
+        """Подключает раздачу файлов к странице Playwright (до set_content)."""
+        if self._files:
+            await page.route(f"{ASSET_ORIGIN}/**", self._handle_route)
+
+    async def _handle_route(self, route: Any) -> None:
+        name = route.request.url.rsplit("/", 1)[-1]
+        item = self._files.get(name)
+        if item is None:
+            await route.abort()
+            return
+        body, media_type = item
+        await route.fulfill(status=200, body=body, content_type=media_type)
 
 
 def _esc(s: str) -> str:
@@ -81,33 +114,33 @@ def _esc(s: str) -> str:
     return html.escape(s or "", quote=True)
 
 
-def _wrap_minor_text(text: str, max_chars: int = 43, max_lines: int = 3) -> list[str]:
-    """Делит описание на несколько строк без обрезки и многоточия (по умолчанию ширина ≈43 символа, блок +20%)."""
-    src = " ".join((text or "").replace("\r", "\n").split())
-    if not src:
-        return []
-    words = src.split(" ")
-    lines: list[str] = []
-    current = ""
-    for word in words:
-        candidate = word if not current else f"{current} {word}"
-        if len(candidate) <= max_chars:
-            current = candidate
-            continue
-        lines.append(current if current else word[:max_chars])
-        current = word if len(word) <= max_chars else word[max_chars:]
-        if len(lines) >= max_lines:
-            break
-    if len(lines) < max_lines and current:
-        lines.append(current)
-    if len(lines) > max_lines:
-        lines = lines[:max_lines]
-    return lines
-
-
-DEFAULT_MINOR_1 = "Это решение подойдёт не только геймерам,"
-DEFAULT_MINOR_2 = "но и дизайнерам, стримерам, 3D-моделлерам"
-DEFAULT_MINOR_3 = "и видеомонтажёрам."
+def _fit_text(slot: TextSlot, text: str) -> tuple[str, str]:
+    """
+    Текст для однострочного слота с подбором кегля по метрикам шрифта (см. text_layout).
+    Возвращает (экранированный текст, доп. атрибуты): если строка не помещается в родной кегль,
+    у <tspan>/<text> добавляется style="font-size:…".
+    """
+    layout = layout_text(slot, text)
+    value = _esc(layout.lines[0] if layout.lines else "")
+    size_attr = ""
+    if layout.lines and layout.font_size != slot.font_size:
+        size_attr = f' style="font-size:{layout.font_size:g}px"'
+    return value, size_attr
+
+
+def _split_spec(raw: str) -> tuple[str, str]:
+    """
+    Характеристика — пара «левая часть — правая часть».
+    Пользователь может вводить с тире, но на карточке тире не показываем:
+    колонка слева = «ключ», колонка справа = «значение».
+    """
+    raw = str(raw or "").strip()
+    for sep in ("—", " - ", " -", "- ", "-"):
+        if sep in raw:
+            left, right = raw.split(sep, 1)
+            return left.strip(), right.strip()
+    # Если тире нет — показываем строку целиком в левой колонке.
+    return raw, ""
 
 
 def build_svg(
@@ -124,224 +157,126 @@ def build_svg(
     specs: list[str],
     template_id: int = 1,
     use_default_logo: bool = True,
+    assets: CardAssets | None = None,
 ) -> str:
-    """Собирает SVG из шаблона: 3 фото, логотип, все тексты (название главное/минорное, цена, до 5 характеристик)."""
-    template_path = SVG_TEMPLATES.get(int(template_id) if template_id in SVG_TEMPLATES else 1, SVG_TEMPLATE_PATH)
-    if not template_path.exists():
-        raise FileNotFoundError(f"Шаблон SVG не найден: {template_path}")
-    # Шаблоны должны быть в UTF-8, но на всякий случай поддерживаем CP1251 (частые экспорты из Illustrator на Windows).
-    try:
-        template = template_path.read_text(encoding="utf-8")
-    except UnicodeDecodeError:
-        template = template_path.read_text(encoding="cp1251")
-
-    main_url = to_data_url(main_photo)
-    minor1_url = to_data_url(minor_photo_1)
-    minor2_url = to_data_url(minor_photo_2)
-    svg = template.replace(f'xlink:href="{SVG_MAIN_HREF}"', f'xlink:href="{main_url}"')
-    svg = svg.replace(f'xlink:href="{SVG_MINOR1_HREF}"', f'xlink:href="{minor1_url}"')
-    svg = svg.replace(f'xlink:href="{SVG_MINOR2_HREF}"', f'xlink:href="{minor2_url}"')
-    # Поддержка старых/битых путей во 2–3 шаблонах (экспорт из Illustrator в CP1251 с заменой кириллицы на «?»).
-    svg = svg.replace(
-        'xlink:href="../../ChatGPT Image 27 ????. 2026 ?., 13_59_03.png"',
-        f'xlink:href="{minor2_url}"',
-    )
-
+    """
+    Собирает SVG из шаблона: 3 фото, логотип, все тексты (название главное/минорное, цена, до 5 характеристик).
+    assets определяет, как картинки попадают в SVG (по умолчанию — data URL).
+    """
+    if assets is None:
+        assets = CardAssets()
+    template: CardTemplate = get_template(template_id)
+
+    default_logo = get_default_logo() if use_default_logo and logo_bytes is None else None
     if logo_bytes is not None:
-        logo_url = to_data_url(logo_bytes, "image/png")
-    elif use_default_logo and LOGO_DEFAULT_PATH.exists():
-        # Логотип по умолчанию (если пользователь явно не отключил логотип).
-        logo_url = to_data_url(LOGO_DEFAULT_PATH.read_bytes(), "image/png")
+        logo_url = assets.href("logo", logo_bytes)
+    elif default_logo is not None:
+        # Логотип по умолчанию (если пользователь явно не отключил логотип), подготовлен при старте.
+        logo_url = assets.href("logo", default_logo, "image/png")
     else:
+        # Пользователь выбрал вариант без логотипа: элемент <image> логотипа в SVG не попадает.
         logo_url = None
-
-    if logo_url:
-        svg = svg.replace(f'xlink:href="{SVG_LOGO_HREF}"', f'xlink:href="{logo_url}"')
-        svg = svg.replace(
-            'xlink:href="C:\\Users\\user\\Downloads\\??????????????.png"',
-            f'xlink:href="{logo_url}"',
-        )
-    else:
-        # Пользователь выбрал вариант без логотипа: убираем элемент <image> с путём логотипа,
-        # чтобы не оставлять «битую» иконку отсутствующего файла.
-        for placeholder in (
-            '<image style="overflow:visible;" width="2480" height="1748" xlink:href="C:\\Users\\user\\Downloads\\Дополнительный.png"  transform="matrix(0.193 0 0 0.193 847.4407 726.5693)">\n</image>',
-            '<image style="overflow:visible;" width="2480" height="1748" xlink:href="C:\\Users\\user\\Downloads\\??????????????.png"  transform="matrix(0.193 0 0 0.193 847.4407 726.5693)">\n</image>',
-        ):
-            svg = svg.replace(placeholder, "")
-
+    hrefs = {
+        "main": assets.href("main", main_photo),
+        "minor1": assets.href("minor1", minor_photo_1),
+        "minor2": assets.href("minor2", minor_photo_2),
+        "logo": logo_url,
+    }
+
+    texts: dict[str, tuple[str, str]] = {}
+
+    def put(name: str, text: str) -> None:
+        slot = template.texts.get(name)
+        if slot is not None:
+            texts[name] = _fit_text(slot, text or template.defaults.get(name, ""))
+
+    put("title_main", title_main)
+    put("title_sub", title_sub)
+    put("bottom_line1", text_bottom_line1)
+    put("bottom_line2", text_bottom_line2)
+    put("price", price)
+
+    # Описание переносится по строкам группы text_minor.1..N; без текста остаются строки-образцы шаблона.
+    minor_names = template.groups.get("text_minor", ())
     minor_input = (text_minor or "").strip()
-    if minor_input:
-        if "\n" in minor_input:
-            minor_lines = [line.strip() for line in minor_input.split("\n") if line.strip()]
+    if minor_names:
+        if minor_input:
+            minor_lines = layout_text(template.texts["text_minor"], minor_input).lines
         else:
-            minor_lines = _wrap_minor_text(minor_input)
-        minor_1 = _esc(minor_lines[0] if len(minor_lines) > 0 else "")
-        minor_2 = _esc(minor_lines[1] if len(minor_lines) > 1 else "")
-        minor_3 = _esc(minor_lines[2] if len(minor_lines) > 2 else "")
-    else:
-        minor_1 = _esc(DEFAULT_MINOR_1)
-        minor_2 = _esc(DEFAULT_MINOR_2)
-        minor_3 = _esc(DEFAULT_MINOR_3)
-
-    svg = svg.replace("Msi Bravo 15.6", _esc(title_main or "Msi Bravo 15.6"))
-    svg = svg.replace("RTX 4060 Ryzen 7 7535HS", _esc(title_sub or "RTX 4060 Ryzen 7 7535HS"))
-
-    # Верхний минорный текст: поддерживаем и нормальные строки, и «кракозябры» из старых шаблонов.
-    svg = svg.replace(DEFAULT_MINOR_1, minor_1)
-    svg = svg.replace(DEFAULT_MINOR_2, minor_2)
-    svg = svg.replace(DEFAULT_MINOR_3, minor_3)
-    svg = svg.replace("??? ??????? ???????? ?? ?????? ????????,", minor_1)
-    svg = svg.replace("?? ? ??????????, ?????????, 3D-??????????", minor_2)
-    svg = svg.replace("? ???????????????.", minor_3)
-
-    # Нижний блок («Гарантия/Доставка») — тоже с поддержкой битой кириллицы.
-    bottom_line1 = _esc(text_bottom_line1 or "Гарантия до 12 месяцев")
-    bottom_line2 = _esc(text_bottom_line2 or "Доставка или самовывоз")
-    for placeholder in ("Гарантия до 12 месяцев", "???????? ?? 12 ???????"):
-        svg = svg.replace(placeholder, bottom_line1)
-    for placeholder in ("Доставка или самовывоз", "???????? ??? ?????????"):
-        svg = svg.replace(placeholder, bottom_line2)
-
-    # Цена: цифры совпадают, но в старых файлах знак рубля заменён на «?».
-    price_text = _esc(price or "69 990 ₽ ")
-    for placeholder in ("69 990 ₽ ", "69 990 ? "):
-        svg = svg.replace(placeholder, price_text)
-
-    # Характеристики — пары «левая часть — правая часть» (до 5 пар).
-    # Пользователь может вводить с тире, но на карточке тире не показываем:
-    # колонка слева = «ключ», колонка справа = «значение».
-    has_specs = any(str(item).strip() for item in specs[:5]) if specs else False
-    for i in range(5):
-        left_val = ""
-        right_val = ""
-        if i < len(specs) and specs[i]:
-            raw = str(specs[i]).strip()
-            for sep in ("—", " - ", " -", "- ", "-"):
-                if sep in raw:
-                    parts = raw.split(sep, 1)
-                    # Тире выкидываем из отображения: только левая и правая части.
-                    left_val = _esc(parts[0].strip()) if parts else ""
-                    right_val = _esc(parts[1].strip()) if len(parts) > 1 else ""
-                    break
-            else:
-                # Если тире нет — показываем строку целиком в левой колонке.
-                left_val = _esc(raw)
-        svg = svg.replace(f"PLACEHOLDER_SPEC_{i + 1}_LEFT", left_val)
-        svg = svg.replace(f"PLACEHOLDER_SPEC_{i + 1}_RIGHT", right_val)
-
-    if has_specs:
-        svg = svg.replace('id="original-specs-paths"', 'id="original-specs-paths" visibility="hidden"')
-        svg = svg.replace('id="user-specs" visibility="hidden"', 'id="user-specs"')
-        if "id=\"spec-grid\"" not in svg:
-            svg = svg.replace("</svg>", f"{SVG_SPECS_GRID}\n</svg>")
-
-    return svg
-
-
-async def render_svg_to_png(svg_content: str, output_path: Path, width: int = 1921, height: int = 1081) -> None:
-    """Рендерит SVG в PNG через Playwright (viewBox шаблона 0 0 1921 1081). Подключает шрифты из app/fonts при наличии."""
+            minor_lines = [template.defaults.get(name, "") for name in minor_names]
+        for idx, name in enumerate(minor_names):
+            texts[name] = (_esc(minor_lines[idx] if idx < len(minor_lines) else ""), "")
+
+    # Характеристики: столько пар, сколько строк spec_N_left/right размечено в шаблоне.
+    rows = template.spec_rows()
+    specs = [str(item) for item in (specs or [])[:rows]]
+    has_specs = any(item.strip() for item in specs)
+    for i in range(rows):
+        left_val, right_val = _split_spec(specs[i]) if i < len(specs) else ("", "")
+        for side, value in (("left", left_val), ("right", right_val)):
+            slot = template.texts.get(f"spec_{i + 1}_{side}")
+            if slot is not None:
+                texts[f"spec_{i + 1}_{side}"] = _fit_text(slot, value)
+
+    return template.render(hrefs, texts, {"specs": has_specs})
+
+
+async def render_svg_to_png(
+    svg_content: str,
+    output_path: Path,
+    width: int = 1921,
+    height: int = 1081,
+    scale: float = 1.0,
+    assets: CardAssets | None = None,
+) -> None:
+    """
+    Рендерит SVG в PNG через Playwright (viewBox шаблона 0 0 1921 1081). Подключает шрифты из app/fonts при наличии.
+    scale — device scale factor: SVG векторный, поэтому итоговый PNG будет width*scale × height*scale без потери чёткости.
+    assets — картинки в режиме "route": раздаются странице из памяти.
+    """
     font_css = _get_font_face_css()
     html_page = f"""<!doctype html><html><head><meta charset="UTF-8"/>{font_css}</head><body style="margin:0;background:white;">{svg_content}</body></html>"""
-    async with async_playwright() as p:
-        browser = await p.chromium.launch()
-        page = await browser.new_page(viewport={"width": width, "height": height})
+    browser = await get_browser()
+    page = await browser.new_page(viewport={"width": width, "height": height}, device_scale_factor=scale)
+    gauge_add("pages", 1)
+    try:
+        if assets is not None:
+            await assets.attach(page)
         await page.set_content(html_page, wait_until="networkidle")
         await page.locator("svg").first.screenshot(path=str(output_path))
-        await browser.close()
-
-
-def build_html(config: dict[str, Any], photos: list[bytes], features: str, description: str, price: str) -> str:
-    output_cfg = config["output"]
-    cards_cfg = config["cards"]
-    price_cfg = cards_cfg["price_block"]
-    desc_cfg = cards_cfg["description_block"]
-
-    width = int(output_cfg["width"])
-    height = int(output_cfg["height"])
-    padding = int(output_cfg["padding"])
-    gap = int(output_cfg["gap"])
-    photo_gap = int(output_cfg.get("photo_gap", gap))
-    bg_color = output_cfg["background_color"]
-    base_font_family = output_cfg.get("font_family", "Arial, Helvetica, sans-serif")
-    grid_radius = int(output_cfg["photo_grid_border_radius"])
-    left_ratio = float(output_cfg.get("left_column_ratio", 0.5))
-    desc_font_family = desc_cfg.get("font_family", base_font_family)
-    price_font_family = price_cfg.get("font_family", base_font_family)
-    title_font_size = int(desc_cfg.get("title_font_size", desc_cfg["font_size"]))
-    features_title = html.escape(desc_cfg.get("features_title", "Характеристики"))
-    description_title = html.escape(desc_cfg.get("description_title", "Описание"))
-
-    safe_features = html.escape(features).replace("\n", "<br/>")
-    safe_description = html.escape(description).replace("\n", "<br/>")
-    safe_price_title = html.escape(price_cfg.get("title", "Название-цена"))
-    safe_price = html.escape(price)
-    n = len(photos)
-
-    def img_cell(data_url: str) -> str:
-        return f'<div class="cell"><img src="{data_url}" alt="" /></div>'
-
-    photo_urls = [to_data_url(p) for p in photos]
-    if n == 1:
-        u = photo_urls[0]
-        photo_area = f'<div class="photo-area photo-area-1">{img_cell(u)}{img_cell(u)}{img_cell(u)}{img_cell(u)}</div>'
-    elif n == 2:
-        u1, u2 = photo_urls[0], photo_urls[1]
-        photo_area = f'<div class="photo-area photo-area-2">{img_cell(u1)}{img_cell(u2)}{img_cell(u1)}{img_cell(u2)}</div>'
-    else:
-        u1, u2, u3 = photo_urls[0], photo_urls[1], photo_urls[2]
-        photo_area = f'<div class="photo-strip">{img_cell(u1)}{img_cell(u2)}{img_cell(u3)}</div>'
-
-    if n == 3:
-        card_body = f"""
-    <div class="three-top">{photo_area}</div>
-    <div class="three-bottom">
-      <div class="three-left info-block"><div class="info-title">{description_title}</div><div class="info-text">{safe_description}</div></div>
-      <div class="three-right info-block"><div class="info-title">{features_title}</div><div class="info-text">{safe_features}</div></div>
-    </div>
-    <div class="price"><div class="price-title">{safe_price_title}</div><div class="price-value">{safe_price}</div></div>
-"""
-    else:
-        card_body = f"""
-    <div class="content">
-      <div class="left">{photo_area}</div>
-      <div class="right">
-        <div class="info">
-          <div class="info-block"><div class="info-title">{features_title}</div><div class="info-text">{safe_features}</div></div>
-          <div class="info-block"><div class="info-title">{description_title}</div><div class="info-text">{safe_description}</div></div>
-        </div>
-      </div>
-    </div>
-    <div class="price"><div class="price-title">{safe_price_title}</div><div class="price-value">{safe_price}</div></div>
-"""
-
-    return f"""<!doctype html><html lang="ru"><head><meta charset="UTF-8" /><style>
-*{{box-sizing:border-box;}} body{{margin:0;width:{width}px;height:{height}px;font-family:{base_font_family};background:transparent;}}
-#card{{width:100%;height:100%;background:{bg_color};display:flex;flex-direction:column;padding:{padding}px;gap:{gap}px;}}
-.content{{flex:1;min-height:0;display:flex;gap:{gap}px;}} .three-top{{flex:0 0 25%;min-height:0;}}
-.photo-strip{{width:100%;height:100%;display:flex;gap:{photo_gap}px;}} .photo-strip .cell{{flex:1;min-width:0;min-height:0;}}
-.three-bottom{{flex:1;min-height:0;display:flex;gap:{gap}px;}} .three-left,.three-right{{flex:1;min-width:0;min-height:0;}}
-.left{{flex:0 0 {left_ratio * 100}%;width:{left_ratio * 100}%;min-width:0;display:flex;flex-direction:column;border-radius:{grid_radius}px;overflow:hidden;}}
-.right{{flex:0 0 {(1 - left_ratio) * 100}%;width:{(1 - left_ratio) * 100}%;min-width:0;display:flex;flex-direction:column;gap:{gap}px;}}
-.photo-area{{flex:1;display:flex;flex-direction:column;gap:{photo_gap}px;min-height:0;}} .photo-area-1 .cell,.photo-area-2 .cell{{flex:1;min-height:0;}}
-.cell{{overflow:hidden;background:#ddd;}} .cell img{{width:100%;height:100%;object-fit:cover;object-position:center;display:block;}}
-.info{{flex:1;min-height:0;display:flex;flex-direction:column;gap:{photo_gap}px;}}
-.info-block{{flex:1;min-height:0;border:{desc_cfg["border"]};border-radius:{int(desc_cfg["border_radius"])}px;background:{desc_cfg["background_color"]};color:{desc_cfg["text_color"]};padding:{desc_cfg["padding"]};overflow:auto;}}
-.info-title{{font-size:{title_font_size}px;font-family:{desc_font_family};font-weight:900;margin-bottom:4px;}}
-.info-text{{font-size:{int(desc_cfg["font_size"])}px;font-family:{desc_font_family};line-height:{float(desc_cfg["line_height"])};font-weight:700;white-space:normal;}}
-.price{{width:100%;flex-shrink:0;display:flex;align-items:center;justify-content:flex-start;gap:8px;padding:{price_cfg["padding"]};border:{price_cfg["border"]};border-radius:{int(price_cfg["border_radius"])}px;background:{price_cfg["background_color"]};color:{price_cfg["text_color"]};font-family:{price_font_family};}}
-.price-title{{font-size:{max(12, int(price_cfg["font_size"]) - 20)}px;font-weight:800;line-height:1;margin-bottom:0;white-space:nowrap;}}
-.price-value{{font-size:{max(12, int(price_cfg["font_size"]) - 20)}px;font-weight:900;line-height:1;white-space:nowrap;-webkit-text-stroke:{int(price_cfg["text_stroke_width"])}px {price_cfg["text_stroke_color"]};text-shadow:0 0 1px {price_cfg["text_stroke_color"]};}}
-</style></head><body><div id="card">{card_body}</div></body></html>"""
-
-
-async def render_png(html_content: str, width: int, height: int, output_path: Path) -> None:
-    async with async_playwright() as p:
-        browser = await p.chromium.launch()
-        page = await browser.new_page(viewport={"width": width, "height": height})
-        await page.set_content(html_content, wait_until="networkidle")
-        await page.locator("#card").screenshot(path=str(output_path))
-        await browser.close()
+    finally:
+        gauge_add("pages", -1)
+        await page.close()
+
+
+# Варианты экспорта карточки: (суффикс файла, ширина в px, формат), по убыванию ширины.
+# Высота считается по пропорциям рендера. «avito» — под размер фото в объявлении, «thumb» — превью для каталога.
+CARD_VARIANTS: tuple[tuple[str, int, str], ...] = (
+    ("avito", 1280, "JPEG"),
+    ("thumb", 480, "JPEG"),
+)
+
+
+def export_card_variants(png_path: Path, variants: tuple[tuple[str, int, str], ...] = CARD_VARIANTS) -> list[Path]:
+    """
+    Делает уменьшенные копии готовой карточки одной цепочкой даунскейла (full → avito → thumb),
+    без повторного рендера в Chromium. Каждый следующий вариант уменьшается из предыдущего.
+    """
+    paths: list[Path] = []
+    with Image.open(png_path) as full:
+        current = full.convert("RGB")
+    for suffix, target_width, fmt in variants:
+        if target_width < current.width:
+            target_height = max(1, round(current.height * target_width / current.width))
+            current = current.resize((target_width, target_height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        ext = "jpg" if fmt == "JPEG" else fmt.lower()
+        path = png_path.with_name(f"{png_path.stem}_{suffix}.{ext}")
+        if fmt == "JPEG":
+            current.save(path, fmt, quality=90, optimize=True, progressive=True)
+        else:
+            current.save(path, fmt)
+        paths.append(path)
+    return paths
 
 
 async def build_card_from_svg(
@@ -360,49 +295,36 @@ async def build_card_from_svg(
     specs: list[str] | None = None,
     template_id: int = 1,
     use_default_logo: bool = True,
+    embed_mode: str = "route",
+    scale: float = 1.0,
 ) -> tuple[Path, Path]:
-    """Собирает карточку из шаблона SVG (3 фото, логотип, все тексты), сохраняет SVG и рендерит PNG."""
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    svg_path = OUTPUT_DIR / f"card_{user_id}_{ts}.svg"
-    png_path = OUTPUT_DIR / f"card_{user_id}_{ts}.png"
-    svg_content = build_svg(
-        main_photo,
-        minor_photo_1,
-        minor_photo_2,
-        logo_bytes,
-        title_main,
-        title_sub,
-        text_minor,
-        text_bottom_line1,
-        text_bottom_line2,
-        price,
-        specs or [],
-        template_id=template_id,
-        use_default_logo=use_default_logo,
-    )
-    svg_path.write_text(svg_content, encoding="utf-8")
-    await render_svg_to_png(svg_content, png_path)
+    """
+    Собирает карточку из шаблона SVG (3 фото, логотип, все тексты), сохраняет SVG и рендерит PNG.
+    embed_mode: "route" — фото отдаются Chromium из памяти по URL, "data_url" — встраиваются base64.
+    """
+    # Суффикс — чтобы параллельные рендеры одного пользователя (или превью шаблонов) не делили файл.
+    stem = f"card_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    svg_path = OUTPUT_DIR / f"{stem}.svg"
+    png_path = OUTPUT_DIR / f"{stem}.png"
+    assets = CardAssets(embed_mode)
+    # Сборка SVG (вёрстка текста) идёт без await — её CPU считаем в стоимость генерации (quotas).
+    with cpu_cost():
+        svg_content = build_svg(
+            main_photo,
+            minor_photo_1,
+            minor_photo_2,
+            logo_bytes,
+            title_main,
+            title_sub,
+            text_minor,
+            text_bottom_line1,
+            text_bottom_line2,
+            price,
+            specs or [],
+            template_id=template_id,
+            use_default_logo=use_default_logo,
+            assets=assets,
+        )
+    await asyncio.to_thread(svg_path.write_text, svg_content, encoding="utf-8")
+    await render_svg_to_png(svg_content, png_path, scale=scale, assets=assets)
     return svg_path, png_path
-
-
-async def build_card(
-    config: AppConfig,
-    photos: list[bytes],
-    features: str,
-    description: str,
-    price: str,
-    user_id: int,
-) -> tuple[Path, Path]:
-    html_content = build_html(config.raw, photos, features, description, price)
-    width = int(config.raw["output"]["width"])
-    height = int(config.raw["output"]["height"])
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_path = OUTPUT_DIR / f"card_{user_id}_{ts}.png"
-    html_output_path = OUTPUT_DIR / f"card_{user_id}_{ts}.html"
-    html_export = html_content
-    for idx, photo in enumerate(photos, start=1):
-        html_export = html_export.replace(to_data_url(photo), f"pic{idx}.jpg")
-    html_output_path.write_text(html_export, encoding="utf-8")
-    await render_png(html_content, width, height, output_path)
-    return output_path, html_output_path
-
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiogram.types import InputFile
+from aiohttp import ClientConnectorError, ConnectionTimeoutError
+
+from .constants import DATA_DIR
+from .metrics import gauge_add, record_error
+
+
+logger = logging.getLogger(__name__)
+
+# Неотправленные сообщения (исчерпаны повторы) — по одной JSON-записи на строку, для разбора вручную.
+DEAD_LETTERS_PATH = DATA_DIR / "dead_letters.jsonl"
+
+# Лимиты Telegram (https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this):
+# ~30 сообщений в секунду на бота, ~1 в секунду в личный чат (короткие всплески допустимы), 20 в минуту в группу.
+GLOBAL_RATE = (30.0, 30.0)  # (токенов в секунду, ёмкость)
+PRIVATE_CHAT_RATE = (1.0, 3.0)
+GROUP_CHAT_RATE = (20.0 / 60.0, 3.0)
+
+# Повторы при 429 (RetryAfter) и при сетевых/серверных ошибках.
+MAX_RETRY_AFTER_ATTEMPTS = 5
+MAX_NETWORK_ATTEMPTS = 4
+NETWORK_BACKOFF = 1.0  # 1, 2, 4 с
+# Корзины чатов, к которым давно не обращались, удаляются, чтобы словарь не рос бесконечно.
+_CHAT_BUCKETS_LIMIT = 1000
+_CHAT_BUCKET_IDLE = 120.0
+
+
+class TokenBucket:
+    """
+    Token bucket без блокировок (бот однопоточный): reserve() забирает токен сразу
+    и возвращает, сколько подождать. Очередь ожидающих выстраивается по отрицательному балансу.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float = 1.0) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate, self.blocked_until - now)
+
+    def try_take(self, amount: float = 1.0) -> float:
+        """Забирает токен, только если он есть (без очереди). Возвращает 0 или сколько ждать до следующего токена."""
+        self._refill(time.monotonic())
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def block(self, seconds: float) -> None:
+        """Telegram попросил подождать (RetryAfter): до этого момента отправки в корзину не идут."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+def _is_outgoing_message(method: TelegramMethod[Any]) -> bool:
+    """Методы, на которые распространяются лимиты отправки (сообщения, медиа, правки сообщений)."""
+    name = type(method).__name__
+    return name.startswith(("Send", "Edit", "Copy", "Forward"))
+
+
+def _describe(method: TelegramMethod[Any]) -> dict[str, Any]:
+    """Короткое описание запроса для dead-letter лога (без содержимого файлов)."""
+    info: dict[str, Any] = {"method": type(method).__name__, "chat_id": getattr(method, "chat_id", None)}
+    for key in ("text", "caption"):
+        value = getattr(method, key, None)
+        if isinstance(value, str):
+            info[key] = value[:500]
+    for key in ("photo", "document", "video"):
+        value = getattr(method, key, None)
+        if isinstance(value, str):
+            info[key] = value
+        elif isinstance(value, InputFile):
+            info[key] = value.filename
+    media = getattr(method, "media", None)
+    if isinstance(media, list):
+        info["media"] = [getattr(getattr(item, "media", None), "filename", None) for item in media]
+    return info
+
+
+def _creates_message(method: TelegramMethod[Any]) -> bool:
+    """Send/Copy/Forward: повтор уже выполненного запроса пришлёт сообщение второй раз (правки повторять безопасно)."""
+    return type(method).__name__.startswith(("Send", "Copy", "Forward"))
+
+
+def _not_delivered(error: BaseException) -> bool:
+    """
+    True, если запрос точно не выполнен Telegram: ответ 5xx или соединение так и не установлено.
+    Таймаут чтения и обрыв соединения после отправки — неизвестно, дошёл ли запрос.
+    """
+    if isinstance(error, TelegramServerError):
+        return True
+    return isinstance(error.__cause__, (ClientConnectorError, ConnectionTimeoutError))
+
+
+def _append_dead_letter(record: dict[str, Any]) -> None:
+    try:
+        with DEAD_LETTERS_PATH.open("a", encoding="utf-8") as fh:
+            fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError:
+        logger.exception("Не удалось записать dead letter")
+
+
+async def write_dead_letter(method: TelegramMethod[Any], error: BaseException, attempts: int) -> None:
+    record_error("dead_letter")
+    record = {"ts": time.time(), "attempts": attempts, "error": f"{type(error).__name__}: {error}", **_describe(method)}
+    await asyncio.to_thread(_append_dead_letter, record)
+
+
+class SendPipeline(BaseRequestMiddleware):
+    """
+    Middleware исходящих запросов бота (bot.session.middleware):
+    - ограничивает скорость отправки глобально и по каждому чату под лимиты Telegram;
+    - при 429 ждёт retry_after и повторяет, приостанавливая отправку в этот чат;
+    - при сетевых и 5xx ошибках повторяет с экспоненциальной задержкой;
+      файлы (BufferedInputFile/FSInputFile) перечитываются при каждой попытке, так что загрузка повторяется целиком;
+    - отправку новых сообщений (Send/Copy/Forward) повторяет, только если запрос точно не дошёл (_not_delivered):
+      после таймаута ответа Telegram мог уже принять сообщение, и повтор прислал бы карточку дважды;
+    - если повторы исчерпаны, пишет запрос в data/dead_letters.jsonl и пробрасывает ошибку.
+    """
+
+    def __init__(self) -> None:
+        self._global = TokenBucket(*GLOBAL_RATE)
+        self._chats: dict[Any, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= _CHAT_BUCKETS_LIMIT:
+                now = time.monotonic()
+                for key in [k for k, b in self._chats.items() if now - b.updated > _CHAT_BUCKET_IDLE]:
+                    del self._chats[key]
+            is_group = isinstance(chat_id, str) or (isinstance(chat_id, int) and chat_id < 0)
+            bucket = TokenBucket(*(GROUP_CHAT_RATE if is_group else PRIVATE_CHAT_RATE))
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Any,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if not _is_outgoing_message(method):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+        retry_after_attempts = 0
+        network_attempts = 0
+        while True:
+            delay = self._global.reserve()
+            if chat_bucket is not None:
+                delay = max(delay, chat_bucket.reserve())
+            if delay > 0:
+                # Сколько отправок сейчас ждёт лимитов Telegram — видно на панели «Состояние бота».
+                gauge_add("send_waiting", 1)
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    gauge_add("send_waiting", -1)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as exc:
+                retry_after_attempts += 1
+                (chat_bucket or self._global).block(exc.retry_after)
+                if retry_after_attempts >= MAX_RETRY_AFTER_ATTEMPTS:
+                    await write_dead_letter(method, exc, retry_after_attempts + network_attempts)
+                    raise
+                logger.warning("429 от Telegram (%s, чат %s): жду %s с", type(method).__name__, chat_id, exc.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as exc:
+                network_attempts += 1
+                if network_attempts >= MAX_NETWORK_ATTEMPTS or (_creates_message(method) and not _not_delivered(exc)):
+                    await write_dead_letter(method, exc, retry_after_attempts + network_attempts)
+                    raise
+                backoff = NETWORK_BACKOFF * 2 ** (network_attempts - 1)
+                logger.warning("Ошибка сети при %s (чат %s): %s, повтор через %.0f с", type(method).__name__, chat_id, exc, backoff)
+                await asyncio.sleep(backoff)
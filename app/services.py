@@ -1,25 +1,176 @@
-from io import BytesIO
+import asyncio
 import logging
+import time
+from pathlib import Path
+from typing import Any
 
 from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
 from aiogram.fsm.context import FSMContext
-from aiogram.types import BufferedInputFile, Message
+from aiogram.types import Message
 
 from .auth_store import get_role
-from .rendering import build_card_from_svg
-from .ui import main_menu_keyboard
+from .context import get_settings
+from .file_id_store import send_album_once, send_document_once, send_photo_once
+from .images import SLOT_SIZES, CappedBuffer, ImageRejected, check_upload_size, fit_image, fit_image_file
+from .job_journal import prune_finished
+from .jobs import (
+    CardJob,
+    complete_job,
+    defer_job,
+    fail_job,
+    finish_job,
+    is_draining,
+    load_job,
+    load_pending_jobs,
+    recently_sent,
+    single_flight,
+    start_job,
+)
+from .logo_assets import load_logo_asset, prepare_logo, save_shop_logo_asset
+from .logo_store import find_shop_by_logo, set_shop_logo
+from .metrics import cache_hit, incr, record_error, record_job
+from .photo_sizes import pick_file_id
+from .profiling import profiled
+from .quotas import (
+    RenderCost,
+    add_cost,
+    costed_task,
+    costed_to_thread,
+    quota_for,
+    quota_message,
+    refund_render_quota,
+    take_render_quota,
+    track_cost,
+)
+from .rendering import build_card_from_svg, export_card_variants
+from .startup import mark_once
+from .store_io import run_io
+from .template_registry import CardTemplate, get_template
+from .ui import main_menu_keyboard, retry_job_keyboard
 
 logger = logging.getLogger(__name__)
 
+# Задание, которое уже столько раз начиналось и не завершилось (процесс падал на нём), при старте не перезапускается сам:
+# пользователь получает кнопку «Повторить».
+MAX_RESUME_ATTEMPTS = 3
+# Задания старше суток при старте тоже не досоздаются молча — пользователь мог уже сделать карточку заново.
+RESUME_MAX_AGE = 24 * 3600
+# Предзагруженные фото хранятся 10 минут (обычное время заполнения анкеты) и не больше 300 штук.
+PREFETCH_TTL = 600.0
+PREFETCH_LIMIT = 300
 
-async def download_photos(bot: Bot, file_ids: list[str]) -> list[bytes]:
-    result: list[bytes] = []
-    for file_id in file_ids:
-        file = await bot.get_file(file_id)
-        buffer = BytesIO()
-        await bot.download_file(file.file_path, destination=buffer)
-        result.append(buffer.getvalue())
-    return result
+# (file_id, размер слота) -> (время запуска, задача скачивания и уменьшения фото, её стоимость).
+_PREFETCH: dict[tuple[str, tuple[int, int] | None], tuple[float, asyncio.Task[bytes], RenderCost]] = {}
+
+
+def _slot_box(template: CardTemplate | None, slot: str | None) -> tuple[int, int] | None:
+    box = SLOT_SIZES.get(slot or "")
+    if template is not None and slot:
+        box = template.image_box(slot, box)
+    return box
+
+
+async def _download_photo(bot: Bot, file_id: str, box: tuple[int, int] | None) -> bytes:
+    # Качаем самый маленький из размеров Telegram, которого хватает на слот, а не всегда самый большой.
+    file = await bot.get_file(pick_file_id(file_id, box))
+    api = bot.session.api
+    if api.is_local:
+        # Свой сервер Bot API (--local): файл уже лежит на общем томе — читаем его с диска через mmap, без HTTP.
+        check_upload_size(file.file_size)
+        add_cost(bytes_in=file.file_size or 0)
+        return await costed_to_thread(fit_image_file, Path(api.wrap_local_file.to_local(file.file_path)), box)
+    check_upload_size(file.file_size)
+    buffer = CappedBuffer()
+    await bot.download_file(file.file_path, destination=buffer)
+    data = buffer.getvalue()
+    buffer.close()
+    add_cost(bytes_in=len(data))
+    return await costed_to_thread(fit_image, data, box)
+
+
+def _prune_prefetch(now: float) -> None:
+    stale = [key for key, (ts, _, _) in _PREFETCH.items() if now - ts > PREFETCH_TTL]
+    overflow = len(_PREFETCH) - len(stale) - PREFETCH_LIMIT
+    if overflow > 0:
+        stale += sorted((k for k in _PREFETCH if k not in stale), key=lambda k: _PREFETCH[k][0])[:overflow]
+    for key in stale:
+        _, task, _ = _PREFETCH.pop(key)
+        task.cancel()
+
+
+def prefetch_photos(bot: Bot, file_ids: list[str], slots: list[str], template_id: int | None = None) -> None:
+    """
+    Запускает скачивание и уменьшение фото в фоне, как только они получены: пока пользователь заполняет
+    тексты, фото уже готовы, и download_photos при генерации берёт результат отсюда.
+    """
+    template = get_template(template_id) if template_id is not None else None
+    now = time.monotonic()
+    _prune_prefetch(now)
+    for file_id, slot in zip(file_ids, slots):
+        box = _slot_box(template, slot)
+        if (file_id, box) in _PREFETCH:
+            continue
+        # Стоимость скачивания запоминается отдельно и попадает в генерацию, которая возьмёт это фото.
+        task, cost = costed_task(_download_photo(bot, file_id, box))
+        # Ошибку заберёт download_photos; если результат так и не понадобится — не шумим в лог.
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        _PREFETCH[(file_id, box)] = (now, task, cost)
+
+
+async def download_photos(
+    bot: Bot, file_ids: list[str], slots: list[str] | None = None, template_id: int | None = None
+) -> list[bytes]:
+    """
+    Скачивает картинки потоково с ограничением размера (MAX_UPLOAD_BYTES) и сразу уменьшает
+    те, что больше своего слота в шаблоне (slots — имена слотов по порядку file_ids).
+    Размер слота берётся из разметки шаблона template_id, без шаблона — из SLOT_SIZES.
+    Все файлы скачиваются параллельно; уже предзагруженные (prefetch_photos) берутся готовыми.
+    Бросает ImageRejected, если файл слишком большой или не является картинкой.
+    """
+    template = get_template(template_id) if template_id is not None else None
+
+    async def one(idx: int, file_id: str) -> bytes:
+        box = _slot_box(template, slots[idx] if slots and idx < len(slots) else None)
+        prefetched = _PREFETCH.pop((file_id, box), None)
+        cache_hit("prefetch", prefetched is not None)
+        if prefetched is not None:
+            try:
+                return await prefetched[1]
+            except ImageRejected:
+                raise
+            except Exception:  # noqa: BLE001
+                # Сбой сети при предзагрузке — просто качаем ещё раз.
+                logger.warning("Предзагрузка фото %s не удалась, скачиваю заново", file_id)
+            finally:
+                add_cost(cost=prefetched[2])
+        return await _download_photo(bot, file_id, box)
+
+    return list(await asyncio.gather(*(one(idx, file_id) for idx, file_id in enumerate(file_ids))))
+
+
+async def store_shop_logo(bot: Bot, shop_id: int, logo_file_id: str) -> bytes:
+    """Скачивает логотип магазина один раз, обрезает/уменьшает под слот и сохраняет готовый файл."""
+    raw = (await download_photos(bot, [pick_file_id(logo_file_id, SLOT_SIZES["logo"])]))[0]
+    prepared = await costed_to_thread(prepare_logo, raw)
+    asset = await asyncio.to_thread(save_shop_logo_asset, shop_id, prepared)
+    await set_shop_logo(shop_id, logo_file_id, asset)
+    return prepared
+
+
+async def load_logo(bot: Bot, logo_file_id: str) -> bytes:
+    """
+    Возвращает подготовленный логотип для рендера. Для логотипов магазинов берётся готовый файл
+    из data/logos; если его ещё нет (логотип задан раньше) — готовится один раз и сохраняется.
+    """
+    shop = await find_shop_by_logo(logo_file_id)
+    if shop is not None:
+        prepared = await asyncio.to_thread(load_logo_asset, shop.logo_asset)
+        if prepared is not None:
+            return prepared
+        return await store_shop_logo(bot, shop.id, logo_file_id)
+    raw = (await download_photos(bot, [pick_file_id(logo_file_id, SLOT_SIZES["logo"])]))[0]
+    return await costed_to_thread(prepare_logo, raw)
 
 
 async def generate_and_send_card(
@@ -33,93 +184,293 @@ async def generate_and_send_card(
     data = await state.get_data()
     photo_file_ids: list[str] = data.get("photo_file_ids", [])  # [main, minor1, minor2]
     if len(photo_file_ids) != 3:
+        if recently_sent(message.chat.id):
+            # Запоздавшее повторное нажатие: карточка уже отправлена, а анкета очищена.
+            await message.answer("Карточка уже отправлена выше.")
+            return
         await message.answer("Нужно 3 фото: главное и два дополнительных.")
         return
-    await message.answer("Собираю карточку, подождите...")
-    try:
-        photos = await download_photos(bot, photo_file_ids)
-        main_b, minor1_b, minor2_b = photos[0], photos[1], photos[2]
-        template_id = int(data.get("template_id", 1) or 1)
-        skip_logo = bool(data.get("skip_logo"))
-        logo_bytes = None
-        logo_file_id: str | None = None
-        if not skip_logo:
-            logo_file_id = data.get("logo_file_id") or data.get("example_logo_file_id")
-            if logo_file_id:
-                try:
-                    logo_list = await download_photos(bot, [logo_file_id])
-                    if logo_list:
-                        logo_bytes = logo_list[0]
-                except Exception:
-                    # Если логотип не скачался — просто продолжаем без него.
-                    logo_bytes = None
-        # Готовим характеристики и подзаголовок на основе CPU / GPU.
-        raw_specs: list[str] = list(data.get("spec_list", []))
-
-        def _extract_value(label: str) -> str:
-            for item in raw_specs:
-                low = item.lower()
-                if low.startswith(label.lower()):
-                    parts = item.split("—", 1)
-                    if len(parts) > 1:
-                        return parts[1].strip()
-                    # Fallback: всё после двоеточия/пробела.
-                    return item[len(label) :].strip()
-            return ""
-
-        cpu_val = _extract_value("cpu")
-        gpu_val = _extract_value("gpu")
-        auto_title_sub = " ".join(part for part in (gpu_val, cpu_val) if part).strip()
-
-        # Форматируем цену: убираем всё, кроме цифр, ставим пробелы по тысячам и знак ₽.
-        raw_price = str(data.get("price", "")).strip()
-        digits = "".join(ch for ch in raw_price if ch.isdigit())
-        if digits:
-            try:
-                price_int = int(digits)
-                formatted_price = f"{price_int:,}".replace(",", " ") + " ₽"
-            except ValueError:
-                formatted_price = raw_price or ""
-        else:
-            formatted_price = ""
-
-        svg_path, png_path = await build_card_from_svg(
-            main_b,
-            minor1_b,
-            minor2_b,
-            message.from_user.id if message.from_user else 0,
-            logo_bytes=logo_bytes,
-            title_main=str(data.get("title_main", "")),
-            title_sub=auto_title_sub or str(data.get("title_sub", "")),
-            text_minor=str(data.get("text_minor", "")),
-            text_bottom_line1=str(data.get("text_bottom_line1", "")),
-            text_bottom_line2=str(data.get("text_bottom_line2", "")),
-            price=formatted_price,
-            specs=raw_specs,
-            template_id=template_id,
-            use_default_logo=not skip_logo,
-        )
-    except Exception:  # noqa: BLE001
-        # Логируем полный traceback в stderr/journalctl,
-        # а пользователю отправляем короткое сообщение (Telegram ограничивает длину текста).
-        logger.exception("Ошибка при создании карточки")
-        await message.answer("Ошибка при создании карточки. Подробности смотрите в логах сервера.")
+    user_id = requester_user_id if requester_user_id is not None else (message.from_user.id if message.from_user else 0)
+    job = CardJob(chat_id=message.chat.id, user_id=user_id, data=dict(data))
+    if is_draining():
+        # Бот останавливается: карточку соберёт следующий запуск.
+        await defer_job(job)
+        await message.answer("Бот перезапускается. Карточка будет создана и прислана сразу после перезапуска.")
+        if clear_state:
+            await state.clear()
+        return
+    # Двойное нажатие «Готово» или повтор сообщения: одинаковый запрос присоединяется к уже идущей генерации,
+    # а только что отправленная карточка не собирается заново.
+    ok, outcome = await single_flight(job.chat_id, job.data, lambda: run_user_card_job(bot, job))
+    if outcome == "recent":
+        await message.answer("Эта карточка уже отправлена выше.")
+        return
+    if not ok or outcome == "joined":
         return
-
-    photo_file = BufferedInputFile(png_path.read_bytes(), filename=png_path.name)
-    await message.answer_photo(photo_file, caption="Готово. Карточка по шаблону создана.")
-    try:
-        svg_path.unlink(missing_ok=True)
-        png_path.unlink(missing_ok=True)
-    except OSError:
-        pass
     if clear_state:
         await state.clear()
     # После генерации показываем главное меню
-    user_id = requester_user_id if requester_user_id is not None else (message.from_user.id if message.from_user else 0)
-    role = get_role(user_id)
+    role = await get_role(user_id)
     if role == "guest":
         # Гость после генерации — крайне маловероятно, но на всякий случай просто не показываем меню.
         return
     await message.answer("Главное меню. Выберите действие:", reply_markup=main_menu_keyboard(role))
 
+
+async def render_card(
+    bot: Bot,
+    data: dict[str, Any],
+    user_id: int,
+    embed_mode: str = "route",
+    scale: float = 1.0,
+    photos: list[bytes] | None = None,
+) -> tuple[Path, Path]:
+    """
+    Рендерит карточку по данным анкеты (FSM state data) и возвращает пути SVG и PNG в output/.
+    photos — уже готовые байты трёх фото (иначе скачиваются по data["photo_file_ids"]);
+    scale — масштаб рендера (меньше 1 — для превью шаблонов).
+    """
+    template_id = int(data.get("template_id", 1) or 1)
+    if photos is None:
+        photo_file_ids: list[str] = data.get("photo_file_ids", [])  # [main, minor1, minor2]
+        photos = await download_photos(bot, photo_file_ids, slots=["main", "minor1", "minor2"], template_id=template_id)
+    main_b, minor1_b, minor2_b = photos[0], photos[1], photos[2]
+    skip_logo = bool(data.get("skip_logo"))
+    logo_bytes = None
+    logo_file_id: str | None = None
+    if not skip_logo:
+        logo_file_id = data.get("logo_file_id") or data.get("example_logo_file_id")
+        if logo_file_id:
+            try:
+                logo_bytes = await load_logo(bot, logo_file_id)
+            except Exception:
+                # Если логотип не скачался — просто продолжаем без него.
+                logo_bytes = None
+    # Готовим характеристики и подзаголовок на основе CPU / GPU.
+    raw_specs: list[str] = list(data.get("spec_list", []))
+
+    def _extract_value(label: str) -> str:
+        for item in raw_specs:
+            low = item.lower()
+            if low.startswith(label.lower()):
+                parts = item.split("—", 1)
+                if len(parts) > 1:
+                    return parts[1].strip()
+                # Fallback: всё после двоеточия/пробела.
+                return item[len(label) :].strip()
+        return ""
+
+    cpu_val = _extract_value("cpu")
+    gpu_val = _extract_value("gpu")
+    auto_title_sub = " ".join(part for part in (gpu_val, cpu_val) if part).strip()
+
+    # Форматируем цену: убираем всё, кроме цифр, ставим пробелы по тысячам и знак ₽.
+    raw_price = str(data.get("price", "")).strip()
+    digits = "".join(ch for ch in raw_price if ch.isdigit())
+    if digits:
+        try:
+            price_int = int(digits)
+            formatted_price = f"{price_int:,}".replace(",", " ") + " ₽"
+        except ValueError:
+            formatted_price = raw_price or ""
+    else:
+        formatted_price = ""
+
+    return await build_card_from_svg(
+        main_b,
+        minor1_b,
+        minor2_b,
+        user_id,
+        logo_bytes=logo_bytes,
+        title_main=str(data.get("title_main", "")),
+        title_sub=auto_title_sub or str(data.get("title_sub", "")),
+        text_minor=str(data.get("text_minor", "")),
+        text_bottom_line1=str(data.get("text_bottom_line1", "")),
+        text_bottom_line2=str(data.get("text_bottom_line2", "")),
+        price=formatted_price,
+        specs=raw_specs,
+        template_id=template_id,
+        use_default_logo=not skip_logo,
+        embed_mode=embed_mode,
+        scale=scale,
+    )
+
+
+async def run_card_job(bot: Bot, job: CardJob) -> bool:
+    """
+    Собирает карточку и отправляет её в чат задания. Возвращает True, если карточка отправлена.
+    Пока задание выполняется, оно числится в jobs: при остановке бота его дождутся или отложат до перезапуска.
+    Входные данные и статус пишутся в журнал (data/jobs.sqlite3): после падения процесса задание досоздаётся
+    при старте, а после ошибки его можно повторить кнопкой. Стоимость генерации тоже пишется в журнал.
+    """
+    await start_job(job)
+    cost = None
+    ok = False
+    try:
+        with track_cost() as cost:
+            ok = await _run_card_job(bot, job)
+            return ok
+    finally:
+        # Уже после выхода из track_cost: в стоимость попадает и полное время генерации.
+        await finish_job(job, cost)
+        if cost is not None:
+            record_job(job.job_id, job.user_id, cost.wall, ok)
+
+
+async def reserve_render(user_id: int) -> tuple[float, tuple[float, int] | None]:
+    """
+    Списывает генерацию из квоты пользователя. Возвращает (0, квота), если можно собирать,
+    иначе (через сколько секунд появится следующая, квота) — тогда ничего не списано.
+    """
+    role = await get_role(user_id)
+    wait = take_render_quota(user_id, role)
+    if wait:
+        incr("quota_denied")
+        logger.info("Квота генерации исчерпана: пользователь %s, ждать %.0f с", user_id, wait)
+    return wait, quota_for(user_id, role)
+
+
+async def run_user_card_job(bot: Bot, job: CardJob) -> bool:
+    """
+    Генерация по кнопке «Готово»: сначала квота пользователя, потом run_reserved_card_job.
+    Сверх квоты карточка не собирается, пользователь получает сообщение, через сколько можно будет повторить.
+    Досоздание после перезапуска (resume_pending_jobs) квоту не тратит.
+    """
+    wait, quota = await reserve_render(job.user_id)
+    if wait:
+        await bot.send_message(job.chat_id, quota_message(wait, quota))
+        return False
+    return await run_reserved_card_job(bot, job)
+
+
+async def run_reserved_card_job(bot: Bot, job: CardJob) -> bool:
+    """
+    run_card_job для генерации, уже списанной из квоты (reserve_render). Если карточка не собралась
+    по нашей вине (ошибка рендера, скачивания, отправки, остановка бота), генерация возвращается в квоту;
+    отклонённые фото — нет: повтор с ними ничего не даст.
+    """
+    refund = True
+    try:
+        # Если админ включил /profile для этого пользователя — со стеками и трассировкой Chromium.
+        ok = await profiled(bot, job.user_id, job.job_id, lambda: run_card_job(bot, job))
+        refund = not ok and await _failed_retryable(job)
+        return ok
+    finally:
+        if refund:
+            refund_render_quota(job.user_id)
+
+
+async def _failed_retryable(job: CardJob) -> bool:
+    loaded = await load_job(job.job_id)
+    return loaded is not None and loaded[1] == "failed" and loaded[2]
+
+
+async def _run_card_job(bot: Bot, job: CardJob) -> bool:
+    data = job.data
+    await bot.send_message(job.chat_id, "Собираю карточку, подождите...")
+    # Один снимок конфига на всю генерацию, даже если его подменят по ходу.
+    settings = get_settings()
+    svg_path = png_path = None
+    variant_paths: list[Path] = []
+    try:
+        svg_path, png_path = await render_card(bot, data, job.user_id, embed_mode=settings.embed_images)
+
+        if settings.send_variants:
+            try:
+                # Уменьшенные копии (для Авито и превью) — из уже готового PNG, без повторного рендера.
+                variant_paths = await costed_to_thread(export_card_variants, png_path)
+            except Exception:  # noqa: BLE001
+                logger.exception("Не удалось подготовить варианты карточки")
+                variant_paths = []
+
+        await _send_card_photo(bot, job.chat_id, png_path)
+        mark_once("первая карточка")
+        if variant_paths:
+            # Все размеры одним альбомом документов, чтобы Telegram не пережимал файлы.
+            album = await asyncio.to_thread(_read_files, [png_path, *variant_paths])
+            add_cost(bytes_out=sum(len(content) for content, _ in album))
+            try:
+                captions: list[str | None] = [None] * (len(album) - 1) + ["Размеры: полный, для Авито, превью."]
+                await send_album_once(bot, job.chat_id, album, kind="document", captions=captions)
+            except TelegramAPIError:
+                # Сама карточка уже у пользователя — альбом размеров не повод сообщать об ошибке.
+                logger.exception("Не удалось отправить варианты карточки")
+        await complete_job(job)
+        return True
+    except ImageRejected as exc:
+        # Повтор с теми же фото ничего не даст — кнопку не показываем.
+        record_error("image_rejected")
+        await fail_job(job, str(exc), retryable=False)
+        await bot.send_message(job.chat_id, str(exc))
+        return False
+    except Exception as exc:  # noqa: BLE001
+        # Логируем полный traceback в stderr/journalctl,
+        # а пользователю отправляем короткое сообщение (Telegram ограничивает длину текста).
+        logger.exception("Ошибка при создании карточки")
+        record_error("render")
+        await fail_job(job, f"{type(exc).__name__}: {exc}")
+        await bot.send_message(
+            job.chat_id,
+            "Ошибка при создании карточки. Подробности смотрите в логах сервера.",
+            reply_markup=retry_job_keyboard(job.job_id),
+        )
+        return False
+    finally:
+        # Файлы карточки удаляются в любом случае — и после ошибки, и при отмене во время остановки.
+        for path in (svg_path, png_path, *variant_paths):
+            if path is not None:
+                try:
+                    path.unlink(missing_ok=True)
+                except OSError:
+                    pass
+
+
+def _read_files(paths: list[Path]) -> list[tuple[bytes, str]]:
+    return [(path.read_bytes(), path.name) for path in paths]
+
+
+async def _send_card_photo(bot: Bot, chat_id: int, png_path: Path) -> None:
+    """
+    Отправляет готовую карточку фото. Повторная карточка с тем же содержимым уходит по file_id без загрузки.
+    Повторы при 429 и сбоях сети делает SendPipeline;
+    если Telegram не принимает файл как фото (размер, пропорции), карточка уходит документом.
+    """
+    data = await asyncio.to_thread(png_path.read_bytes)
+    add_cost(bytes_out=len(data))
+    caption = "Готово. Карточка по шаблону создана."
+    try:
+        await send_photo_once(bot, chat_id, data, png_path.name, caption=caption)
+    except TelegramBadRequest as exc:
+        logger.warning("Карточка не принята как фото (%s), отправляю документом", exc)
+        await send_document_once(bot, chat_id, data, png_path.name, caption=caption)
+
+
+async def resume_pending_jobs(bot: Bot) -> None:
+    """
+    Восстановление при старте: досоздаёт карточки из журнала, которые не завершились —
+    отложенные при остановке (см. jobs.drain) и прерванные падением процесса или Chromium.
+    Задания, на которых процесс уже падал MAX_RESUME_ATTEMPTS раз, и слишком старые не перезапускаются:
+    пользователь получает сообщение с кнопкой «Повторить».
+    """
+    try:
+        await run_io(prune_finished)
+        pending = await load_pending_jobs()
+    except Exception:  # noqa: BLE001
+        logger.exception("Не удалось прочитать журнал заданий")
+        return
+    if pending:
+        logger.info("Журнал: %s незавершённых карточек", len(pending))
+    for job in pending:
+        try:
+            if job.attempts >= MAX_RESUME_ATTEMPTS or time.time() - job.created_at > RESUME_MAX_AGE:
+                await fail_job(job, "не завершено до перезапуска")
+                await bot.send_message(
+                    job.chat_id,
+                    "Карточку не удалось создать до перезапуска бота. Нажмите «Повторить», чтобы собрать её заново.",
+                    reply_markup=retry_job_keyboard(job.job_id),
+                )
+                continue
+            await bot.send_message(job.chat_id, "Бот был перезапущен — досоздаю вашу карточку.")
+            await run_card_job(bot, job)
+        except Exception:  # noqa: BLE001
+            logger.exception("Не удалось досоздать отложенную карточку %s", job.job_id)
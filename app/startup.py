@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+
+logger = logging.getLogger(__name__)
+
+# Момент старта процесса: app/__main__.py импортирует этот модуль первым, до aiogram и обработчиков.
+PROCESS_STARTED = time.perf_counter()
+# Разовые отметки («первый ответ», «первая карточка»): каждая логируется только один раз за процесс.
+_MARKS: dict[str, float] = {}
+
+
+def since_start() -> float:
+    """Секунды с момента старта процесса."""
+    return time.perf_counter() - PROCESS_STARTED
+
+
+def mark(name: str) -> None:
+    """Пишет в лог, сколько прошло от старта процесса до этапа name."""
+    logger.info("Старт: %s через %.0f мс", name, since_start() * 1000)
+
+
+def mark_once(name: str) -> None:
+    """Как mark, но только при первом вызове для данного имени (первый ответ, первая карточка и т.п.)."""
+    if name in _MARKS:
+        return
+    _MARKS[name] = since_start()
+    mark(name)
+
+
+async def first_update_middleware(
+    handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+    event: Any,
+    data: dict[str, Any],
+) -> Any:
+    """Outer-middleware на update: фиксирует время до первого обработанного апдейта после старта."""
+    try:
+        return await handler(event, data)
+    finally:
+        mark_once("первый ответ")
+
+
+def _warm_files() -> None:
+    """Синхронная часть прогрева: логотип по умолчанию, шаблоны, реестр размеров фото, шрифты и метрики шрифтов."""
+    from .logo_assets import preload_default_logo
+    from .photo_sizes import load_photo_sizes
+    from .rendering import _get_font_face_css
+    from .template_registry import refresh_templates
+    from .text_layout import BOLD_FONT, REGULAR_FONT, get_font_metrics
+
+    preload_default_logo()
+    refresh_templates()
+    load_photo_sizes()
+    _get_font_face_css()
+    get_font_metrics(REGULAR_FONT)
+    get_font_metrics(BOLD_FONT)
+
+
+async def warmup(browser: bool = True) -> None:
+    """
+    Фоновый прогрев после запуска polling: всё, что иначе делалось бы при первой карточке.
+    Ошибки только логируются — бот работает и без прогрева.
+    """
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(_warm_files)
+        if browser:
+            from .browser import get_browser
+
+            await get_browser()
+    except Exception:  # noqa: BLE001
+        logger.exception("Прогрев не завершён")
+        return
+    logger.info("Прогрев занял %.0f мс", (time.perf_counter() - started) * 1000)
+    mark("прогрев завершён")
@@ -37,4 +37,6 @@ class AdminEditStates(StatesGroup):
     waiting_for_usage = State()
     waiting_for_desc_template = State()
     waiting_for_usage_video = State()
+    # Новая квота генерации для роли или пользователя (цель — в FSM data, quota_target).
+    waiting_for_quota = State()
 
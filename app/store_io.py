@@ -0,0 +1,138 @@
+import asyncio
+import copy
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from pathlib import Path
+from typing import Any, Callable, Generic, TypeVar
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+S = TypeVar("S")
+
+# Отдельный небольшой пул для файлов хранилищ: чтение и запись JSON не ждут за уменьшением фото
+# и другой тяжёлой работой в общем пуле asyncio.to_thread, а диск не получает десятки записей сразу.
+STORE_IO_WORKERS = 4
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=STORE_IO_WORKERS, thread_name_prefix="store-io")
+# Файл -> блокировка: запись (и чтение-изменение-запись) одного файла идут строго по очереди.
+_FILE_LOCKS: dict[Path, asyncio.Lock] = {}
+# Все хранилища с отложенной записью — их дописывает flush_stores при остановке.
+_STORES: list["JsonStore[Any]"] = []
+
+
+async def run_io(func: Callable[..., T], *args: Any) -> T:
+    """Выполняет func(*args) в пуле хранилищ (с текущим контекстом, как asyncio.to_thread)."""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(copy_context().run, func, *args)
+    return await loop.run_in_executor(_EXECUTOR, call)
+
+
+def file_lock(path: Path) -> asyncio.Lock:
+    lock = _FILE_LOCKS.get(path)
+    if lock is None:
+        lock = _FILE_LOCKS[path] = asyncio.Lock()
+    return lock
+
+
+class _Replace:
+    """Операция очереди: заменить содержимое хранилища целиком."""
+
+    def __init__(self, value: Any) -> None:
+        self.value = value
+
+
+class JsonStore(Generic[S]):
+    """
+    Асинхронный доступ к JSON-хранилищу: load/save — синхронные функции модуля хранилища, они выполняются в пуле.
+    Изменения (update) и замены (write), пришедшие за один проход цикла событий, применяются пачкой:
+    один load, все изменения по порядку, один save — под блокировкой файла, так что изменения не теряются.
+    Каждое изменение применяется к копии: если mutate бросил исключение, его частичные правки отбрасываются
+    (исключение получает вызвавший), а остальные изменения пачки сохраняются.
+    Запись файла должна быть атомарной (временный файл + replace): чтение идёт без блокировки.
+    """
+
+    def __init__(self, path: Path, load: Callable[[], S], save: Callable[[S], None]) -> None:
+        self.path = path
+        self._load = load
+        self._save = save
+        self._pending: list[tuple[Any, asyncio.Future[Any]]] = []
+        self._flushes: set[asyncio.Task[None]] = set()
+        _STORES.append(self)
+
+    async def read(self) -> S:
+        return await run_io(self._load)
+
+    async def update(self, mutate: Callable[[S], T]) -> T:
+        """Применяет mutate к текущему содержимому и сохраняет; результат mutate возвращается вызывающему."""
+        return await self._enqueue(mutate)
+
+    async def write(self, value: S) -> None:
+        """Заменяет содержимое целиком; из нескольких замен за один проход на диск попадает только последняя."""
+        await self._enqueue(_Replace(value))
+
+    def _enqueue(self, op: Any) -> asyncio.Future[Any]:
+        future: asyncio.Future[Any] = asyncio.get_running_loop().create_future()
+        if not self._pending:
+            # Задача стартует на следующем проходе цикла — к этому времени соберутся все операции текущего.
+            task = asyncio.create_task(self._flush())
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+        self._pending.append((op, future))
+        return future
+
+    async def _flush(self) -> None:
+        async with file_lock(self.path):
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+            try:
+                results = await run_io(self._apply, [op for op, _ in batch])
+            except Exception as exc:  # noqa: BLE001
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                return
+        for (_, future), (ok, value) in zip(batch, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _apply(self, ops: list[Any]) -> list[tuple[bool, Any]]:
+        state = None if isinstance(ops[0], _Replace) else self._load()
+        changed = False
+        results: list[tuple[bool, Any]] = []
+        for op in ops:
+            if isinstance(op, _Replace):
+                state = op.value
+                changed = True
+                results.append((True, None))
+                continue
+            candidate = copy.deepcopy(state)
+            try:
+                results.append((True, op(candidate)))
+            except Exception as exc:  # noqa: BLE001
+                # Ошибка одного изменения (например, проверки) не отменяет остальные в пачке.
+                results.append((False, exc))
+                continue
+            state = candidate
+            changed = True
+        if changed:
+            self._save(state)
+        return results
+
+    async def drain(self) -> None:
+        while self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+
+async def flush_stores() -> None:
+    """Дожидается записи всех отложенных изменений хранилищ (при остановке бота)."""
+    for store in _STORES:
+        await store.drain()
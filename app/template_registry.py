@@ -0,0 +1,374 @@
+import asyncio
+import html
+import logging
+import re
+import threading
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .constants import FONTS_DIR, TEMPLATES_DIR
+from .text_layout import REGULAR_FONT, TextSlot
+
+
+logger = logging.getLogger(__name__)
+
+# Шаблоны карточек: app/templates/template_<id>.svg. Новый шаблон — просто новый файл в каталоге.
+TEMPLATE_FILE_RE = re.compile(r"^template_(\d+)\.svg$")
+# Как часто проверять каталог шаблонов на новые/изменённые файлы (секунды).
+TEMPLATES_WATCH_INTERVAL = 5.0
+
+XLINK_HREF = "{http://www.w3.org/1999/xlink}href"
+
+# Сетка под пользовательские характеристики: добавляется, если в шаблоне её нет (id="spec-grid").
+SVG_SPECS_GRID = """
+<g id="spec-grid">
+	<g>
+		<path class="st15" d="M56.1,468.2c132.5-0.5,281.1-0.5,413.6,0C337.2,468.8,188.6,468.8,56.1,468.2L56.1,468.2z"/>
+	</g>
+	<g>
+		<path class="st15" d="M56.1,534.2c132.5-0.5,281.1-0.5,413.6,0C337.2,534.7,188.6,534.7,56.1,534.2L56.1,534.2z"/>
+	</g>
+	<g>
+		<path class="st15" d="M56.1,600.1c132.5-0.5,281.1-0.5,413.6,0C337.2,600.6,188.6,600.6,56.1,600.1L56.1,600.1z"/>
+	</g>
+	<g>
+		<path class="st15" d="M56.1,666c132.5-0.5,281.1-0.5,413.6,0C337.2,666.6,188.6,666.6,56.1,666L56.1,666z"/>
+	</g>
+	<path class="st16" d="M174.2,423.3c0,8,0,16,0,24"/>
+	<path class="st16" d="M174.2,489.2c0,8,0,16,0,24"/>
+	<path class="st16" d="M174.2,555.1c0,8,0,16,0,24"/>
+	<path class="st16" d="M174.2,621.1c0,8,0,16,0,24"/>
+	<path class="st16" d="M174.2,687c0,8,0,16,0,24"/>
+</g>
+"""
+
+# Начальный тег элемента-слота: <image data-slot="main" ...>, <tspan data-slot="title_main" ...>.
+_SLOT_TAG_RE = re.compile(r'<(image|tspan|text)\b[^>]*?\bdata-slot="([^"]+)"[^>]*>')
+_HREF_RE = re.compile(r'xlink:href="[^"]*"')
+_CSS_RULE_RE = re.compile(r"\.([\w-]+)\s*\{([^}]*)\}")
+_MATRIX_RE = re.compile(r"matrix\(\s*([-\d.eE]+)")
+
+
+class TemplateError(ValueError):
+    """SVG-шаблон не удалось разобрать (битый XML, нет нужных слотов)."""
+
+
+@dataclass(frozen=True)
+class ImageSlot:
+    """Слот картинки: размер в пикселях карточки (width/height <image> × масштаб transform)."""
+
+    name: str
+    width: float
+    height: float
+
+    @property
+    def box(self) -> tuple[int, int]:
+        return max(1, round(self.width)), max(1, round(self.height))
+
+
+@dataclass(frozen=True)
+class _Image:
+    """Элемент <image> целиком: до значения xlink:href и после. Без картинки элемент выкидывается."""
+
+    name: str
+    before: str
+    after: str
+
+
+@dataclass(frozen=True)
+class _Text:
+    """Текстовый элемент-слот: начальный тег без «>» (туда добавляется style) и закрывающий тег."""
+
+    name: str
+    open_tag: str
+    close_tag: str
+
+
+@dataclass(frozen=True)
+class _Switch:
+    """Фрагмент, зависящий от флага (например, показ блока характеристик)."""
+
+    flag: str
+    when_true: str
+    when_false: str
+
+
+@dataclass(frozen=True)
+class CardTemplate:
+    """
+    Разобранный шаблон: текст SVG, заранее разбитый на статические куски и слоты,
+    геометрия слотов (для уменьшения фото и подбора кегля) и тексты-образцы из самого шаблона.
+    """
+
+    template_id: int
+    title: str
+    path: Path
+    mtime_ns: int
+    parts: tuple[str | _Image | _Text | _Switch, ...]
+    images: dict[str, ImageSlot]
+    texts: dict[str, TextSlot]
+    # Текст слота в файле шаблона — используется, если пользователь поле не заполнил.
+    defaults: dict[str, str]
+    # Многострочные группы (text_minor → [text_minor.1, text_minor.2, ...]).
+    groups: dict[str, tuple[str, ...]] = field(default_factory=dict)
+
+    def image_box(self, name: str, fallback: tuple[int, int] | None = None) -> tuple[int, int] | None:
+        slot = self.images.get(name)
+        return slot.box if slot is not None else fallback
+
+    def spec_rows(self) -> int:
+        return sum(1 for name in self.texts if name.startswith("spec_") and name.endswith("_left"))
+
+    def render(self, hrefs: dict[str, str | None], texts: dict[str, tuple[str, str]], flags: dict[str, bool]) -> str:
+        """
+        Собирает итоговый SVG за один проход по кускам.
+        hrefs — URL картинок (None — убрать элемент), texts — (экранированный текст, доп. атрибуты тега).
+        """
+        out: list[str] = []
+        for part in self.parts:
+            if isinstance(part, str):
+                out.append(part)
+            elif isinstance(part, _Text):
+                value, extra_attrs = texts.get(part.name, ("", ""))
+                out.append(f"{part.open_tag}{extra_attrs}>{value}{part.close_tag}")
+            elif isinstance(part, _Image):
+                href = hrefs.get(part.name)
+                if href is not None:
+                    out.append(f'{part.before}xlink:href="{html.escape(href, quote=True)}"{part.after}')
+            else:
+                out.append(part.when_true if flags.get(part.flag) else part.when_false)
+        return "".join(out)
+
+
+def _css_rules(root: ET.Element) -> dict[str, dict[str, str]]:
+    rules: dict[str, dict[str, str]] = {}
+    for style in root.iter("{http://www.w3.org/2000/svg}style"):
+        for class_name, body in _CSS_RULE_RE.findall(style.text or ""):
+            props = rules.setdefault(class_name, {})
+            for decl in body.split(";"):
+                if ":" in decl:
+                    key, value = decl.split(":", 1)
+                    props[key.strip()] = value.strip().strip("'\"")
+    return rules
+
+
+def _font_props(element: ET.Element, parents: dict[ET.Element, ET.Element], rules: dict[str, dict[str, str]]) -> dict[str, str]:
+    """CSS-свойства шрифта элемента с наследованием от родительских <text>/<g>."""
+    chain = []
+    node: ET.Element | None = element
+    while node is not None:
+        chain.append(node)
+        node = parents.get(node)
+    props: dict[str, str] = {}
+    for node in reversed(chain):
+        for class_name in (node.get("class") or "").split():
+            props.update(rules.get(class_name, {}))
+    return props
+
+
+def _font_file(family: str | None) -> str:
+    if family:
+        for ext in (".ttf", ".otf"):
+            if (FONTS_DIR / f"{family}{ext}").exists():
+                return f"{family}{ext}"
+    return REGULAR_FONT
+
+
+def _text_slot(element: ET.Element, props: dict[str, str]) -> TextSlot:
+    font_size = float(props.get("font-size", "32px").removesuffix("px"))
+    max_width = element.get("data-max-width")
+    min_size = element.get("data-min-size")
+    return TextSlot(
+        _font_file(props.get("font-family")),
+        font_size,
+        float(max_width) if max_width else 10_000.0,
+        min_font_size=float(min_size) if min_size else None,
+    )
+
+
+def _image_slot(name: str, element: ET.Element) -> ImageSlot:
+    scale = 1.0
+    match = _MATRIX_RE.search(element.get("transform") or "")
+    if match:
+        scale = float(match.group(1))
+    return ImageSlot(name, float(element.get("width") or 0) * scale, float(element.get("height") or 0) * scale)
+
+
+def _compile(text: str) -> tuple[str | _Image | _Text | _Switch, ...]:
+    """Разбивает текст шаблона на статические куски и слоты (поиск по data-slot выполняется один раз)."""
+    parts: list[str | _Image | _Text | _Switch] = []
+    pos = 0
+    for match in _SLOT_TAG_RE.finditer(text):
+        tag, name = match.group(1), match.group(2)
+        start_tag = match.group(0)
+        parts.append(text[pos : match.start()])
+        if tag == "image":
+            if start_tag.endswith("/>"):
+                end = match.end()
+            else:
+                end = text.index("</image>", match.end()) + len("</image>")
+            element = text[match.start() : end]
+            href = _HREF_RE.search(element)
+            if href is None:
+                raise TemplateError(f"У слота {name} нет xlink:href")
+            parts.append(_Image(name, element[: href.start()], element[href.end() :]))
+        else:
+            close_tag = f"</{tag}>"
+            end = text.index(close_tag, match.end())
+            if "<" in text[match.end() : end]:
+                raise TemplateError(f"Слот {name} должен содержать только текст")
+            parts.append(_Text(name, start_tag[:-1], close_tag))
+            end += len(close_tag)
+        pos = end
+    parts.append(text[pos:])
+
+    # Блок характеристик: исходные линии прячутся, а пользовательский текст показывается только при наличии данных.
+    switches = (
+        ('id="user-specs" visibility="hidden"', _Switch("specs", 'id="user-specs"', 'id="user-specs" visibility="hidden"')),
+        ('id="original-specs-paths"', _Switch("specs", 'id="original-specs-paths" visibility="hidden"', 'id="original-specs-paths"')),
+    )
+    for marker, switch in switches:
+        split: list[str | _Image | _Text | _Switch] = []
+        for part in parts:
+            if isinstance(part, str) and marker in part:
+                head, tail = part.split(marker, 1)
+                split.extend([head, switch, tail])
+            else:
+                split.append(part)
+        parts = split
+    if 'id="spec-grid"' not in text:
+        last = parts[-1]
+        if isinstance(last, str) and "</svg>" in last:
+            head, tail = last.rsplit("</svg>", 1)
+            parts[-1:] = [head, _Switch("specs", f"{SVG_SPECS_GRID}\n", ""), f"</svg>{tail}"]
+    return tuple(part for part in parts if part != "")
+
+
+def parse_template(path: Path, template_id: int) -> CardTemplate:
+    """Разбирает один файл шаблона: слоты, геометрия, шрифты, тексты-образцы."""
+    raw = path.read_bytes()
+    try:
+        text = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        # Экспорт из Illustrator на Windows иногда сохраняется в CP1251.
+        text = raw.decode("cp1251")
+    try:
+        root = ET.fromstring(text.encode("utf-8"))
+    except ET.ParseError as exc:
+        raise TemplateError(f"{path.name}: некорректный SVG ({exc})") from exc
+
+    parents = {child: parent for parent in root.iter() for child in parent}
+    rules = _css_rules(root)
+    images: dict[str, ImageSlot] = {}
+    texts: dict[str, TextSlot] = {}
+    defaults: dict[str, str] = {}
+    for element in root.iter():
+        name = element.get("data-slot")
+        if not name:
+            continue
+        if element.tag.endswith("}image"):
+            images[name] = _image_slot(name, element)
+        else:
+            texts[name] = _text_slot(element, _font_props(element, parents, rules))
+            defaults[name] = element.text or ""
+
+    groups: dict[str, list[str]] = {}
+    for name in texts:
+        if "." in name:
+            groups.setdefault(name.split(".", 1)[0], []).append(name)
+    group_slots: dict[str, tuple[str, ...]] = {}
+    for group, names in groups.items():
+        names.sort(key=lambda n: int(n.rsplit(".", 1)[1]))
+        first = texts[names[0]]
+        # Группа строк переносится как один текст: ширина и шрифт — по первой строке.
+        texts[group] = TextSlot(first.font_file, first.font_size, first.max_width, max_lines=len(names), overflow="wrap")
+        group_slots[group] = tuple(names)
+
+    if "main" not in images:
+        raise TemplateError(f"{path.name}: нет слота главного фото (data-slot=\"main\")")
+    return CardTemplate(
+        template_id=template_id,
+        title=root.get("data-title") or f"Шаблон {template_id}",
+        path=path,
+        mtime_ns=path.stat().st_mtime_ns,
+        parts=_compile(text),
+        images=images,
+        texts=texts,
+        defaults=defaults,
+        groups=group_slots,
+    )
+
+
+# id шаблона -> разобранный шаблон. Заполняется при первом обращении, дальше обновляются только изменённые файлы.
+# refresh_templates идёт в потоке (прогрев, watch_templates): собирает новый словарь и подменяет его целиком,
+# так что цикл событий никогда не видит словарь на середине обновления.
+_REGISTRY: dict[int, CardTemplate] = {}
+_LOADED = False
+_REFRESH_LOCK = threading.Lock()
+
+
+def refresh_templates() -> bool:
+    """
+    Сканирует каталог шаблонов: разбирает новые и изменённые файлы, убирает удалённые.
+    Битый файл логируется и пропускается (остаётся прежняя версия, если была). Возвращает True, если что-то изменилось.
+    """
+    global _LOADED, _REGISTRY
+    with _REFRESH_LOCK:
+        found: dict[int, Path] = {}
+        for path in TEMPLATES_DIR.glob("template_*.svg"):
+            match = TEMPLATE_FILE_RE.match(path.name)
+            if match:
+                found[int(match.group(1))] = path
+        registry = {template_id: template for template_id, template in _REGISTRY.items() if template_id in found}
+        changed = len(registry) != len(_REGISTRY)
+        for template_id, path in found.items():
+            current = registry.get(template_id)
+            try:
+                if current is not None and current.mtime_ns == path.stat().st_mtime_ns:
+                    continue
+                registry[template_id] = parse_template(path, template_id)
+                changed = True
+                logger.info("Шаблон %s загружен: %s", template_id, path.name)
+            except (OSError, TemplateError) as exc:
+                logger.error("Шаблон %s не загружен: %s", path.name, exc)
+        _REGISTRY = registry
+        _LOADED = True
+        return changed
+
+
+def _registry() -> dict[int, CardTemplate]:
+    # Обычно реестр уже загружен прогревом (startup.warmup); иначе — один раз здесь.
+    if not _LOADED:
+        refresh_templates()
+    return _REGISTRY
+
+
+def template_ids() -> list[int]:
+    return sorted(_registry())
+
+
+def get_template(template_id: int) -> CardTemplate:
+    """Шаблон по id; для неизвестного id — первый доступный (как раньше — шаблон 1)."""
+    registry = _registry()
+    template = registry.get(int(template_id))
+    if template is None:
+        if not registry:
+            raise FileNotFoundError(f"В {TEMPLATES_DIR} нет ни одного шаблона template_<id>.svg")
+        template = registry[min(registry)]
+    return template
+
+
+def template_titles() -> dict[int, str]:
+    return {template_id: template.title for template_id, template in sorted(_registry().items())}
+
+
+async def watch_templates(interval: float = TEMPLATES_WATCH_INTERVAL) -> None:
+    """Фоновая задача: подхватывает новые и изменённые файлы шаблонов без перезапуска бота."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # stat всех файлов и разбор изменённых SVG — не в цикле событий.
+            await asyncio.to_thread(refresh_templates)
+        except Exception:  # noqa: BLE001
+            logger.exception("Ошибка при проверке каталога шаблонов")
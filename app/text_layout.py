@@ -0,0 +1,172 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+from PIL import ImageFont
+
+from .constants import FONTS_DIR
+
+
+# Метрики читаются в единицах «на 1000 px кегля», затем масштабируются под нужный размер шрифта.
+UNITS_PER_EM = 1000
+# Символы, ширины которых считаются сразу при загрузке шрифта (остальные — при первой встрече).
+_PRELOAD_CHARS = (
+    " !\"#$%&'()*+,-./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\\]^_`abcdefghijklmnopqrstuvwxyz{|}~"
+    "АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯабвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+    "—–«»…₽№°\""
+)
+
+
+class FontMetrics:
+    """Ширины глифов одного TTF-шрифта: загружаются один раз, дальше измерение строки — сумма из словаря."""
+
+    def __init__(self, path: Path) -> None:
+        self._font = ImageFont.truetype(str(path), UNITS_PER_EM)
+        self._advances: dict[str, float] = {ch: self._font.getlength(ch) for ch in _PRELOAD_CHARS}
+
+    def advance(self, ch: str) -> float:
+        width = self._advances.get(ch)
+        if width is None:
+            width = self._font.getlength(ch)
+            self._advances[ch] = width
+        return width
+
+    def measure(self, text: str, font_size: float) -> float:
+        """Ширина строки в px при данном кегле (без кернинга — для подбора размеров этого достаточно)."""
+        return sum(self.advance(ch) for ch in text) * font_size / UNITS_PER_EM
+
+
+@lru_cache(maxsize=None)
+def get_font_metrics(font_file: str) -> FontMetrics:
+    return FontMetrics(FONTS_DIR / font_file)
+
+
+@dataclass(frozen=True)
+class TextSlot:
+    """
+    Текстовый слот шаблона.
+    overflow: "shrink" — уменьшать кегль до min_font_size, затем многоточие;
+              "wrap" — переносить по словам (длинные слова — с дефисом) до max_lines, затем многоточие.
+    """
+
+    font_file: str
+    font_size: float
+    max_width: float
+    max_lines: int = 1
+    min_font_size: float | None = None
+    overflow: str = "shrink"
+
+
+REGULAR_FONT = "MuseoSansVkusVill-100Italic.ttf"
+BOLD_FONT = "MuseoSansVkusVill-900.ttf"
+
+# Слоты по умолчанию (координаты viewBox 0 0 1921 1081). Конкретные шаблоны задают свои слоты атрибутами
+# data-slot/data-max-width/data-min-size — см. template_registry; эти нужны для проверок до выбора шаблона.
+TEXT_SLOTS: dict[str, TextSlot] = {
+    "title_main": TextSlot(BOLD_FONT, 74, 580, min_font_size=44),
+    "title_sub": TextSlot(BOLD_FONT, 33, 555, min_font_size=24),
+    "text_minor": TextSlot(REGULAR_FONT, 32, 800, max_lines=3, overflow="wrap"),
+    "text_bottom": TextSlot(REGULAR_FONT, 32, 420, min_font_size=24),
+    "price": TextSlot(BOLD_FONT, 84, 425, min_font_size=48),
+    "spec_left": TextSlot(REGULAR_FONT, 33, 110, min_font_size=22),
+    "spec_right": TextSlot(REGULAR_FONT, 33, 285, min_font_size=22),
+}
+
+ELLIPSIS = "…"
+
+
+@dataclass(frozen=True)
+class TextLayout:
+    lines: list[str]
+    font_size: float
+    truncated: bool = False
+
+
+def _with_ellipsis(metrics: FontMetrics, text: str, font_size: float, max_width: float) -> str:
+    """Обрезает строку так, чтобы вместе с многоточием она поместилась в max_width."""
+    budget = max_width - metrics.measure(ELLIPSIS, font_size)
+    width = 0.0
+    for idx, ch in enumerate(text):
+        width += metrics.advance(ch) * font_size / UNITS_PER_EM
+        if width > budget:
+            text = text[:idx]
+            break
+    return text.rstrip(" ,.;:-") + ELLIPSIS
+
+
+def _ellipsize(metrics: FontMetrics, text: str, font_size: float, max_width: float) -> str:
+    if metrics.measure(text, font_size) <= max_width:
+        return text
+    return _with_ellipsis(metrics, text, font_size, max_width)
+
+
+def _split_word(metrics: FontMetrics, word: str, font_size: float, max_width: float) -> tuple[str, str]:
+    """Разбивает слишком длинное слово: часть с дефисом, которая помещается, и остаток."""
+    budget = max_width - metrics.measure("-", font_size)
+    width = 0.0
+    for idx, ch in enumerate(word):
+        width += metrics.advance(ch) * font_size / UNITS_PER_EM
+        if width > budget:
+            cut = max(idx, 1)
+            return word[:cut] + "-", word[cut:]
+    return word, ""
+
+
+def wrap_text(metrics: FontMetrics, text: str, font_size: float, max_width: float) -> list[str]:
+    """Переносит текст по словам по реальной ширине глифов; слова шире строки переносятся с дефисом."""
+    lines: list[str] = []
+    current = ""
+    for word in text.split():
+        candidate = word if not current else f"{current} {word}"
+        if metrics.measure(candidate, font_size) <= max_width:
+            current = candidate
+            continue
+        if current:
+            lines.append(current)
+            current = ""
+        while metrics.measure(word, font_size) > max_width:
+            head, word = _split_word(metrics, word, font_size, max_width)
+            lines.append(head)
+        current = word
+    if current:
+        lines.append(current)
+    return lines
+
+
+def layout_text(slot_name: str | TextSlot, text: str) -> TextLayout:
+    """
+    Раскладывает текст в слот шаблона: подбирает кегль, переносы и при необходимости ставит многоточие.
+    slot_name — имя из TEXT_SLOTS или готовый слот конкретного шаблона.
+    """
+    slot = slot_name if isinstance(slot_name, TextSlot) else TEXT_SLOTS[slot_name]
+    metrics = get_font_metrics(slot.font_file)
+    src = " ".join((text or "").split())
+    if not src:
+        return TextLayout([], slot.font_size)
+
+    if slot.overflow == "wrap":
+        # Явные переносы строк пользователя сохраняем: каждый абзац переносится отдельно.
+        lines: list[str] = []
+        for paragraph in (text or "").replace("\r", "\n").split("\n"):
+            if paragraph.strip():
+                lines.extend(wrap_text(metrics, " ".join(paragraph.split()), slot.font_size, slot.max_width))
+        if len(lines) <= slot.max_lines:
+            return TextLayout(lines, slot.font_size)
+        kept = lines[: slot.max_lines]
+        kept[-1] = _with_ellipsis(metrics, kept[-1].removesuffix("-"), slot.font_size, slot.max_width)
+        return TextLayout(kept, slot.font_size, truncated=True)
+
+    natural = metrics.measure(src, slot.font_size)
+    if natural <= slot.max_width:
+        return TextLayout([src], slot.font_size)
+    min_size = slot.min_font_size or slot.font_size
+    fitted = slot.font_size * slot.max_width / natural
+    if fitted >= min_size:
+        # Округляем вниз до 0.5 px, чтобы строка гарантированно поместилась.
+        return TextLayout([src], int(fitted * 2) / 2)
+    return TextLayout([_ellipsize(metrics, src, min_size, slot.max_width)], min_size, truncated=True)
+
+
+def fits(slot_name: str | TextSlot, text: str) -> bool:
+    """True, если текст помещается в слот без многоточия (можно заранее предупредить пользователя)."""
+    return not layout_text(slot_name, text).truncated
@@ -2,6 +2,8 @@ from typing import Any
 
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
+from .template_registry import template_titles
+
 
 def main_menu_keyboard(role: str = "user") -> InlineKeyboardMarkup:
     rows: list[list[InlineKeyboardButton]] = [
@@ -16,12 +18,21 @@ def main_menu_keyboard(role: str = "user") -> InlineKeyboardMarkup:
     ]
     if role in {"admin", "root_admin"}:
         rows.append([InlineKeyboardButton(text="✏️ Изменить данные", callback_data="admin_edit_data")])
+        rows.append([InlineKeyboardButton(text="📈 Состояние бота", callback_data="admin_metrics")])
     if role == "root_admin":
         rows.append([InlineKeyboardButton(text="👤 Управление пользователями", callback_data="root_admin_users")])
         rows.append([InlineKeyboardButton(text="🔗 Инвайт-ссылки", callback_data="root_admin_invites")])
+        rows.append([InlineKeyboardButton(text="⏱ Квоты и расход", callback_data="root_admin_quotas")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
+def retry_job_keyboard(job_id: str) -> InlineKeyboardMarkup:
+    """Кнопка повтора генерации карточки из журнала заданий (после ошибки или падения бота)."""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[InlineKeyboardButton(text="🔁 Повторить", callback_data=f"job_retry:{job_id}")]]
+    )
+
+
 def cancel_keyboard(
     extra_buttons: list[list[InlineKeyboardButton]] | None = None,
     default_callback: str | None = None,
@@ -48,12 +59,13 @@ def examples_menu_keyboard() -> InlineKeyboardMarkup:
 
 
 def template_select_keyboard(prefix: str = "card_tpl") -> InlineKeyboardMarkup:
-    """Клавиатура выбора варианта SVG-шаблона (K&B, МНСГ, Паша)."""
+    """Клавиатура выбора варианта SVG-шаблона: по кнопке на каждый файл templates/template_<id>.svg."""
     return InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="K&B", callback_data=f"{prefix}:1")],
-            [InlineKeyboardButton(text="МНСГ", callback_data=f"{prefix}:2")],
-            [InlineKeyboardButton(text="Паша", callback_data=f"{prefix}:3")],
+            *[
+                [InlineKeyboardButton(text=title, callback_data=f"{prefix}:{template_id}")]
+                for template_id, title in template_titles().items()
+            ],
             [InlineKeyboardButton(text="⬅️ Назад", callback_data="cancel")],
         ]
     )